@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g
 import os
 from dotenv import load_dotenv
 
@@ -6,34 +6,121 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import firebase_admin
-from firebase_admin import credentials, auth, firestore, storage
+from firebase_admin import credentials, auth, firestore
 from werkzeug.utils import secure_filename
-from modules.utils import generate_filename, allowed_file, extract_text
-from modules.summary import generate_summary
-from modules.questions import generate_questions
+from werkzeug.exceptions import RequestEntityTooLarge
+from modules.utils import generate_filename, allowed_file
+from modules.summary import (generate_summary, stream_summary, generate_summary_mapreduce,
+                             stream_summary_mapreduce, needs_map_reduce, is_valid_summary)
+from modules.questions import generate_questions, stream_questions, is_valid_question_set
+from modules.search_index import SearchIndex
+from modules.fulltext import FullTextIndex
+from modules.semantic_index import SemanticIndex, default_query
+from modules.notes import (fetch_notes, fetch_saved_page, fetch_uploads_page, project_note,
+                           parse_limit, encode_cursor, decode_cursor, LIST_FIELDS)
+from modules.saved_notes import SavedNoteIndex
+from modules.text_cache import TextCache, hash_file
+from modules.extraction import ExtractionPipeline, PENDING, FAILED
+from modules.moderation import ModerationPipeline, PENDING_REVIEW, MANUAL_REVIEW
+from modules.safety import APPROVED, REJECTED
+from modules.result_cache import ResultCache, make_key, text_hash
+from modules.gemini_gateway import gateway, is_rate_limit_error
+from modules.streaming import sse_event
+from modules.jobs import JobManager, JobQueueFull
+from modules.user_cache import UserProfileCache
+from modules.view_stats import write_views, record_upload, get_user_stats, rebuild_user_stats
+from modules.view_buffer import ViewBuffer
+from modules.file_server import FileServer
+from modules.upload_store import BlobStore, request_class
+from modules.storage import LocalStorage, ObjectStorage, is_blob_name
+from modules.model_registry import registry as model_registry
+from modules.metrics import metrics, HTTP_LATENCY
+from modules.datastore import Datastore, read_budget
+from modules.firestore_fake import FakeFirestore
+from modules.logs import configure_logging
 import datetime
+import functools
+import hmac
+import math
+import atexit
+import logging
+import time
+import sqlite3
+import threading
 import requests
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
 
+configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
+logger = logging.getLogger(__name__)
+
+# Counters and histograms served at /metrics; when off, recording is a no-op
+metrics.enabled = app.config['METRICS_ENABLED']
+
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Extracted text lives on disk, notes only keep its content hash
+text_cache = TextCache(app.config['TEXT_CACHE_FOLDER'], app.config['TEXT_CACHE_MAX_BYTES'])
+
+# Gemini results, keyed by note text and generation parameters
+result_cache = ResultCache(app.config['RESULT_CACHE_PATH'], app.config['RESULT_CACHE_TTL_SECONDS'],
+                           app.config['RESULT_CACHE_MAX_BYTES'])
+
+# Gemini generations run as background jobs with per-operation concurrency caps
+jobs = JobManager(app.config['JOBS_PATH'], {'summary': app.config['SUMMARY_JOB_WORKERS'],
+                                            'questions': app.config['QUESTIONS_JOB_WORKERS']},
+                  app.config['JOB_MAX_QUEUED'])
+
+# Profiles are read on every page render, so keep them briefly in memory
+user_cache = UserProfileCache(app.config['USER_CACHE_TTL_SECONDS'])
+
+# Saved-note IDs per user, so "is saved" flags are set lookups
+saved_index = SavedNoteIndex(app.config['USER_CACHE_TTL_SECONDS'])
+
+# Uploaded files: on local disk, or in an object store shared by every instance
+if app.config['STORAGE_BACKEND'] == 's3':
+    upload_storage = ObjectStorage(app.config['STORAGE_BUCKET'], app.config['OBJECT_CACHE_FOLDER'],
+                                   app.config['OBJECT_CACHE_MAX_BYTES'], app.config['STORAGE_PREFIX'],
+                                   app.config['STORAGE_ENDPOINT_URL'], app.config['STORAGE_REGION'],
+                                   app.config['STORAGE_PART_SIZE'])
+else:
+    upload_storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+
+# Uploads are streamed to disk while hashed, size-capped and stored once per content
+blob_store = BlobStore(upload_storage, app.config['UPLOAD_INDEX_PATH'], app.config['UPLOAD_MAX_BYTES'],
+                       legacy_folder=app.config['UPLOAD_FOLDER'])
+app.request_class = request_class(blob_store)
+
+# Profile files kept per user, as '<type>Url' fields
+PROFILE_FILE_TYPES = ('pfp', 'timetable', 'syllabus')
+
+# /uploads responses: content-hash ETags, byte ranges, optional proxy offload
+file_server = FileServer(upload_storage, app.config['UPLOAD_SERVE_MODE'],
+                         app.config['UPLOAD_ACCEL_PREFIX'])
+
 # Context processor to make user info available globally
 @app.context_processor
 def inject_user():
     if 'user' in session:
         uid = session['user']
         if db:
-            user_doc = db.collection('users').document(uid).get()
-            if user_doc.exists:
-                return {'current_user': user_doc.to_dict()}
+            profile = user_cache.get(db, uid)
+            if profile is not None:
+                return {'current_user': profile}
     return {'current_user': None}
 
 # Initialize Firebase Admin
 cred_path = app.config['FIREBASE_CREDENTIALS_PATH']
-if os.path.exists(cred_path):
+if __name__ == '__mp_main__':
+    # An extraction worker ('spawn') re-running this script under `python app.py`: it only
+    # needs modules.extraction, and with no database no index build or background thread starts
+    db = None
+elif app.config['FIRESTORE_BACKEND'] == 'memory':
+    # Everything in process memory: for tests and read measurements (auth still needs Firebase)
+    db = FakeFirestore()
+elif os.path.exists(cred_path):
     cred = credentials.Certificate(cred_path)
     # Check if app is already initialized to avoid errors
     if not firebase_admin._apps:
@@ -41,7 +128,6 @@ if os.path.exists(cred_path):
             'storageBucket': 'notestack-d14e7.appspot.com'
         })
     db = firestore.client()
-    bucket = storage.bucket() if firebase_admin._apps else None
 elif os.environ.get('FIREBASE_CREDENTIALS_JSON'):
     # Fallback for Render/Production using Environment Variable
     import json
@@ -52,11 +138,163 @@ elif os.environ.get('FIREBASE_CREDENTIALS_JSON'):
             'storageBucket': 'notestack-d14e7.appspot.com'
         })
     db = firestore.client()
-    bucket = storage.bucket() if firebase_admin._apps else None
 else:
-    print(f"Warning: Firebase credentials not found at {cred_path} and FIREBASE_CREDENTIALS_JSON not set.")
+    logger.warning("Firebase credentials not found at %s and FIREBASE_CREDENTIALS_JSON not set.", cred_path)
     db = None
-    bucket = None
+
+if db:
+    # Every Firestore read and write goes through the data-access layer, which counts them per
+    # request and flags N+1 gets and blown read budgets
+    db = Datastore(db, app.config['FIRESTORE_READ_BUDGET'], app.config['FIRESTORE_N_PLUS_ONE_GETS'],
+                   app.config['FIRESTORE_STRICT'])
+
+# In-memory index used by /api/search_notes
+search_index = SearchIndex()
+
+# On-disk BM25 index over note text; catches up with every search index build
+try:
+    fulltext_index = FullTextIndex(app.config['FULLTEXT_INDEX_PATH'])
+    search_index.add_listener(lambda notes: threading.Thread(
+        target=fulltext_index.sync, args=(notes, text_cache.get), daemon=True).start())
+except sqlite3.OperationalError as e:
+    # e.g. SQLite built without FTS5: search falls back to metadata only
+    logger.warning("Full-text search disabled: %s", e)
+    fulltext_index = None
+
+# Passage vectors used to pick relevant context for the AI generators
+semantic_index = SemanticIndex(app.config['SEMANTIC_INDEX_FOLDER'])
+search_index.add_listener(lambda notes: threading.Thread(
+    target=semantic_index.sync, args=(notes, text_cache.get), daemon=True).start())
+
+if db:
+    try:
+        search_index.build(db)
+    except Exception as e:
+        logger.error("Search index build error: %s", e)
+
+# Text extraction runs in worker processes right after upload
+extraction_pipeline = ExtractionPipeline(db, text_cache, app.config['EXTRACTION_WORKERS'],
+                                         app.config['EXTRACTION_PAGE_WORKERS'])
+
+def index_note_text(note_id, text_hash):
+    """Puts a note's extracted text into the full-text and semantic indexes"""
+    text = text_cache.get(text_hash)
+    if text is None:
+        return
+    if fulltext_index is not None:
+        fulltext_index.set_text(note_id, text_hash, text)
+    semantic_index.add_note(note_id, text_hash, text)
+
+extraction_pipeline.add_listener(index_note_text)
+
+# Uploads are moderated once extracted; only approved notes become searchable
+moderation = ModerationPipeline(db, text_cache, result_cache, app.config['MODERATION_WORKERS'],
+                                retry_seconds=app.config['MODERATION_RETRY_SECONDS'],
+                                retry_max_seconds=app.config['MODERATION_RETRY_MAX_SECONDS'])
+
+def publish_note(note_id, status, note):
+    """Adds an approved note to the search indexes, or takes a rejected one out"""
+    if status == 'approved':
+        search_index.add(note_id, note)
+        if fulltext_index is not None:
+            text_hash = note.get('textHash')
+            fulltext_index.index_note(note_id, note, text_cache.get(text_hash) if text_hash else None, text_hash)
+    else:
+        search_index.remove(note_id)
+        if fulltext_index is not None:
+            fulltext_index.remove(note_id)
+        semantic_index.remove_note(note_id)
+
+moderation.add_listener(publish_note)
+extraction_pipeline.add_listener(moderation.submit)
+extraction_pipeline.add_failure_listener(lambda note_id, error: moderation.submit(note_id, None))
+
+def requeue_moderation():
+    """
+    Queues notes left pending (e.g. by a restart or an unavailable model):
+    moderated now if their text is cached, otherwise extracted first. Notes
+    held for manual review wait for /admin/moderate_note instead.
+    """
+    queued = 0
+    for doc in db.notes(status=PENDING_REVIEW):
+        note = doc.to_dict()
+        if (note.get('moderation') or {}).get('stage') == MANUAL_REVIEW:
+            continue
+        text_hash = note.get('textHash')
+        if text_hash and text_cache.get(text_hash) is not None:
+            moderation.submit(doc.id, text_hash)
+        elif note.get('extraction') == FAILED:
+            moderation.submit(doc.id, None)
+        elif note.get('filename') and upload_storage.exists(note['filename']):
+            extraction_pipeline.submit(doc.id, upload_storage.local_path(note['filename']))
+        else:
+            continue
+        queued += 1
+    return queued
+
+if db:
+    threading.Thread(target=requeue_moderation, daemon=True).start()
+    moderation.start()
+
+# Views are acknowledged right away and written to Firestore in batches
+view_buffer = ViewBuffer(lambda views: write_views(db, views), app.config['VIEW_BUFFER_MAX_SIZE'],
+                         app.config['VIEW_BUFFER_FLUSH_SECONDS'], app.config['VIEW_DEDUPE_SECONDS'])
+if db:
+    view_buffer.start()
+    atexit.register(view_buffer.stop)
+
+@app.before_request
+def start_request_accounting():
+    g.request_start = time.perf_counter()
+    if db:
+        db.begin_request()
+
+@app.after_request
+def finish_request_accounting(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method,
+                             status=response.status_code)
+        if db:
+            db.end_request(route, app.view_functions.get(request.endpoint))
+    return response
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    return header[len('Bearer '):] if header.startswith('Bearer ') else None
+
+def is_admin_request():
+    """True if the bearer token is ADMIN_TOKEN or a verified Firebase ID token with the 'admin' claim"""
+    token = bearer_token()
+    if not token:
+        return False
+    admin_token = app.config['ADMIN_TOKEN']
+    if admin_token and hmac.compare_digest(token, admin_token):
+        return True
+    try:
+        return auth.verify_id_token(token).get('admin') is True
+    except Exception:
+        return False
+
+def admin_required(view):
+    """Route decorator answering 403 to requests that are not from an admin"""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+if metrics.enabled:
+    @app.route('/metrics')
+    def prometheus_metrics():
+        # Served only to a scraper holding METRICS_TOKEN (or an admin); with no token set, to admins only
+        token = app.config['METRICS_TOKEN']
+        scraper = bool(token) and hmac.compare_digest(bearer_token() or '', token)
+        if not scraper and not is_admin_request():
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def landing():
@@ -64,8 +302,19 @@ def landing():
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    from flask import send_from_directory
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return file_server.send(filename)
+
+@app.route('/api/uploads/stats')
+@admin_required
+def api_uploads_stats():
+    stats = file_server.stats()
+    stats['store'] = blob_store.stats()
+    return jsonify(stats)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit_mb = app.config['UPLOAD_MAX_BYTES'] // (1024 * 1024)
+    return jsonify({'error': f'File is too large. The limit is {limit_mb} MB.'}), 413
 
 @app.route('/upload')
 def upload():
@@ -93,11 +342,11 @@ def upload_file():
     
     try:
         if db:
-            user_doc = db.collection('users').document(uid).get()
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
+            profile = user_cache.get(db, uid)
+            if profile is not None:
+                user_data = profile
                 enrollment_id = user_data.get('enrollmentId', 'Unknown')
-                print(f"User found: {user_data.get('name')} ({enrollment_id})")
+                logger.debug("User found: %s (%s)", user_data.get('name'), enrollment_id)
             else:
                 # Fallback: Get email from Firebase Auth
                 try:
@@ -107,13 +356,13 @@ def upload_file():
                         'email': user_record.email
                     }
                     enrollment_id = 'NotSet'
-                    print(f"User profile not in Firestore, using email: {user_record.email}")
+                    logger.info("User profile not in Firestore, using email: %s", user_record.email)
                 except Exception as auth_err:
-                    print(f"Could not get user from Auth: {auth_err}")
+                    logger.warning("Could not get user from Auth: %s", auth_err)
         else:
             return jsonify({'error': 'Database not initialized'}), 500
     except Exception as e:
-        print(f"Error fetching user: {e}")
+        logger.error("Error fetching user: %s", e)
 
     if file and allowed_file(file.filename):
         subject_name = request.form.get('subjectName')
@@ -123,36 +372,58 @@ def upload_file():
         if not subject_name or not department:
             return jsonify({'error': 'Subject Name and Department are required'}), 400
         
+        doc_ref = db.note_ref()
+        owner = f"note:{doc_ref.id}"
         try:
-            # 1. Rename and save locally
-            new_filename = generate_filename(subject_name, department, enrollment_id)
-            local_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-            file.save(local_path)
-            print(f"File saved locally: {local_path}")
+            # 1. Store the bytes once per content (already hashed while streaming in).
+            # The readable name no longer decides where the file lives, so a
+            # re-upload with the same subject/department/enrollment can't overwrite it.
+            display_name = generate_filename(subject_name, department, enrollment_id)
+            ext = file.filename.rsplit('.', 1)[1].lower()
+            new_filename, content_hash = blob_store.ingest(file, ext, owner)
+            local_path = upload_storage.local_path(new_filename)
+            logger.info("File stored as %s (%s)", new_filename, display_name)
             
-            # 2. Use local file URL
-            file_url = f"/uploads/{new_filename}"
+            # 2. Use local file URL, versioned by content so browsers can cache it for good
+            file_url = file_server.versioned_url(new_filename, content_hash)
             
             # 3. Save metadata to Firestore
-            doc_ref = db.collection('notes').document()
-            doc_ref.set({
+            note_data = {
                 'subjectName': subject_name,
                 'department': department,
                 'type': file_type,
                 'uploaderId': uid,
                 'uploaderName': user_data.get('name', 'User'),
                 'filename': new_filename,
+                'displayName': display_name,
+                'contentHash': content_hash,
                 'fileUrl': file_url,
                 'timestamp': datetime.datetime.now(),
-                'status': 'approved'
-            })
-            print(f"Metadata saved to Firestore for: {new_filename}")
+                # Becomes 'approved' or 'rejected' once moderated in the background
+                'status': PENDING_REVIEW,
+                'extraction': PENDING,
+                'extractionStartedAt': datetime.datetime.now(datetime.timezone.utc)
+            }
+            doc_ref.set(note_data)
+            logger.debug("Metadata saved to Firestore for: %s", new_filename)
+
+            # 4. Extract text in the background so AI requests don't pay for it
+            try:
+                extraction_pipeline.submit(doc_ref.id, local_path, mark_pending=False)
+            except Exception as e:
+                # Not fatal: the note is queued again on its first AI request
+                logger.warning("Could not queue extraction for %s: %s", new_filename, e)
+
+            # 5. It becomes searchable once moderation (after extraction) approves it
+            record_upload(db, uid)
             
-            return jsonify({'message': 'File uploaded successfully!'}), 200
+            return jsonify({'message': 'File uploaded successfully! It will appear in search once reviewed.'}), 200
+        except RequestEntityTooLarge:
+            raise
         except Exception as e:
-            print(f"Upload error: {str(e)}")
-            if os.path.exists(local_path):
-                os.remove(local_path)
+            logger.exception("Upload error")
+            # Deletes the stored file unless another note has the same content
+            blob_store.release(owner)
             return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
     return jsonify({'error': 'Invalid file type'}), 400
@@ -166,69 +437,215 @@ def ai_assist():
     
     uid = session['user']
     try:
-        # Get saved notes for this user
-        saved_refs = db.collection('saved_notes').where('userId', '==', uid).stream()
-        saved_note_ids = [doc.to_dict().get('noteId') for doc in saved_refs]
-        
-        notes_list = []
-        if saved_note_ids:
-            # Firestore 'in' query supports up to 30 items
-            # For simplicity, we fetch all notes and filter, or batch if needed
-            # Here we just fetch the saved ones individually for accuracy if list is small
-            for note_id in saved_note_ids:
-                note_doc = db.collection('notes').document(note_id).get()
-                if note_doc.exists:
-                    note = note_doc.to_dict()
-                    note['id'] = note_doc.id
-                    notes_list.append(note)
+        # Get saved notes for this user (batched, in saved order)
+        notes_list = fetch_notes(db, saved_index.note_ids(db, uid), field_paths=LIST_FIELDS)
         
         return render_template('ai_assist.html', notes=notes_list)
     except Exception as e:
-        print(f"AI Assist fetch error: {e}")
+        logger.error("AI Assist fetch error: %s", e)
         return render_template('ai_assist.html', notes=[])
 
+def resolve_note_text(note_ref, note_data):
+    """
+    Returns (text, status) for a note without extracting inline.
+    Text comes from the on-disk cache via the note's 'textHash' pointer; legacy
+    notes that still carry 'extractedText' are migrated to the pointer. If no
+    text is available yet the note is queued for background extraction and
+    status is 'pending'.
+    """
+    text_hash = note_data.get('textHash')
+    if text_hash:
+        text = text_cache.get(text_hash)
+        if text is not None:
+            return text, 'done'
+
+    filename = note_data.get('filename')
+    file_exists = bool(filename) and upload_storage.exists(filename)
+
+    legacy_text = note_data.get('extractedText')
+    if legacy_text:
+        if file_exists:
+            # Keep the note document small: store a pointer, not the text
+            key = note_data.get('contentHash') or hash_file(upload_storage.local_path(filename))
+            text_cache.put(key, legacy_text)
+            note_ref.update({'textHash': key, 'extraction': 'done', 'extractedText': firestore.DELETE_FIELD})
+            index_note_text(note_ref.id, key)
+        return legacy_text, 'done'
+
+    if not file_exists:
+        logger.warning("File NOT found for note %s: %s", note_ref.id, filename)
+        return '', 'missing'
+
+    status = note_data.get('extraction')
+    if status == FAILED:
+        return '', FAILED
+    if status == PENDING:
+        started = note_data.get('extractionStartedAt')
+        age = None
+        if started:
+            if started.tzinfo is None:
+                started = started.replace(tzinfo=datetime.timezone.utc)
+            age = (datetime.datetime.now(datetime.timezone.utc) - started).total_seconds()
+        if extraction_pipeline.is_in_flight(note_ref.id) or (age is not None and age < app.config['EXTRACTION_STALE_SECONDS']):
+            return None, PENDING
+
+    # Never extracted, evicted from the cache, or a stale job: queue it again
+    extraction_pipeline.submit(note_ref.id, upload_storage.local_path(filename))
+    return None, PENDING
+
+def note_text_error(status):
+    """
+    Builds the JSON response for a note whose text is not available.
+    """
+    if status == PENDING:
+        return jsonify({'status': 'processing', 'message': 'This note is still being processed. Please try again in a few seconds.'}), 202
+    if status == FAILED:
+        return jsonify({'error': 'Text could not be extracted from this note.'}), 422
+    return jsonify({'error': 'No text content available or extracted for this note.'}), 400
+
+def focused_text(note_id, note_data, text, data, replace_long=True):
+    """
+    Text to generate from. A 'topic' in the request, or 'useLibrary' (which
+    widens the pool to all of the user's saved notes), selects the passages
+    most relevant to the topic instead of the note as a whole. With
+    replace_long, notes longer than one prompt are also narrowed this way
+    (around their subject) rather than truncated.
+    """
+    topic = (data.get('topic') or '').strip()
+    use_library = bool(data.get('useLibrary')) and 'user' in session
+    max_chars = app.config['RETRIEVAL_MAX_CHARS']
+    if not topic and not use_library and not (replace_long and len(text) > max_chars):
+        return text
+
+    try:
+        if note_data.get('textHash'):
+            # No-op if already indexed at extraction time
+            semantic_index.add_note(note_id, note_data['textHash'], text)
+        note_ids = [note_id]
+        if use_library:
+            note_ids += [n for n in saved_index.note_ids(db, session['user']) if n != note_id]
+        context = semantic_index.relevant_text(topic or default_query(note_data), note_ids,
+                                               max_chars, text_cache.get)
+    except Exception as e:
+        logger.warning("Passage retrieval failed for note %s: %s", note_id, e)
+        return text
+    return context or text
+
+# Cache keys leave the model out: whichever model of the fallback chain answered, its
+# result is reused until it expires
+def summary_cache_key(text):
+    if needs_map_reduce(text):
+        return make_key(text=text_hash(text), operation='summary', strategy='mapreduce')
+    return make_key(text=text_hash(text), operation='summary')
+
+def summarize(text):
+    """
+    Summarizes a note, chunk by chunk when it is too long for one prompt.
+    """
+    if needs_map_reduce(text):
+        return generate_summary_mapreduce(text, result_cache, app.config['SUMMARY_MAX_WORKERS'],
+                                          app.config['SUMMARY_MAX_CHUNKS'])
+    return generate_summary(text)
+
+def stream_summarize(text):
+    if needs_map_reduce(text):
+        return stream_summary_mapreduce(text, result_cache, app.config['SUMMARY_MAX_WORKERS'],
+                                        app.config['SUMMARY_MAX_CHUNKS'])
+    return stream_summary(text)
+
+def num_questions_arg(data):
+    """The request's numQuestions as an int, or None if it is not a number"""
+    try:
+        return int(data.get('numQuestions', 1))
+    except (TypeError, ValueError):
+        return None
+
+def questions_cache_key(text, mode, marks, num_questions):
+    return make_key(text=text_hash(text), operation='questions', mode=mode,
+                    marks=str(marks) if marks else None, numQuestions=num_questions)
+
+def ai_error_message(e):
+    if is_rate_limit_error(e):
+        return "AI Limit Reached: You've hit Google's free tier limit. Please wait 1 minute before trying again."
+    return f'AI generation failed: {str(e)}'
+
+def start_job(operation, cache_key, compute, bypass, should_store):
+    """
+    Answers a generation request without waiting for Gemini: a cached result
+    is returned as is (200), anything else is queued as a job (202) whose
+    result is polled from /api/jobs/<id>. Identical requests in flight share
+    one job.
+    """
+    if not bypass:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached)
+
+    def run():
+        try:
+            result = compute()
+        except Exception as e:
+            logger.error("%s job error: %s", operation, e)
+            raise RuntimeError(ai_error_message(e)) from e
+        if should_store(result):
+            result_cache.set(cache_key, result)
+        return result
+
+    try:
+        job_id = jobs.submit(operation, cache_key, run)
+    except JobQueueFull:
+        return jsonify({'error': 'The AI tools are busy right now. Please try again in a minute.'}), 503, {'Retry-After': '30'}
+    return jsonify({'status': 'queued', 'jobId': job_id, 'statusUrl': url_for('api_job', job_id=job_id)}), 202
+
+def sse_response(cache_key, start_stream, bypass, should_store):
+    """
+    Streams a generation as Server-Sent Events: 'field' and 'item' events as
+    parts of the JSON complete ('progress' for map-reduce summaries), then
+    'done' with the full result (or 'error').
+    A cached result is sent as a single 'done' event.
+    """
+    def generate():
+        cached = None if bypass else result_cache.get(cache_key)
+        if cached is not None:
+            yield sse_event('done', cached)
+            return
+        try:
+            for kind, key, value in start_stream():
+                if kind == 'done':
+                    if should_store(value):
+                        result_cache.set(cache_key, value)
+                    yield sse_event('done', value)
+                else:
+                    yield sse_event(kind, {'key': key, 'value': value})
+        except Exception as e:
+            logger.error("Streaming generation error: %s", e)
+            yield sse_event('error', {'error': ai_error_message(e)})
+
+    # X-Accel-Buffering stops nginx from holding back the stream
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/generate_summary', methods=['POST'])
 def api_generate_summary():
     data = request.json
     note_id = data.get('noteId')
     
-    note_ref = db.collection('notes').document(note_id)
+    note_ref = db.note_ref(note_id)
     note = note_ref.get()
     if not note.exists:
         return jsonify({'error': 'Note not found'}), 404
         
     note_data = note.to_dict()
-    text = note_data.get('extractedText', '')
+    text, status = resolve_note_text(note_ref, note_data)
     
     if not text:
-        # Extract on the fly
-        filename = note_data.get('filename')
-        if filename:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            print(f"DEBUG: Looking for file at {filepath}")
-            if os.path.exists(filepath):
-                print(f"DEBUG: File found, extracting text for {filename}")
-                text = extract_text(filepath)
-                if text:
-                    print(f"DEBUG: Text extracted successfully ({len(text)} chars)")
-                    # Update Firestore so we don't have to extract again
-                    note_ref.update({'extractedText': text})
-                else:
-                    print("DEBUG: extract_text returned empty/None")
-            else:
-                print(f"DEBUG: File NOT found at {filepath}")
-        else:
-            print("DEBUG: No filename in note metadata")
-    
-    if not text:
-        return jsonify({'error': 'No text content available or extracted for this note.'}), 400
-        
-    try:
-        summary = generate_summary(text)
-        return jsonify(summary)
-    except Exception as e:
-        print(f"Summary Gen Error: {e}")
-        return jsonify({'error': f'AI Summary generation failed: {str(e)}'}), 500
+        return note_text_error(status)
+    # Long notes are summarized whole (map-reduce); only a topic narrows them
+    text = focused_text(note_id, note_data, text, data, replace_long=False)
+
+    # 'regenerate' skips the cached result and replaces it
+    return start_job('summary', summary_cache_key(text), lambda: summarize(text),
+                     bool(data.get('regenerate')), is_valid_summary)
 
 @app.route('/api/generate_questions', methods=['POST'])
 def api_generate_questions():
@@ -236,38 +653,92 @@ def api_generate_questions():
     note_id = data.get('noteId')
     mode = data.get('mode', 'objective')
     marks = data.get('marks')
+    num_questions = num_questions_arg(data)
+    if num_questions is None:
+        return jsonify({'error': 'numQuestions must be a number'}), 400
     
-    note_ref = db.collection('notes').document(note_id)
+    note_ref = db.note_ref(note_id)
     note = note_ref.get()
     if not note.exists:
         return jsonify({'error': 'Note not found'}), 404
         
     note_data = note.to_dict()
-    text = note_data.get('extractedText', '')
-    
-    if not text:
-        # Extract on the fly
-        filename = note_data.get('filename')
-        if filename:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                print(f"Extracting text on-the-fly for {filename}")
-                text = extract_text(filepath)
-                if text:
-                    # Update Firestore so we don't have to extract again
-                    note_ref.update({'extractedText': text})
+    text, status = resolve_note_text(note_ref, note_data)
 
     if not text:
-        return jsonify({'error': 'No text content available or extracted for this note.'}), 400
+        return note_text_error(status)
+    text = focused_text(note_id, note_data, text, data)
 
+    return start_job('questions', questions_cache_key(text, mode, marks, num_questions),
+                     lambda: generate_questions(text, mode, marks, num_questions),
+                     bool(data.get('regenerate')), is_valid_question_set)
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """Status of a generation job; ?wait=N long-polls up to N seconds for it to finish"""
     try:
-        num_questions = int(data.get('numQuestions', 1))
-        questions = generate_questions(text, mode, marks, num_questions)
-        return jsonify(questions)
-    except Exception as e:
-        print(f"Questions Gen Error: {e}")
-        return jsonify({'error': f'AI Questions generation failed: {str(e)}'}), 500
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    if not math.isfinite(wait):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait = min(max(wait, 0), app.config['JOB_MAX_WAIT_SECONDS'])
+    job = jobs.wait(job_id, wait) if wait else jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
+@app.route('/api/generate_summary/stream', methods=['POST'])
+def api_generate_summary_stream():
+    data = request.json
+    note_ref = db.note_ref(data.get('noteId'))
+    note = note_ref.get()
+    if not note.exists:
+        return jsonify({'error': 'Note not found'}), 404
+
+    note_data = note.to_dict()
+    text, status = resolve_note_text(note_ref, note_data)
+    if not text:
+        return note_text_error(status)
+    text = focused_text(note_ref.id, note_data, text, data, replace_long=False)
+
+    return sse_response(summary_cache_key(text), lambda: stream_summarize(text),
+                        bool(data.get('regenerate')), is_valid_summary)
+
+@app.route('/api/generate_questions/stream', methods=['POST'])
+def api_generate_questions_stream():
+    data = request.json
+    mode = data.get('mode', 'objective')
+    marks = data.get('marks')
+    num_questions = num_questions_arg(data)
+    if num_questions is None:
+        return jsonify({'error': 'numQuestions must be a number'}), 400
+    note_ref = db.note_ref(data.get('noteId'))
+    note = note_ref.get()
+    if not note.exists:
+        return jsonify({'error': 'Note not found'}), 404
+
+    note_data = note.to_dict()
+    text, status = resolve_note_text(note_ref, note_data)
+    if not text:
+        return note_text_error(status)
+    text = focused_text(note_ref.id, note_data, text, data)
+
+    return sse_response(questions_cache_key(text, mode, marks, num_questions),
+                        lambda: stream_questions(text, mode, marks, num_questions),
+                        bool(data.get('regenerate')), is_valid_question_set)
+
+@app.route('/api/ai_stats')
+@admin_required
+def api_ai_stats():
+    return jsonify({
+        'gateway': gateway.stats(),
+        'models': model_registry.stats(),
+        'resultCache': result_cache.stats(),
+        'moderation': moderation.stats(),
+        'jobs': jobs.stats(),
+        'semanticIndex': semantic_index.stats()
+    })
 
 @app.route('/library')
 def library():
@@ -278,20 +749,10 @@ def library():
     if not db:
         return "Database not initialized", 500
     
-    notes_list = []
-    
-    # Get only saved notes (not uploads)
-    saved_refs = db.collection('saved_notes').where('userId', '==', uid).stream()
-    saved_note_ids = [doc.to_dict().get('noteId') for doc in saved_refs]
-    
-    for note_id in saved_note_ids:
-        note_doc = db.collection('notes').document(note_id).get()
-        if note_doc.exists:
-            note = note_doc.to_dict()
-            note['id'] = note_doc.id
-            notes_list.append(note)
+    # Get only saved notes (not uploads); later pages come from /api/saved_notes
+    notes_list, next_cursor = fetch_saved_page(db, saved_index.note_ids(db, uid), page_limit())
         
-    return render_template('library.html', notes=notes_list)
+    return render_template('library.html', notes=notes_list, next_cursor=next_cursor)
 
 
 @app.route('/login')
@@ -332,7 +793,8 @@ def register_user():
             'role': 'student' 
         }
         if db:
-            db.collection('users').document(uid).set(user_data)
+            db.user_ref(uid).set(user_data)
+            user_cache.invalidate(uid)
         
         # Ensure session is empty after registration
         session.clear()
@@ -354,44 +816,17 @@ def dashboard():
     
     try:
         if db:
-            # 1. Total Uploads
-            uploads_ref = db.collection('notes').where('uploaderId', '==', uid).get()
-            stats['uploads'] = len(uploads_ref)
-            
-            # 2. Total Views & Recent Views
-            # Simplify query to avoid index requirement - sort in Python
-            views_stream = db.collection('user_views').where('userId', '==', uid).stream()
-            all_views = [doc.to_dict() for doc in views_stream]
-            
-            # Sort by timestamp descending
-            all_views.sort(key=lambda x: x.get('timestamp'), reverse=True)
+            # Counters and the recent ring are maintained on write, so this
+            # costs the same no matter how many views the user has
+            user_stats = get_user_stats(db, uid)
+            stats['uploads'] = user_stats.get('uploads', 0)
+            stats['views'] = user_stats.get('views', 0)
+            stats['recent_views'] = fetch_notes(db, user_stats.get('recentNoteIds', []),
+                                                 field_paths=LIST_FIELDS)
+            logger.debug("Stats updated for %s: %d uploads, %d total views", uid, stats['uploads'], stats['views'])
             
-            seen_notes = set()
-            recent_notes = []
-            
-            for view_data in all_views:
-                note_id = view_data.get('noteId')
-                
-                if note_id and note_id not in seen_notes:
-                    seen_notes.add(note_id)
-                    # Fetch note details
-                    note_doc = db.collection('notes').document(note_id).get()
-                    if note_doc.exists:
-                        note = note_doc.to_dict()
-                        note['id'] = note_doc.id
-                        recent_notes.append(note)
-                
-                if len(recent_notes) >= 5:
-                    break
-            
-            stats['views'] = len(all_views)
-            stats['recent_views'] = recent_notes
-            print(f"Stats updated for {uid}: {stats['uploads']} uploads, {stats['views']} total views")
-            
-    except Exception as e:
-        print(f"Dashboard stats error: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Dashboard stats error")
         
     return render_template('dashboard.html', stats=stats)
 
@@ -407,19 +842,33 @@ def log_view():
     if not note_id:
         return jsonify({'error': 'Missing noteId'}), 400
         
+    if db:
+        # Buffered; a repeat within the dedupe window is silently dropped
+        view_buffer.add(uid, note_id)
+        return jsonify({'status': 'success'}), 200
+    
+    return jsonify({'status': 'no_db'}), 200
+
+@app.route('/api/view_buffer/stats')
+@admin_required
+def api_view_buffer_stats():
+    return jsonify(view_buffer.stats())
+
+@app.route('/admin/compact_view_stats', methods=['POST'])
+@read_budget(None)
+@admin_required
+def compact_view_stats():
+    """Admin route to recompute every user's view counters from the raw view log"""
+    if not db:
+        return jsonify({'error': 'Database not initialized'}), 500
     try:
-        if db:
-            print(f"Logging view for uid: {uid}, noteId: {note_id}")
-            db.collection('user_views').add({
-                'userId': uid,
-                'noteId': note_id,
-                'timestamp': datetime.datetime.now()
-            })
-            return jsonify({'status': 'success'}), 200
+        rebuilt = 0
+        for doc in db.users():
+            rebuild_user_stats(db, doc.id)
+            rebuilt += 1
+        return jsonify({'message': f'Rebuilt view stats for {rebuilt} users'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
-    return jsonify({'status': 'no_db'}), 200
 
 @app.route('/logout')
 def logout():
@@ -439,13 +888,13 @@ def profile():
     uid = session['user']
     profile_data = None
     my_notes = []
+    next_cursor = None
     
     try:
         if db:
             # Get user profile
-            user_doc = db.collection('users').document(uid).get()
-            if user_doc.exists:
-                profile_data = user_doc.to_dict()
+            profile_data = user_cache.get(db, uid)
+            if profile_data is not None:
                 # Ensure pfp, timetable, syllabus keys exist
                 if 'pfpUrl' not in profile_data: profile_data['pfpUrl'] = None
                 if 'timetableUrl' not in profile_data: profile_data['timetableUrl'] = None
@@ -467,20 +916,16 @@ def profile():
                     pass
             
             # Get user's saved notes to mark status
-            saved_refs = db.collection('saved_notes').where('userId', '==', uid).stream()
-            saved_note_ids = [doc.to_dict().get('noteId') for doc in saved_refs]
+            saved_note_ids = saved_index.ids(db, uid)
             
-            # Get user's uploads
-            notes_ref = db.collection('notes').where('uploaderId', '==', uid).stream()
-            for doc in notes_ref:
-                note = doc.to_dict()
-                note['id'] = doc.id
+            # First page of the user's uploads; the rest load from /api/my_notes
+            my_notes, next_cursor = fetch_uploads_page(db, uid, page_limit())
+            for note in my_notes:
                 note['isSaved'] = note['id'] in saved_note_ids
-                my_notes.append(note)
     except Exception as e:
-        print(f"Profile fetch error: {e}")
+        logger.error("Profile fetch error: %s", e)
     
-    return render_template('profile.html', profile=profile_data, my_notes=my_notes)
+    return render_template('profile.html', profile=profile_data, my_notes=my_notes, next_cursor=next_cursor)
 
 @app.route('/api/update_profile', methods=['POST'])
 def update_profile():
@@ -493,7 +938,8 @@ def update_profile():
     
     try:
         if db:
-            db.collection('users').document(uid).update({'name': name})
+            db.user_ref(uid).update({'name': name})
+            user_cache.invalidate(uid)
             return jsonify({'message': 'Profile updated successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -517,22 +963,94 @@ def upload_profile_file():
     if file and file_type:
         uid = session['user']
         ext = file.filename.rsplit('.', 1)[1].lower()
-        new_filename = f"{file_type}_{uid}.{ext}"
-        local_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-        file.save(local_path)
-        
-        file_url = f"/uploads/{new_filename}"
+        # One reference per user and file type: replacing the file releases the old one
+        new_filename, content_hash = blob_store.ingest(file, ext, f"profile:{uid}:{file_type}")
+        file_url = file_server.versioned_url(new_filename, content_hash)
         field_name = f"{file_type}Url"
         
         try:
             if db:
-                db.collection('users').document(uid).update({field_name: file_url})
+                db.user_ref(uid).update({field_name: file_url})
+                user_cache.invalidate(uid)
                 return jsonify({'message': f'{file_type} updated', 'url': file_url})
         except Exception as e:
             return jsonify({'error': str(e)}), 500
             
     return jsonify({'error': 'Invalid request'}), 400
 
+@app.route('/admin/dedupe_uploads', methods=['POST'])
+@read_budget(None)
+@admin_required
+def dedupe_uploads():
+    """Admin route to move files saved under legacy names into the content-addressed store"""
+    if not db:
+        return jsonify({'error': 'Database not initialized'}), 500
+    try:
+        adopted = {}  # legacy filename -> (blob name, hash); overwritten names are shared
+        def adopt(filename, owner):
+            if filename not in adopted:
+                adopted[filename] = blob_store.adopt(filename, owner)
+            elif adopted[filename] is not None:
+                blob_store.add_reference(adopted[filename][1], owner)
+            return adopted[filename]
+
+        notes = 0
+        for doc in db.notes():
+            filename = doc.to_dict().get('filename')
+            if not filename or is_blob_name(filename):
+                continue
+            stored = adopt(filename, f"note:{doc.id}")
+            if stored is None:
+                continue
+            doc.reference.update({'filename': stored[0], 'displayName': filename, 'contentHash': stored[1],
+                                  'fileUrl': file_server.versioned_url(stored[0], stored[1])})
+            notes += 1
+
+        profile_files = 0
+        for doc in db.users():
+            user_data = doc.to_dict()
+            updates = {}
+            for file_type in PROFILE_FILE_TYPES:
+                url = user_data.get(f"{file_type}Url") or ''
+                filename = url.split('?', 1)[0].rsplit('/', 1)[-1]
+                if not url.startswith('/uploads/') or is_blob_name(filename):
+                    continue
+                stored = adopt(filename, f"profile:{doc.id}:{file_type}")
+                if stored is not None:
+                    updates[f"{file_type}Url"] = file_server.versioned_url(stored[0], stored[1])
+            if updates:
+                doc.reference.update(updates)
+                user_cache.invalidate(doc.id)
+                profile_files += len(updates)
+
+        # Search results carry fileUrl from the index copy
+        search_index.build(db)
+        return jsonify({'notes': notes, 'profileFiles': profile_files, 'store': blob_store.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/collect_uploads', methods=['POST'])
+@read_budget(None)
+@admin_required
+def collect_uploads():
+    """Admin route to delete stored files no note or profile points at (needed on shared storage)"""
+    if not db:
+        return jsonify({'error': 'Database not initialized'}), 500
+    try:
+        referenced = set()
+        for doc in db.notes(fields=['filename']):
+            referenced.add(doc.to_dict().get('filename'))
+        profile_fields = [f"{file_type}Url" for file_type in PROFILE_FILE_TYPES]
+        for doc in db.users(fields=profile_fields):
+            user_data = doc.to_dict()
+            for field in profile_fields:
+                url = user_data.get(field) or ''
+                referenced.add(url.split('?', 1)[0].rsplit('/', 1)[-1])
+        deleted = blob_store.sweep(referenced)
+        return jsonify({'deleted': deleted, 'store': blob_store.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/change_password', methods=['POST'])
 def change_password():
     if 'user' not in session:
@@ -548,41 +1066,113 @@ def change_password():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def page_limit():
+    """Page size requested with ?limit=, clamped to the configured maximum"""
+    return parse_limit(request.args.get('limit'), app.config['LIST_PAGE_SIZE'],
+                       app.config['LIST_MAX_PAGE_SIZE'])
+
 @app.route('/api/search_notes')
 def api_search_notes():
     query = request.args.get('q', '').lower()
     file_type = request.args.get('type', 'all')
+    limit = page_limit()
+    try:
+        position = decode_cursor(request.args.get('cursor'))
+        offset = max(0, int(position.get('o', 0)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     if not db or not query:
-        return jsonify([])
+        return jsonify({'notes': [], 'nextCursor': None})
     
     try:
         # Get current user's saved notes to mark status
-        saved_note_ids = []
+        saved_note_ids = frozenset()
         if 'user' in session:
-            uid = session['user']
-            saved_refs = db.collection('saved_notes').where('userId', '==', uid).stream()
-            saved_note_ids = [doc.to_dict().get('noteId') for doc in saved_refs]
-
-        notes_ref = db.collection('notes').where('status', '==', 'approved').stream()
-        results = []
-        for doc in notes_ref:
-            note = doc.to_dict()
-            note['id'] = doc.id
+            saved_note_ids = saved_index.ids(db, session['user'])
+
+        # Served from local indexes, no Firestore reads for the notes
+        search_index.maybe_refresh(db, app.config['SEARCH_INDEX_REFRESH_SECONDS'])
+        if fulltext_index is not None:
+            # Ranked by BM25 over metadata and note text, paged by offset.
+            # One extra hit tells us whether there is a next page.
+            hits = fulltext_index.search(query, file_type, limit + 1, offset)
+            notes = []
+            for note_id, score, snippet in hits[:limit]:
+                # Only approved notes are in the search index
+                note = search_index.get(note_id)
+                if note is None:
+                    continue
+                note = project_note(note)
+                note['snippet'] = snippet
+                notes.append(note)
+            next_cursor = encode_cursor({'o': offset + limit}) if len(hits) > limit else None
+        else:
+            results = search_index.search(query, file_type, after=position.get('after'), limit=limit + 1)
+            notes = [project_note(note) for note in results[:limit]]
+            next_cursor = encode_cursor({'after': notes[-1]['id']}) if len(results) > limit else None
+        for note in notes:
             note['isSaved'] = note['id'] in saved_note_ids
-            
-            # Simple search matching
-            subject_match = query in note.get('subjectName', '').lower()
-            dept_match = query in note.get('department', '').lower() or query in note.get('subjectCode', '').lower()
-            uploader_match = query in note.get('uploaderName', '').lower()
-            
-            type_match = (file_type == 'all' or note.get('type', 'note') == file_type)
-            
-            if (subject_match or dept_match or uploader_match) and type_match:
-                results.append(note)
-        return jsonify(results)
+        return jsonify({'notes': notes, 'nextCursor': next_cursor})
     except Exception as e:
-        print(f"Search error: {e}")
-        return jsonify([])
+        logger.error("Search error: %s", e)
+        return jsonify({'notes': [], 'nextCursor': None})
+
+@app.route('/api/search_index/stats')
+@admin_required
+def api_search_index_stats():
+    stats = search_index.stats()
+    stats['fulltext'] = fulltext_index.stats() if fulltext_index is not None else None
+    return jsonify(stats)
+
+@app.route('/admin/moderate_pending', methods=['POST'])
+@read_budget(None)
+@admin_required
+def moderate_pending():
+    """Admin route to queue every note still waiting for moderation"""
+    if not db:
+        return jsonify({'error': 'Database not initialized'}), 500
+    try:
+        return jsonify({'queued': requeue_moderation(), 'moderation': moderation.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/moderate_note', methods=['POST'])
+@read_budget(None)
+@admin_required
+def moderate_note():
+    """Admin route to approve or reject a pending note, e.g. one held for manual review"""
+    if not db:
+        return jsonify({'error': 'Database not initialized'}), 500
+    data = request.json or {}
+    note_id = data.get('noteId')
+    status = data.get('status')
+    if not note_id or status not in (APPROVED, REJECTED):
+        return jsonify({'error': "noteId and a status of 'approved' or 'rejected' are required"}), 400
+    try:
+        note = db.note_ref(note_id).get()
+        if not note.exists:
+            return jsonify({'error': 'Note not found'}), 404
+        note_data = note.to_dict()
+        if note_data.get('status') != PENDING_REVIEW:
+            return jsonify({'error': f"Note is already {note_data.get('status')}"}), 409
+        moderation.apply(note_id, {'status': status, 'stage': 'admin', 'reason': data.get('reason', '')},
+                         note_data)
+        return jsonify({'id': note_id, 'status': status})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/rebuild_search_index', methods=['POST'])
+@read_budget(None)
+@admin_required
+def rebuild_search_index():
+    """Admin route to rebuild the in-memory search index from Firestore"""
+    if not db:
+        return jsonify({'error': 'Database not initialized'}), 500
+    try:
+        search_index.build(db)
+        return jsonify(search_index.stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/get_profile')
 def api_get_profile():
@@ -596,9 +1186,8 @@ def api_get_profile():
         uid = decoded_token['uid']
         
         if db:
-            user_doc = db.collection('users').document(uid).get()
-            if user_doc.exists:
-                profile = user_doc.to_dict()
+            profile = user_cache.get(db, uid)
+            if profile is not None:
                 return jsonify(profile)
             else:
                 # Create profile from auth data if missing
@@ -609,7 +1198,8 @@ def api_get_profile():
                     'branch': 'Not Set'
                 }
                 # Save it to Firestore for next time
-                db.collection('users').document(uid).set(profile)
+                db.user_ref(uid).set(profile)
+                user_cache.invalidate(uid)
                 return jsonify(profile)
         
         return jsonify({
@@ -619,33 +1209,39 @@ def api_get_profile():
             'branch': 'Not Set'
         })
     except Exception as e:
-        print(f"Profile fetch error: {e}")
+        logger.error("Profile fetch error: %s", e)
         return jsonify({'error': str(e)}), 401
 
 @app.route('/api/my_notes')
 def api_my_notes():
     auth_header = request.headers.get('Authorization')
-    if not auth_header:
+    # The profile page loads further pages with its session cookie
+    if not auth_header and 'user' not in session:
         return jsonify({'error': 'No token'}), 401
     
     try:
-        id_token = auth_header.replace('Bearer ', '')
-        decoded_token = auth.verify_id_token(id_token)
-        uid = decoded_token['uid']
-        
-        if not db:
-            return jsonify([])
-        
-        notes_ref = db.collection('notes').where('uploaderId', '==', uid).stream()
-        notes_list = []
-        for doc in notes_ref:
-            note = doc.to_dict()
-            note['id'] = doc.id
-            notes_list.append(note)
-        return jsonify(notes_list)
+        if auth_header:
+            id_token = auth_header.replace('Bearer ', '')
+            decoded_token = auth.verify_id_token(id_token)
+            uid = decoded_token['uid']
+        else:
+            uid = session['user']
     except Exception as e:
         return jsonify({'error': str(e)}), 401
 
+    if not db:
+        return jsonify({'notes': [], 'nextCursor': None})
+    try:
+        notes_list, next_cursor = fetch_uploads_page(db, uid, page_limit(), request.args.get('cursor'))
+        saved_note_ids = saved_index.ids(db, uid)
+        for note in notes_list:
+            note['isSaved'] = note['id'] in saved_note_ids
+        return jsonify({'notes': notes_list, 'nextCursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 
 
 @app.route('/api/save_note', methods=['POST'])
@@ -658,16 +1254,9 @@ def api_save_note():
     uid = session['user']
     
     try:
-        # Check if already saved
-        existing = db.collection('saved_notes').where('userId', '==', uid).where('noteId', '==', note_id).get()
-        if not existing:
-            # Save to saved_notes collection
-            save_ref = db.collection('saved_notes').document()
-            save_ref.set({
-                'userId': uid,
-                'noteId': note_id,
-                'savedAt': datetime.datetime.now()
-            })
+        if not note_id:
+            return jsonify({'error': 'Missing noteId'}), 400
+        if saved_index.save(db, uid, note_id, datetime.datetime.now()):
             return jsonify({'message': 'Note saved successfully!'})
         else:
             return jsonify({'message': 'Note already in your library!'})
@@ -684,10 +1273,9 @@ def api_unsave_note():
     uid = session['user']
     
     try:
-        # Find and delete the saved note
-        saved_refs = db.collection('saved_notes').where('userId', '==', uid).where('noteId', '==', note_id).stream()
-        for doc in saved_refs:
-            doc.reference.delete()
+        if not note_id:
+            return jsonify({'error': 'Missing noteId'}), 400
+        saved_index.unsave(db, uid, note_id)
         return jsonify({'message': 'Note removed from saved collection'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -700,51 +1288,51 @@ def api_saved_notes():
     uid = session['user']
     
     try:
-        # Get all saved note IDs for this user
-        saved_refs = db.collection('saved_notes').where('userId', '==', uid).stream()
-        note_ids = [doc.to_dict().get('noteId') for doc in saved_refs]
-        
-        # Get full note details
-        notes_list = []
-        for note_id in note_ids:
-            note_doc = db.collection('notes').document(note_id).get()
-            if note_doc.exists:
-                note = note_doc.to_dict()
-                note['id'] = note_doc.id
-                notes_list.append(note)
+        # One page of saved notes, read in a single batched get_all
+        notes_list, next_cursor = fetch_saved_page(db, saved_index.note_ids(db, uid), page_limit(),
+                                                   request.args.get('cursor'))
         
-        return jsonify(notes_list)
+        return jsonify({'notes': notes_list, 'nextCursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/admin/clear_all_users', methods=['POST'])
+@read_budget(None)
 def clear_all_users():
     """Admin route to clear all users - USE WITH CAUTION"""
     try:
         # Clear Firestore users
         if db:
-            users_ref = db.collection('users').stream()
+            users_ref = db.users()
             for doc in users_ref:
                 doc.reference.delete()
-                print(f"Deleted user: {doc.id}")
+                blob_store.release(*(f"profile:{doc.id}:{t}" for t in PROFILE_FILE_TYPES))
+                logger.info("Deleted user: %s", doc.id)
+            user_cache.clear()
             
             # Clear notes
-            notes_ref = db.collection('notes').stream()
+            notes_ref = db.notes()
             for doc in notes_ref:
                 doc.reference.delete()
-                print(f"Deleted note: {doc.id}")
+                blob_store.release(f"note:{doc.id}")
+                logger.info("Deleted note: %s", doc.id)
             
             # Clear saved notes
-            saved_ref = db.collection('saved_notes').stream()
+            saved_ref = db.documents('saved_notes')
             for doc in saved_ref:
                 doc.reference.delete()
+            for doc in db.documents('user_saved'):
+                doc.reference.delete()
+            saved_index.clear()
         
         # Clear Firebase Auth users
         page = auth.list_users()
         while page:
             for user in page.users:
                 auth.delete_user(user.uid)
-                print(f"Deleted auth user: {user.email}")
+                logger.info("Deleted auth user: %s", user.email)
             page = page.get_next_page()
         
         return jsonify({'message': 'All users and data cleared successfully!'})
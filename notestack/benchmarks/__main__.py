@@ -0,0 +1,13 @@
+"""
+Runs every benchmark suite and checks the results against thresholds.json.
+
+    python -m benchmarks [--quick] [--output results.json] [--baseline old.json]
+
+The semantic index benchmark is separate (python -m benchmarks.semantic_index).
+"""
+import sys
+
+from benchmarks import harness, extraction, search, prompts
+
+if __name__ == '__main__':
+    sys.exit(harness.main([extraction, search, prompts], __doc__.strip().splitlines()[0]))
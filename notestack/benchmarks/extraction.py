@@ -0,0 +1,123 @@
+"""
+Text extraction and filename generation.
+
+    python -m benchmarks.extraction [--uploads uploads] [--output results.json]
+
+Times, per page, the two PDF paths behind extract_text on the PDFs found
+under the uploads folder (legacy names and hash-sharded blobs alike):
+pypdf's extract_text, and pdfplumber, which extract_text falls back to for
+pages where pypdf finds nothing. Also times whole extract_text calls per
+page, a synthetic DOCX, and generate_filename. Runs offline; with no PDFs
+in the folder only the synthetic benchmarks run.
+"""
+import os
+import sys
+import random
+import tempfile
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pypdf  # noqa: E402
+import pdfplumber  # noqa: E402
+import docx  # noqa: E402
+
+from benchmarks import harness  # noqa: E402
+from modules.utils import extract_text, generate_filename  # noqa: E402
+
+NOTESTACK_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DOCX_PARAGRAPHS = 500
+
+WORDS = ('stack queue tree graph heap process thread memory kernel matrix vector integral '
+         'voltage current circuit signal protocol packet router database index query').split()
+
+
+def add_arguments(parser):
+    parser.add_argument('--uploads', default=os.path.join(NOTESTACK_FOLDER, 'uploads'),
+                        help='folder searched for PDFs (default: notestack/uploads)')
+
+
+def find_pdfs(folder):
+    pdfs = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        pdfs.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith('.pdf'))
+    return pdfs
+
+
+@contextmanager
+def pypdf_pages(path):
+    yield pypdf.PdfReader(path).pages
+
+
+@contextmanager
+def plumber_pages(path):
+    with pdfplumber.open(path) as pdf:
+        yield pdf.pages
+
+
+def time_pages(open_pages, extract, rounds):
+    """
+    Milliseconds for each extract(page) call, every page once per round.
+    The file is reopened each round: both libraries cache what they parse
+    on the page object, so a second call on it would time a cache hit.
+    """
+    times = []
+    for _ in range(rounds):
+        with open_pages() as pages:
+            for page in pages:
+                times.extend(harness.measure(lambda: extract(page), repeat=1, warmup=0))
+    return times
+
+
+def make_docx(path, rng):
+    document = docx.Document()
+    for _ in range(DOCX_PARAGRAPHS):
+        document.add_paragraph(' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 60))))
+    document.save(path)
+
+
+def run(report, args):
+    rng = random.Random(args.seed)
+    rounds = 1 if args.quick else 3
+
+    pypdf_ms, plumber_ms, extract_ms = [], [], []
+    pdfs = find_pdfs(args.uploads)
+    total_pages = 0
+    for path in pdfs:
+        try:
+            reader = pypdf.PdfReader(path)
+            pages = list(reader.pages)
+        except Exception as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            continue
+        if not pages:
+            continue
+        total_pages += len(pages)
+        pypdf_ms += time_pages(lambda: pypdf_pages(path), lambda page: page.extract_text(), rounds)
+        plumber_ms += time_pages(lambda: plumber_pages(path), lambda page: page.extract_text(), rounds)
+        # Whole extractions, normalised to one page so files of any length compare
+        extract_ms += [ms / len(pages) for ms in harness.measure(lambda: extract_text(path),
+                                                                  repeat=rounds, warmup=0)]
+
+    info = {'files': len(pdfs), 'pages': total_pages}
+    report.add('extract.pdf.pypdf_page', pypdf_ms, **info)
+    report.add('extract.pdf.pdfplumber_page', plumber_ms, **info)
+    report.add('extract.pdf.extract_text_per_page', extract_ms, **info)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'synthetic.docx')
+        make_docx(path, rng)
+        report.add(f'extract.docx.extract_text[paragraphs={DOCX_PARAGRAPHS}]',
+                   harness.measure(lambda: extract_text(path), repeat=args.repeat))
+
+    names = [(rng.choice(WORDS).title() + ' ' + rng.choice(WORDS), rng.choice(('CSE', 'IT', 'ECE', 'ME')),
+              f'BT{rng.randint(10, 99)}IT{rng.randint(1000, 9999)}') for _ in range(100)]
+    report.add('utils.generate_filename',
+               harness.measure(lambda: [generate_filename(*n) for n in names], repeat=args.repeat),
+               callsPerRun=len(names))
+
+
+if __name__ == '__main__':
+    sys.exit(harness.main([sys.modules[__name__]], __doc__.strip().splitlines()[0]))
@@ -0,0 +1,158 @@
+"""
+Shared timing, reporting and regression checks for the benchmark suites.
+
+Every suite module has run(report, args) and an optional
+add_arguments(parser); main() parses the common options, runs the suites,
+prints a table and writes the results as JSON:
+
+    {"meta": {...}, "results": {"<name>": {"unit": "ms", "runs": N,
+     "mean": ..., "p50": ..., "p95": ..., "min": ..., ...}}}
+
+A run fails (exit status 1) when a result is slower than its ceiling in
+thresholds.json ({"<name>": {"p50": ms, "p95": ms}}), or, with --baseline,
+more than --tolerance slower than the same result in an earlier run.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_THRESHOLDS = os.path.join(BENCHMARKS_FOLDER, 'thresholds.json')
+
+# Statistics a threshold or baseline can be set on
+CHECKED_STATS = ('p50', 'p95', 'mean')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(times_ms):
+    return {
+        'unit': 'ms',
+        'runs': len(times_ms),
+        'mean': round(sum(times_ms) / len(times_ms), 4),
+        'p50': round(percentile(times_ms, 0.5), 4),
+        'p95': round(percentile(times_ms, 0.95), 4),
+        'min': round(min(times_ms), 4),
+    }
+
+
+def measure(fn, repeat=20, number=1, warmup=1):
+    """
+    Returns the milliseconds per call of fn() over repeat timed batches of
+    number calls each, after warmup untimed calls.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) * 1000 / number)
+    return times
+
+
+class Report:
+    def __init__(self):
+        self.results = {}
+
+    def add(self, name, times_ms, **info):
+        """
+        Records timings (milliseconds) under name; info is stored alongside
+        (e.g. corpus size, pages) but never checked.
+        """
+        if not times_ms:
+            return
+        self.results[name] = dict(summarize(times_ms), **info)
+
+    def print_table(self, out=sys.stdout):
+        width = max([len(name) for name in self.results] + [9])
+        out.write(f"{'benchmark':<{width}} {'runs':>5} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10}\n")
+        for name, r in self.results.items():
+            out.write(f"{name:<{width}} {r['runs']:>5} {r['p50']:>10.4f} {r['p95']:>10.4f} {r['mean']:>10.4f}\n")
+
+    def to_json(self):
+        return {
+            'meta': {
+                'createdAt': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'argv': sys.argv[1:],
+            },
+            'results': self.results,
+        }
+
+
+def check(results, thresholds, baseline=None, tolerance=0.25):
+    """
+    Returns a list of regression messages: results over their threshold, and
+    (with a baseline results dict) results more than tolerance slower than
+    before. Benchmarks missing on either side are not compared.
+    """
+    failures = []
+    for name, limits in thresholds.items():
+        result = results.get(name)
+        if result is None:
+            continue
+        for stat, limit in limits.items():
+            if stat in CHECKED_STATS and result[stat] > limit:
+                failures.append(f"{name}: {stat} {result[stat]:.4f} ms > threshold {limit} ms")
+    for name, before in (baseline or {}).items():
+        result = results.get(name)
+        if result is None:
+            continue
+        for stat in ('p50', 'p95'):
+            if before.get(stat) and result[stat] > before[stat] * (1 + tolerance):
+                failures.append(f"{name}: {stat} {result[stat]:.4f} ms is more than {tolerance:.0%} "
+                                f"slower than baseline {before[stat]:.4f} ms")
+    return failures
+
+
+def main(suites, description=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--thresholds', default=DEFAULT_THRESHOLDS,
+                        help='JSON file of per-benchmark ceilings (default: benchmarks/thresholds.json)')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against --baseline (default 0.25 = 25%%)')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--quick', action='store_true', help='smaller corpora and fewer runs, for a smoke test')
+    for suite in suites:
+        if hasattr(suite, 'add_arguments'):
+            suite.add_arguments(parser)
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat = min(args.repeat, 5)
+
+    report = Report()
+    for suite in suites:
+        suite.run(report, args)
+    report.print_table()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report.to_json(), f, indent=2)
+
+    thresholds = {}
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    failures = check(report.results, thresholds, baseline, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
@@ -0,0 +1,148 @@
+"""
+AI prompt construction and response post-processing, against a stub model.
+
+    python -m benchmarks.prompts [--metrics] [--output results.json]
+
+Everything around a Gemini call except the call itself: building summary,
+chunk, reduce and question prompts, chunking long notes, and turning a
+fenced JSON reply into a result, both whole (generate_summary,
+generate_questions) and streamed (IncrementalJSONParser). The gateway is
+pointed at a stub model that answers at once with canned replies, so the
+numbers are this code's overhead, with no network. Metrics recording is
+off unless --metrics is given.
+"""
+import os
+import sys
+import json
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+from modules import summary, questions  # noqa: E402
+from modules.gemini_gateway import gateway, TokenBucket  # noqa: E402
+from modules.metrics import metrics  # noqa: E402
+from modules.streaming import IncrementalJSONParser  # noqa: E402
+from modules.utils import PAGE_BREAK  # noqa: E402
+
+# Characters per page of synthetic notes, and pages in the long ones
+PAGE_CHARS = 2500
+LONG_NOTE_PAGES = 80
+# Stream chunk size; Gemini sends a few dozen characters at a time
+STREAM_CHUNK_CHARS = 40
+
+WORDS = ('the a of and to is in for stack queue tree node pointer process thread memory page kernel '
+         'matrix vector integral derivative voltage current signal protocol packet router database '
+         'index query transaction schema algorithm complexity recursion sorting hashing graph').split()
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', action='store_true', help='record metrics as the app does')
+
+
+def make_page(rng, number):
+    lines = [f'Unit {number}: {rng.choice(WORDS).title()} {rng.choice(WORDS).title()}']
+    while sum(len(line) + 1 for line in lines) < PAGE_CHARS:
+        lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))) + '.')
+    return '\n'.join(lines)
+
+
+def make_note(rng, pages):
+    return ('\n' + PAGE_BREAK).join(make_page(rng, i + 1) for i in range(pages))
+
+
+def summary_data(rng):
+    return {
+        'short_summary': ' '.join(rng.choice(WORDS) for _ in range(60)),
+        'detailed_summary': [' '.join(rng.choice(WORDS) for _ in range(25)) for _ in range(12)],
+    }
+
+
+def summary_reply(rng):
+    return '```json\n' + json.dumps(summary_data(rng), indent=2) + '\n```'
+
+
+def questions_reply(rng, count):
+    return '```json\n' + json.dumps({'questions': [{
+        'type': 'objective',
+        'marks': 2,
+        'question': ' '.join(rng.choice(WORDS) for _ in range(20)) + '?',
+        'options': [' '.join(rng.choice(WORDS) for _ in range(4)) for _ in range(4)],
+        'answer': 'A',
+    } for _ in range(count)]}, indent=2) + '\n```'
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """
+    Stands in for a GenerativeModel: replies to summary prompts with
+    summary_text and to anything else with questions_text.
+    """
+
+    def __init__(self, summary_text, questions_text):
+        self.summary_text = summary_text
+        self.questions_text = questions_text
+
+    def _reply(self, prompt):
+        return self.summary_text if 'Summarize' in prompt or 'Combine' in prompt else self.questions_text
+
+    def generate_content(self, prompt, stream=False):
+        text = self._reply(prompt)
+        if stream:
+            return [_Chunk(text[i:i + STREAM_CHUNK_CHARS]) for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        return _Chunk(text)
+
+
+def run(report, args):
+    rng = random.Random(args.seed)
+    metrics.enabled = args.metrics
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark-stub')
+    model = StubModel(summary_reply(rng), questions_reply(rng, 10))
+    gateway.model_factory = lambda model_name: model
+    # No rate limit: only local overhead is measured
+    gateway.bucket = TokenBucket(10 ** 9, burst=10 ** 9)
+
+    note = make_note(rng, 6)
+    long_note = make_note(rng, LONG_NOTE_PAGES)
+    chunks = summary.chunk_text(long_note)
+    partials = [summary_data(rng) for _ in chunks]
+    repeat = args.repeat
+
+    report.add('prompts.summary.build_prompt',
+               harness.measure(lambda: summary.build_summary_prompt(note), repeat=repeat, number=100))
+    report.add('prompts.questions.build_prompt',
+               harness.measure(lambda: questions.build_questions_prompt(note, 'objective', 2, 10),
+                               repeat=repeat, number=100))
+    report.add(f'prompts.summary.chunk_text[pages={LONG_NOTE_PAGES}]',
+               harness.measure(lambda: summary.chunk_text(long_note), repeat=repeat), chunks=len(chunks))
+    report.add(f'prompts.summary.map_reduce_prompts[pages={LONG_NOTE_PAGES}]',
+               harness.measure(lambda: ([summary.build_chunk_prompt(c) for c in chunks],
+                                        summary.build_reduce_prompt(partials)), repeat=repeat),
+               chunks=len(chunks))
+
+    report.add('prompts.summary.generate_stub',
+               harness.measure(lambda: summary.generate_summary(note), repeat=repeat, number=10))
+    report.add('prompts.questions.generate_stub',
+               harness.measure(lambda: questions.generate_questions(note, 'objective', 2, 10),
+                               repeat=repeat, number=10))
+    report.add('prompts.summary.stream_stub',
+               harness.measure(lambda: list(summary.stream_summary(note)), repeat=repeat))
+    report.add('prompts.questions.stream_stub',
+               harness.measure(lambda: list(questions.stream_questions(note, 'objective', 2, 10)), repeat=repeat))
+
+    def parse(text):
+        parser = IncrementalJSONParser()
+        for i in range(0, len(text), STREAM_CHUNK_CHARS):
+            parser.feed(text[i:i + STREAM_CHUNK_CHARS])
+        return parser.result()
+    report.add('prompts.streaming.parse_questions_reply',
+               harness.measure(lambda: parse(model.questions_text), repeat=repeat),
+               chars=len(model.questions_text))
+
+
+if __name__ == '__main__':
+    sys.exit(harness.main([sys.modules[__name__]], __doc__.strip().splitlines()[0]))
@@ -0,0 +1,116 @@
+"""
+Note search matching versus corpus size.
+
+    python -m benchmarks.search [--sizes 1000,10000,100000] [--output results.json]
+
+Builds synthetic approved notes (subject, department, code, uploader, type)
+and times the two matchers behind /api/search_notes: the in-memory
+SearchIndex (as-you-type prefix matching, the fallback without FTS5) and
+the SQLite FullTextIndex (BM25 over metadata; bodies are not indexed here).
+Queries mix whole words, prefixes and two-term searches, asking for one
+page plus one as the route does.
+"""
+import os
+import sys
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+from modules.search_index import SearchIndex  # noqa: E402
+from modules.fulltext import FullTextIndex  # noqa: E402
+
+PAGE_SIZE = 20
+
+SUBJECT_WORDS = tuple(('data structures algorithms operating systems computer networks database management '
+                       'digital electronics signals control theory thermodynamics fluid mechanics discrete '
+                       'mathematics linear algebra probability statistics compiler design machine learning '
+                       'software engineering microprocessors power electronics engineering physics chemistry '
+                       'graphics cryptography distributed cloud computing embedded web technologies').split())
+DEPARTMENTS = ('CSE', 'IT', 'ECE', 'EEE', 'ME', 'CE', 'AIML', 'DS')
+FIRST_NAMES = ('aarav', 'diya', 'ishaan', 'kavya', 'rohan', 'sneha', 'arjun', 'meera', 'vivaan', 'ananya',
+               'kabir', 'riya', 'aditya', 'pooja', 'nikhil', 'tanvi')
+LAST_NAMES = ('sharma', 'patel', 'verma', 'iyer', 'reddy', 'gupta', 'nair', 'singh', 'joshi', 'rao',
+              'mehta', 'das', 'kulkarni', 'chopra')
+TYPES = ('note', 'note', 'note', 'pyq', 'syllabus')
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', default='1000,10000,100000', help='note counts, comma separated')
+    parser.add_argument('--queries', type=int, default=50)
+
+
+def make_note(rng):
+    subject = ' '.join(rng.sample(SUBJECT_WORDS, rng.randint(1, 3))).title()
+    department = rng.choice(DEPARTMENTS)
+    return {
+        'subjectName': subject,
+        'department': department,
+        'subjectCode': f'{department}{rng.randint(100, 499)}',
+        'uploaderName': f'{rng.choice(FIRST_NAMES).title()} {rng.choice(LAST_NAMES).title()}',
+        'type': rng.choice(TYPES),
+        'status': 'approved',
+    }
+
+
+def make_queries(rng, count):
+    queries = []
+    for i in range(count):
+        word = rng.choice(SUBJECT_WORDS + LAST_NAMES)
+        kind = i % 3
+        if kind == 0:
+            queries.append(word)
+        elif kind == 1:
+            queries.append(word[:rng.randint(2, 4)])
+        else:
+            queries.append(f'{word} {rng.choice(SUBJECT_WORDS)[:3]}')
+    return queries
+
+
+def time_queries(search, queries, repeat):
+    times = []
+    for _ in range(max(1, repeat // 5)):
+        for query in queries:
+            times.extend(harness.measure(lambda: search(query), repeat=1, warmup=0))
+    return times
+
+
+def run(report, args):
+    rng = random.Random(args.seed)
+    sizes = [int(s) for s in args.sizes.split(',')]
+    if args.quick:
+        sizes = [min(size, 10000) for size in sizes]
+    queries = make_queries(rng, args.queries)
+
+    for size in sizes:
+        notes = {f'note{n:07d}': make_note(rng) for n in range(size)}
+
+        index = SearchIndex()
+        report.add(f'search.index.build[n={size}]',
+                   harness.measure(lambda: [index.add(note_id, note) for note_id, note in notes.items()],
+                                   repeat=1, warmup=0), notes=size)
+        report.add(f'search.index.query[n={size}]',
+                   time_queries(lambda q: index.search(q, limit=PAGE_SIZE + 1), queries, args.repeat),
+                   notes=size, queries=len(queries))
+        report.add(f'search.index.query_typed[n={size}]',
+                   time_queries(lambda q: index.search(q, 'pyq', limit=PAGE_SIZE + 1), queries, args.repeat),
+                   notes=size, queries=len(queries))
+
+        with tempfile.TemporaryDirectory() as folder:
+            try:
+                fulltext = FullTextIndex(os.path.join(folder, 'fulltext.sqlite3'))
+            except sqlite3.OperationalError as e:
+                print(f"Skipping full-text benchmarks: {e}", file=sys.stderr)
+                continue
+            report.add(f'search.fulltext.build[n={size}]',
+                       harness.measure(lambda: fulltext.sync(notes, lambda text_hash: None),
+                                       repeat=1, warmup=0), notes=size)
+            report.add(f'search.fulltext.query[n={size}]',
+                       time_queries(lambda q: fulltext.search(q, limit=PAGE_SIZE + 1), queries, args.repeat),
+                       notes=size, queries=len(queries))
+
+
+if __name__ == '__main__':
+    sys.exit(harness.main([sys.modules[__name__]], __doc__.strip().splitlines()[0]))
@@ -0,0 +1,110 @@
+"""
+Query latency of the semantic index versus corpus size.
+
+    python -m benchmarks.semantic_index [--sizes 1000,10000,50000] [--queries 50]
+
+Builds synthetic topical corpora in a temporary folder: every note is about
+one of a few hundred topics, and its passages mix that topic's words with a
+Zipf-distributed general vocabulary. Queries are a few words of one topic.
+Reports, per size, the median and p95 latency of exact scoring and of the
+IVF index, and the IVF recall@10 against the exact results.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import semantic_index  # noqa: E402
+from modules.semantic_index import SemanticIndex  # noqa: E402
+
+PASSAGES_PER_NOTE = 10
+WORDS_PER_PASSAGE = 200
+TOPICS = 300
+TOPIC_WORDS = 60
+# Share of a passage's words drawn from its note's topic
+TOPIC_SHARE = 0.3
+
+
+def make_vocab(rng, size=20000):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def make_passage(rng, vocab, weights, topic):
+    words = rng.choices(vocab, weights, k=WORDS_PER_PASSAGE)
+    for i in rng.sample(range(WORDS_PER_PASSAGE), int(WORDS_PER_PASSAGE * TOPIC_SHARE)):
+        words[i] = rng.choice(topic)
+    return ' '.join(words)[:semantic_index.PASSAGE_CHARS - 2]
+
+
+def build(folder, rng, vocab, weights, topics, passages):
+    index = SemanticIndex(folder)
+    for n in range(passages // PASSAGES_PER_NOTE):
+        topic = topics[n % len(topics)]
+        # Paragraph breaks every ~PASSAGE_CHARS give one passage per paragraph
+        text = '\n\n'.join(make_passage(rng, vocab, weights, topic) for _ in range(PASSAGES_PER_NOTE))
+        index.add_note(f'note{n}', f'hash{n}', text)
+    index.refresh()
+    return index
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def timed_queries(index, queries):
+    results, times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k=10))
+        times.append((time.perf_counter() - start) * 1000)
+    return results, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000', help='passage counts, comma separated')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = make_vocab(rng)
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    topics = [rng.sample(vocab[200:], TOPIC_WORDS) for _ in range(TOPICS)]
+    queries = [' '.join(rng.sample(rng.choice(topics), 4)) for _ in range(args.queries)]
+
+    print(f"{'passages':>9} {'build s':>8} {'exact p50':>10} {'exact p95':>10} "
+          f"{'ivf p50':>8} {'ivf p95':>8} {'recall@10':>9}")
+    saved_threshold = semantic_index.EXACT_MAX_ROWS
+    for size in [int(s) for s in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            index = build(folder, rng, vocab, weights, topics, size)
+            build_seconds = time.perf_counter() - start
+
+            semantic_index.EXACT_MAX_ROWS = float('inf')
+            exact, exact_ms = timed_queries(index, queries)
+            semantic_index.EXACT_MAX_ROWS = 0
+            index.train()
+            approx, ivf_ms = timed_queries(index, queries)
+            semantic_index.EXACT_MAX_ROWS = saved_threshold
+
+            hits = total = 0
+            for e, a in zip(exact, approx):
+                want = {(r[0], r[2]) for r in e}
+                hits += len(want & {(r[0], r[2]) for r in a})
+                total += len(want)
+            recall = hits / total if total else 1.0
+            print(f"{size:>9} {build_seconds:>8.1f} {percentile(exact_ms, 0.5):>10.2f} "
+                  f"{percentile(exact_ms, 0.95):>10.2f} {percentile(ivf_ms, 0.5):>8.2f} "
+                  f"{percentile(ivf_ms, 0.95):>8.2f} {recall:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,4 +7,92 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev_secret_key_change_in_production'
     FIREBASE_CREDENTIALS_PATH = os.environ.get('FIREBASE_CREDENTIALS_PATH') or 'firebase_credentials.json'
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-    UPLOAD_FOLDER = 'uploads' 
+    # /admin routes need 'Authorization: Bearer <token>' with this token, or with a Firebase
+    # ID token carrying the 'admin' custom claim
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    UPLOAD_FOLDER = 'uploads'
+    # Largest accepted file; uploads are cut off with a 413 as soon as they pass it
+    UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES') or 50 * 1024 * 1024)
+    # Werkzeug rejects bigger requests from their Content-Length before reading the body
+    MAX_CONTENT_LENGTH = UPLOAD_MAX_BYTES + 1024 * 1024
+    # Which notes and profile files reference each stored upload (uploads are stored once per content)
+    UPLOAD_INDEX_PATH = os.environ.get('UPLOAD_INDEX_PATH') or os.path.join('cache', 'uploads.sqlite3')
+    # Where uploaded files live: 'local' (UPLOAD_FOLDER, sharded by hash) or 's3'
+    # (any S3-compatible object store: AWS S3, GCS interoperability, MinIO)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'local'
+    STORAGE_BUCKET = os.environ.get('STORAGE_BUCKET')
+    STORAGE_PREFIX = os.environ.get('STORAGE_PREFIX') or 'uploads/'
+    # e.g. https://storage.googleapis.com or http://localhost:9000 for MinIO; credentials come from the AWS_* variables
+    STORAGE_ENDPOINT_URL = os.environ.get('STORAGE_ENDPOINT_URL')
+    STORAGE_REGION = os.environ.get('STORAGE_REGION')
+    STORAGE_PART_SIZE = int(os.environ.get('STORAGE_PART_SIZE') or 8 * 1024 * 1024)
+    # Local read-through copies of object storage files (served and extracted from here)
+    OBJECT_CACHE_FOLDER = os.environ.get('OBJECT_CACHE_FOLDER') or os.path.join('cache', 'objects')
+    OBJECT_CACHE_MAX_BYTES = int(os.environ.get('OBJECT_CACHE_MAX_BYTES') or 1024 * 1024 * 1024)
+    # How /uploads bytes are sent: 'direct' (by the app), 'x-accel' (nginx) or 'x-sendfile'
+    UPLOAD_SERVE_MODE = os.environ.get('UPLOAD_SERVE_MODE') or 'direct'
+    # nginx 'internal' location aliased to UPLOAD_FOLDER (OBJECT_CACHE_FOLDER with 's3'), used in 'x-accel' mode
+    UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX') or '/protected-uploads/'
+    # Seconds before the in-memory search index is rebuilt in the background (0 disables)
+    SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS') or 300)
+    # On-disk SQLite FTS5 index over note text, shared by the app processes on a host
+    FULLTEXT_INDEX_PATH = os.environ.get('FULLTEXT_INDEX_PATH') or os.path.join('cache', 'fulltext.sqlite3')
+    # On-disk cache of extracted note text, keyed by file content hash
+    TEXT_CACHE_FOLDER = os.environ.get('TEXT_CACHE_FOLDER') or os.path.join('cache', 'text')
+    TEXT_CACHE_MAX_BYTES = int(os.environ.get('TEXT_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+    # Background text extraction at upload time
+    EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS') or 2)
+    # A note left 'pending' longer than this (e.g. after a restart) is queued again
+    EXTRACTION_STALE_SECONDS = int(os.environ.get('EXTRACTION_STALE_SECONDS') or 600)
+    # Processes each extraction fans PDF pages out to (0 or 1 extracts serially)
+    EXTRACTION_PAGE_WORKERS = int(os.environ.get('EXTRACTION_PAGE_WORKERS') or 0)
+    # Threads per process moderating uploads after extraction (verdicts are cached in RESULT_CACHE_PATH)
+    MODERATION_WORKERS = int(os.environ.get('MODERATION_WORKERS') or 2)
+    # A note whose Gemini check failed is retried after this many seconds, then after twice
+    # as long each time, up to the max
+    MODERATION_RETRY_SECONDS = int(os.environ.get('MODERATION_RETRY_SECONDS') or 60)
+    MODERATION_RETRY_MAX_SECONDS = int(os.environ.get('MODERATION_RETRY_MAX_SECONDS') or 3600)
+    # Persistent cache of Gemini summaries and question sets
+    RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH') or os.path.join('cache', 'results.sqlite3')
+    RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS') or 7 * 24 * 3600)
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    # Background jobs for /api/generate_summary and /api/generate_questions: worker
+    # threads per operation and per process, and how many more may wait
+    SUMMARY_JOB_WORKERS = int(os.environ.get('SUMMARY_JOB_WORKERS') or 2)
+    QUESTIONS_JOB_WORKERS = int(os.environ.get('QUESTIONS_JOB_WORKERS') or 2)
+    JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED') or 16)
+    JOBS_PATH = os.environ.get('JOBS_PATH') or os.path.join('cache', 'jobs.sqlite3')
+    # Longest ?wait= a job status request may block for
+    JOB_MAX_WAIT_SECONDS = float(os.environ.get('JOB_MAX_WAIT_SECONDS') or 10)
+    # Map-reduce summaries for notes longer than one prompt
+    SUMMARY_MAX_WORKERS = int(os.environ.get('SUMMARY_MAX_WORKERS') or 4)
+    SUMMARY_MAX_CHUNKS = int(os.environ.get('SUMMARY_MAX_CHUNKS') or 12)
+    # Per-process TTL for cached user profiles and saved-note sets
+    USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS') or 30)
+    # Write-behind buffer for /api/log_view: flush at this many views or this often
+    VIEW_BUFFER_MAX_SIZE = int(os.environ.get('VIEW_BUFFER_MAX_SIZE') or 100)
+    VIEW_BUFFER_FLUSH_SECONDS = float(os.environ.get('VIEW_BUFFER_FLUSH_SECONDS') or 5)
+    # Repeat views of a note by the same user within this window are dropped
+    VIEW_DEDUPE_SECONDS = float(os.environ.get('VIEW_DEDUPE_SECONDS') or 2)
+    # Page size for the search, library and uploads listings (?limit= up to the max)
+    LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE') or 20)
+    LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE') or 100)
+    # Prometheus-format counters and histograms at /metrics (per process), served to requests
+    # with 'Authorization: Bearer <METRICS_TOKEN>' or an admin's token (see ADMIN_TOKEN)
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or 'true').lower() not in ('0', 'false', 'no')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Log records go to stderr as 'text' or 'json' lines
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'text'
+    # 'memory' runs the app on the in-memory Firestore fake (no network or credentials)
+    FIRESTORE_BACKEND = os.environ.get('FIRESTORE_BACKEND') or 'firebase'
+    # Firestore documents one request may read (0: no budget; admin routes are exempt) and
+    # single-document gets from one collection that flag an N+1 pattern; logged as warnings,
+    # raised with FIRESTORE_STRICT (for tests)
+    FIRESTORE_READ_BUDGET = int(os.environ.get('FIRESTORE_READ_BUDGET') or 0)
+    FIRESTORE_N_PLUS_ONE_GETS = int(os.environ.get('FIRESTORE_N_PLUS_ONE_GETS') or 10)
+    FIRESTORE_STRICT = (os.environ.get('FIRESTORE_STRICT') or 'false').lower() in ('1', 'true', 'yes')
+    # Passage vectors for retrieval-based context in the AI generators
+    SEMANTIC_INDEX_FOLDER = os.environ.get('SEMANTIC_INDEX_FOLDER') or os.path.join('cache', 'semantic')
+    # Characters of retrieved passages sent in place of a whole note
+    RETRIEVAL_MAX_CHARS = int(os.environ.get('RETRIEVAL_MAX_CHARS') or 15000)
@@ -0,0 +1,105 @@
+import logging
+
+from modules.firestore_metrics import InstrumentedFirestore
+from modules.metrics import start_request, finish_request
+
+logger = logging.getLogger(__name__)
+
+
+class ReadBudgetExceeded(Exception):
+    """A request read more Firestore documents than its budget (strict mode)."""
+
+
+class NPlusOneReads(Exception):
+    """A request fetched many documents of one collection one get at a time (strict mode)."""
+
+
+def read_budget(limit):
+    """
+    Route decorator overriding FIRESTORE_READ_BUDGET for one view; None
+    means unlimited (admin maintenance routes). Goes below @app.route.
+    """
+    def decorate(view):
+        view.read_budget = limit
+        return view
+    return decorate
+
+
+class Datastore(InstrumentedFirestore):
+    """
+    The app's one way into Firestore. Routes use the helpers below for the
+    documents they touch; modules are handed the Datastore itself as their
+    client. Either way every document read and written is counted against
+    the current request, and end_request() checks the counts:
+
+    - N+1: n_plus_one_gets or more single-document gets from one collection
+      (batch them with get_all, see modules.notes.fetch_notes)
+    - budget: more documents read than read_budget (0: no budget), or than
+      a view's own @read_budget
+
+    Problems are logged as warnings; in strict mode (tests) they raise.
+    """
+
+    __slots__ = ('read_budget', 'n_plus_one_gets', 'strict')
+
+    def __init__(self, client, read_budget=0, n_plus_one_gets=10, strict=False):
+        super().__init__(client)
+        self.read_budget = read_budget
+        self.n_plus_one_gets = n_plus_one_gets
+        self.strict = strict
+
+    # Documents and queries the routes use
+
+    def note_ref(self, note_id=None):
+        """A note's reference; a new auto-ID one without note_id."""
+        return self.collection('notes').document(note_id)
+
+    def user_ref(self, uid):
+        return self.collection('users').document(uid)
+
+    def notes(self, status=None, fields=None):
+        """Streams note snapshots, optionally only one status and some fields."""
+        query = self.collection('notes')
+        if status is not None:
+            query = query.where('status', '==', status)
+        if fields is not None:
+            query = query.select(fields)
+        return query.stream()
+
+    def users(self, fields=None):
+        query = self.collection('users')
+        if fields is not None:
+            query = query.select(fields)
+        return query.stream()
+
+    def documents(self, collection):
+        """Streams every document of a collection (admin maintenance)."""
+        return self.collection(collection).stream()
+
+    # Per-request accounting
+
+    def begin_request(self):
+        start_request()
+
+    def end_request(self, route, view=None):
+        """
+        Stops counting for the request and checks its reads. view is the
+        request's view function, for its @read_budget. Returns the counts.
+        """
+        counts = finish_request(route)
+        if counts is None:
+            return None
+        problems = []
+        for collection, gets in counts.gets.items():
+            if self.n_plus_one_gets and gets >= self.n_plus_one_gets:
+                problems.append((NPlusOneReads, f"{gets} single-document gets from '{collection}' in {route}"))
+        budget = getattr(view, 'read_budget', self.read_budget)
+        if budget and counts.reads > budget:
+            problems.append((ReadBudgetExceeded, f"{counts.reads} Firestore reads in {route} (budget {budget})"))
+        for error, message in problems:
+            logger.warning("%s: %s", error.__name__, message,
+                           extra={'route': route, 'reads': counts.reads, 'writes': counts.writes})
+        if problems and self.strict:
+            error, message = problems[0]
+            raise error(message)
+        return counts
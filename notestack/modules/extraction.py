@@ -0,0 +1,160 @@
+import time
+import logging
+import multiprocessing
+import threading
+import datetime
+from concurrent.futures import ProcessPoolExecutor, BrokenExecutor
+
+from modules.utils import extract_text, PAGE_BREAK
+from modules.text_cache import TextCache, hash_file
+from modules.metrics import EXTRACT_SECONDS, EXTRACT_PAGES, EXTRACTIONS
+
+logger = logging.getLogger(__name__)
+
+# Note 'extraction' field values
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# One cache handle per worker process, created on first use
+_worker_cache = None
+
+
+def _extract_in_worker(filepath, cache_folder, cache_max_bytes, page_workers=0):
+    """
+    Runs in a worker process: extracts the file's text into the shared on-disk
+    text cache and returns (content hash, number of characters, seconds spent
+    in extract_text, pages with text). Seconds is None on a cache hit.
+    Metrics live in the app process, so timings travel back with the result.
+    """
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = TextCache(cache_folder, cache_max_bytes)
+
+    key = hash_file(filepath)
+    text = _worker_cache.get(key)
+    seconds = None
+    if text is None:
+        start = time.perf_counter()
+        text = extract_text(filepath, page_workers=page_workers)
+        seconds = time.perf_counter() - start
+        if text is None:
+            raise RuntimeError(f"Could not extract text from {filepath}")
+        _worker_cache.put(key, text)
+    separator = PAGE_BREAK if filepath.lower().endswith('.pdf') else '\n'
+    pages = text.count(separator) + 1 if text else 0
+    return key, len(text), seconds, pages
+
+
+class ExtractionPipeline:
+    """
+    Extracts uploaded files in a pool of worker processes (pypdf parsing is
+    CPU-bound and holds the GIL) and records the outcome on the note document.
+    """
+
+    def __init__(self, db, text_cache, max_workers=2, page_workers=0):
+        self.db = db
+        self.text_cache = text_cache
+        self.max_workers = max_workers
+        self.page_workers = page_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._listeners = []
+        self._failure_listeners = []
+
+    def _get_executor(self):
+        # Created lazily so each gunicorn worker gets its own pool after fork.
+        # 'spawn' avoids forking a process that holds gRPC threads.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def add_listener(self, callback):
+        """
+        Registers callback(note_id, text_hash), called after a successful extraction.
+        """
+        self._listeners.append(callback)
+
+    def add_failure_listener(self, callback):
+        """
+        Registers callback(note_id, error), called when a note's text can't be extracted.
+        """
+        self._failure_listeners.append(callback)
+
+    def submit(self, note_id, filepath, mark_pending=True):
+        """
+        Queues a note for extraction and marks it pending (callers that already
+        wrote 'extraction': 'pending' with the note can skip the extra write).
+        Returns False if the note is already queued in this process.
+        """
+        with self._lock:
+            if note_id in self._in_flight:
+                return False
+            self._in_flight.add(note_id)
+
+        try:
+            with self._lock:
+                executor = self._get_executor()
+            if mark_pending:
+                self.db.collection('notes').document(note_id).update({
+                    'extraction': PENDING,
+                    'extractionStartedAt': datetime.datetime.now(datetime.timezone.utc)
+                })
+            future = executor.submit(
+                _extract_in_worker, filepath, self.text_cache.folder, self.text_cache.max_bytes,
+                self.page_workers
+            )
+        except Exception as e:
+            # Leave the note free to be submitted again; a broken pool is replaced on next use
+            with self._lock:
+                self._in_flight.discard(note_id)
+                if isinstance(e, BrokenExecutor):
+                    self._executor = None
+            raise
+        file_format = filepath.rsplit('.', 1)[-1].lower()
+        future.add_done_callback(lambda f: self._finish(note_id, f, file_format))
+        return True
+
+    def _finish(self, note_id, future, file_format):
+        with self._lock:
+            self._in_flight.discard(note_id)
+
+        note_ref = self.db.collection('notes').document(note_id)
+        try:
+            text_hash, chars, seconds, pages = future.result()
+        except Exception as e:
+            logger.error("Extraction failed for note %s: %s", note_id, e)
+            EXTRACTIONS.inc(outcome='failed')
+            note_ref.update({'extraction': FAILED, 'extractionError': str(e)})
+            for callback in self._failure_listeners:
+                try:
+                    callback(note_id, e)
+                except Exception:
+                    logger.exception("Extraction failure listener error for note %s", note_id)
+            return
+
+        if seconds is None:
+            EXTRACTIONS.inc(outcome='cached')
+        else:
+            EXTRACTIONS.inc(outcome='done')
+            EXTRACT_SECONDS.observe(seconds, format=file_format)
+            EXTRACT_PAGES.observe(pages, format=file_format)
+        logger.debug("Extraction done for note %s (%d chars, %d pages)", note_id, chars, pages)
+        note_ref.update({'extraction': DONE, 'textHash': text_hash})
+        for callback in self._listeners:
+            try:
+                callback(note_id, text_hash)
+            except Exception:
+                logger.exception("Extraction listener error for note %s", note_id)
+
+    def is_in_flight(self, note_id):
+        with self._lock:
+            return note_id in self._in_flight
+
+    def stats(self):
+        with self._lock:
+            return {'inFlight': len(self._in_flight), 'workers': self.max_workers}
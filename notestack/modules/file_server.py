@@ -0,0 +1,131 @@
+import os
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from flask import request, send_file, abort, current_app
+
+from modules.text_cache import hash_file
+from modules.storage import is_blob_name
+
+# Hex digits of the content hash used as the ?v= version in file URLs
+VERSION_LENGTH = 16
+
+# Cache-Control for URLs whose ?v= matches the file: the bytes behind them never change
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# Everything else (unversioned or outdated URLs) is revalidated on each use,
+# which costs a 304 with no body while the file is unchanged
+REVALIDATE_CACHE = 'no-cache'
+
+MODES = ('direct', 'x-accel', 'x-sendfile')
+
+
+class FileServer:
+    """
+    Serves files from the upload storage with strong content-hash ETags,
+    conditional GETs (304) and byte ranges (206), so PDF viewers can fetch
+    pages lazily and browsers never download an unchanged file twice.
+    Blob names are their content hash; legacy filenames were reused when a
+    note or profile file was replaced, so only URLs carrying the current
+    content version are cached as immutable.
+    In 'x-accel' (nginx) and 'x-sendfile' (Apache, lighttpd) modes the
+    response carries headers only and the front proxy streams the bytes
+    from the storage's local folder (the object cache for object storage).
+    """
+
+    def __init__(self, storage, mode='direct', accel_prefix='/protected-uploads/', max_hashes=4096):
+        if mode not in MODES:
+            raise ValueError(f"Unknown file serving mode: {mode}")
+        self.storage = storage
+        self.mode = mode
+        self.accel_prefix = accel_prefix.rstrip('/') + '/'
+        self.max_hashes = max_hashes
+        self._lock = threading.Lock()
+        self._hashes = OrderedDict()  # path -> (mtime_ns, size, sha256 hex)
+        self.hash_hits = 0
+        self.hash_misses = 0
+        self.not_modified = 0
+
+    def content_hash(self, filename):
+        """
+        Returns the sha256 of a stored file. Blob names carry it; other files
+        are re-hashed only when their mtime or size changed.
+        """
+        if is_blob_name(filename):
+            return filename.split('.', 1)[0]
+        path = self.storage.local_path(filename)
+        st = os.stat(path)
+        with self._lock:
+            entry = self._hashes.get(path)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._hashes.move_to_end(path)
+                self.hash_hits += 1
+                return entry[2]
+            self.hash_misses += 1
+
+        digest = hash_file(path)
+        self._remember(path, st, digest)
+        return digest
+
+    def _remember(self, path, st, digest):
+        with self._lock:
+            self._hashes[path] = (st.st_mtime_ns, st.st_size, digest)
+            self._hashes.move_to_end(path)
+            while len(self._hashes) > self.max_hashes:
+                self._hashes.popitem(last=False)
+
+    def versioned_url(self, filename, digest=None):
+        """
+        Returns the /uploads URL of a saved file with its content version
+        appended, for storing in note and profile documents. A digest already
+        computed while storing the file saves hashing it again.
+        """
+        version = (digest or self.content_hash(filename))[:VERSION_LENGTH]
+        return f"/uploads/{filename}?v={version}"
+
+    def send(self, filename):
+        """
+        Builds the response for GET /uploads/<filename> in the current request.
+        """
+        try:
+            etag = self.content_hash(filename)
+            if is_blob_name(filename) and request.if_none_match.contains(etag):
+                # The name is the content hash, so revalidating needs no storage access
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+            else:
+                # On object storage this downloads into the local cache first
+                response = self._send(filename, self.storage.local_path(filename), etag)
+        except FileNotFoundError:
+            abort(404)
+
+        version = request.args.get('v', '')
+        current = len(version) >= VERSION_LENGTH and etag.startswith(version)
+        if response.status_code == 304:
+            with self._lock:
+                self.not_modified += 1
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE if current else REVALIDATE_CACHE
+        return response
+
+    def _send(self, filename, path, etag):
+        if self.mode == 'direct':
+            # conditional=True answers If-None-Match with 304 and Range with 206
+            response = send_file(os.path.abspath(path), conditional=True, etag=etag, max_age=None)
+        else:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = current_app.response_class(mimetype=mimetype)
+            if self.mode == 'x-accel':
+                response.headers['X-Accel-Redirect'] = self.accel_prefix + self.storage.relative_path(filename)
+            else:
+                response.headers['X-Sendfile'] = os.path.abspath(path)
+            response.set_etag(etag)
+            # The proxy handles ranges; only 304s are decided here
+            response = response.make_conditional(request)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'mode': self.mode, 'hashedFiles': len(self._hashes), 'hashHits': self.hash_hits,
+                    'hashMisses': self.hash_misses, 'notModified': self.not_modified}
+
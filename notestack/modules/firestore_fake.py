@@ -0,0 +1,381 @@
+import copy
+import uuid
+import datetime
+import functools
+import threading
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _document_id(value):
+    # References stand for their document ID in __name__ filters and cursors
+    return value.id if isinstance(value, FakeDocument) else value
+
+
+def _transform(current, value):
+    """
+    The stored value for a write of value over current (None if missing),
+    resolving Firestore's transform sentinels.
+    """
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, firestore.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, firestore.ArrayUnion):
+        items = list(current) if isinstance(current, list) else []
+        return items + [v for v in value.values if v not in items]
+    if isinstance(value, firestore.ArrayRemove):
+        return [v for v in current if v not in value.values] if isinstance(current, list) else []
+    if isinstance(value, dict):
+        return _merge({}, value)
+    return copy.deepcopy(value)
+
+
+def _merge(target, data):
+    # set(merge=True) merges nested maps too
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = _transform(target.get(key), value)
+    return target
+
+
+def _update(target, data):
+    # update() takes dotted field paths; missing parents are created
+    for field_path, value in data.items():
+        *parents, name = field_path.split('.')
+        node = target
+        for part in parents:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is firestore.DELETE_FIELD:
+            node.pop(name, None)
+        else:
+            node[name] = _transform(node.get(name), value)
+    return target
+
+
+def _project(data, field_paths):
+    projected = {}
+    for field_path in field_paths:
+        try:
+            value = _get_field(data, field_path)
+        except KeyError:
+            continue
+        _update(projected, {field_path: copy.deepcopy(value)})
+    return projected
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, field_paths=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and field_paths is not None:
+            data = _project(data, field_paths)
+        self._data = copy.deepcopy(data)
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        return copy.deepcopy(_get_field(self._data, field_path))
+
+
+class FakeDocument:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+        self._collection_path = collection_path
+
+    @property
+    def parent(self):
+        return FakeCollection(self._client, self._collection_path)
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocument) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def _documents(self):
+        return self._client._collections.setdefault(self._collection_path, {})
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        with self._client._lock:
+            return FakeSnapshot(self, self._documents().get(self.id), field_paths)
+
+    def set(self, data, merge=False, **kwargs):
+        with self._client._lock:
+            documents = self._documents()
+            current = documents.get(self.id) if merge else None
+            documents[self.id] = _merge(current if current is not None else {}, data)
+
+    def create(self, data, **kwargs):
+        with self._client._lock:
+            if self.id in self._documents():
+                raise AlreadyExists(f"Document already exists: {self.path}")
+            self.set(data)
+
+    def update(self, data, **kwargs):
+        with self._client._lock:
+            documents = self._documents()
+            if self.id not in documents:
+                raise NotFound(f"No document to update: {self.path}")
+            _update(documents[self.id], data)
+
+    def delete(self, **kwargs):
+        with self._client._lock:
+            self._documents().pop(self.id, None)
+
+    def collection(self, name):
+        return FakeCollection(self._client, f"{self.path}/{name}")
+
+
+class FakeQuery:
+    """
+    The query subset the app uses: where (==, !=, <, <=, >, >=, in, not-in,
+    array_contains, array_contains_any), order_by, select, start_after,
+    offset and limit. As in Firestore, documents missing a filtered or
+    ordered field are left out, and ties are broken by document ID.
+    """
+
+    def __init__(self, client, collection_path, filters=(), orders=(), fields=None, cursor=None,
+                 offset=0, limit=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = filters
+        self._orders = orders
+        self._fields = fields
+        self._cursor = cursor
+        self._offset = offset
+        self._limit = limit
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, fields=self._fields, cursor=self._cursor,
+                     offset=self._offset, limit=self._limit)
+        state.update(changes)
+        return FakeQuery(self._client, self._collection_path, **state)
+
+    def where(self, field_path, op_string, value):
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction == 'DESCENDING'),))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    @staticmethod
+    def _value(doc_id, data, field_path):
+        if field_path == '__name__':
+            return doc_id
+        return _get_field(data, field_path)
+
+    @staticmethod
+    def _matches(value, op_string, expected):
+        expected = _document_id(expected)
+        if op_string == '==':
+            return value == expected
+        if op_string == '!=':
+            return value != expected
+        if op_string == 'in':
+            return value in expected
+        if op_string == 'not-in':
+            return value not in expected
+        if op_string == 'array_contains':
+            return isinstance(value, list) and expected in value
+        if op_string == 'array_contains_any':
+            return isinstance(value, list) and any(v in value for v in expected)
+        try:
+            return {'<': value < expected, '<=': value <= expected,
+                    '>': value > expected, '>=': value >= expected}[op_string]
+        except TypeError:
+            return False
+
+    def _key(self, doc_id, data):
+        return tuple(self._value(doc_id, data, field_path) for field_path, _ in self._orders) + (doc_id,)
+
+    def _compare(self, a, b):
+        descending = [desc for _, desc in self._orders] + [False]
+        for x, y, desc in zip(a, b, descending):
+            if x != y:
+                return (1 if x > y else -1) * (-1 if desc else 1)
+        return 0
+
+    def _after_cursor(self, key):
+        cursor = self._cursor
+        if isinstance(cursor, FakeSnapshot):
+            return self._compare(key, self._key(cursor.id, cursor._data or {})) > 0
+        values = tuple(_document_id(cursor[field_path]) for field_path, _ in self._orders)
+        if '__name__' in cursor:
+            values += (_document_id(cursor['__name__']),)
+        # Without a document ID the cursor sits after every tie on its fields
+        return self._compare(key[:len(values)], values) > 0
+
+    def _run(self):
+        with self._client._lock:
+            documents = list(self._client._collections.get(self._collection_path, {}).items())
+        rows = []
+        for doc_id, data in documents:
+            try:
+                if not all(self._matches(self._value(doc_id, data, f), op, v) for f, op, v in self._filters):
+                    continue
+                key = self._key(doc_id, data)
+            except KeyError:
+                continue
+            rows.append((key, doc_id, data))
+        rows.sort(key=functools.cmp_to_key(lambda a, b: self._compare(a[0], b[0])))
+        if self._cursor is not None:
+            rows = [row for row in rows if self._after_cursor(row[0])]
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        collection = FakeCollection(self._client, self._collection_path)
+        return [FakeSnapshot(collection.document(doc_id), data, self._fields) for _, doc_id, data in rows]
+
+    def stream(self, transaction=None, **kwargs):
+        yield from self._run()
+
+    def get(self, transaction=None, **kwargs):
+        return self._run()
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return FakeDocument(self._client, self.path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+    def list_documents(self):
+        with self._client._lock:
+            ids = list(self._client._collections.get(self.path, {}))
+        return [self.document(doc_id) for doc_id in ids]
+
+
+class FakeBatch:
+    """
+    Buffers writes and applies them together on commit(); the transaction
+    below is one of these that also satisfies firestore.transactional.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append((reference.set, (document_data,), {'merge': merge}))
+
+    def create(self, reference, document_data):
+        self._writes.append((reference.create, (document_data,), {}))
+
+    def update(self, reference, field_updates, **kwargs):
+        self._writes.append((reference.update, (field_updates,), {}))
+
+    def delete(self, reference, **kwargs):
+        self._writes.append((reference.delete, (), {}))
+
+    def commit(self, **kwargs):
+        with self._client._lock:
+            for write, args, kwargs in self._writes:
+                write(*args, **kwargs)
+        results = [None] * len(self._writes)
+        self._writes = []
+        return results
+
+
+class FakeTransaction(FakeBatch):
+    # Attributes and hooks firestore.transactional drives a transaction through
+    _max_attempts = 1
+    _read_only = False
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        results = self.commit()
+        self._clean_up()
+        return results
+
+
+class FakeFirestore:
+    """
+    An in-memory stand-in for the Firestore client (FIRESTORE_BACKEND=memory),
+    so the app can be run and its reads measured with no network or
+    credentials. Thread-safe within one process; nothing is persisted.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {}  # collection path -> {document ID: data}
+
+    def collection(self, collection_path):
+        return FakeCollection(self, collection_path)
+
+    def document(self, document_path):
+        collection_path, doc_id = document_path.rsplit('/', 1)
+        return FakeDocument(self, collection_path, doc_id)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for reference in references:
+            yield reference.get(field_paths=field_paths)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def collections(self):
+        with self._lock:
+            paths = [path for path in self._collections if '/' not in path]
+        return [FakeCollection(self, path) for path in paths]
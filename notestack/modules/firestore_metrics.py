@@ -0,0 +1,154 @@
+from modules.metrics import count_reads, count_writes
+
+# Query methods that return a narrowed query, wrapped so its reads are counted too
+_QUERY_BUILDERS = frozenset(('where', 'order_by', 'limit', 'limit_to_last', 'offset', 'select',
+                             'start_at', 'start_after', 'end_at', 'end_before'))
+
+
+def _unwrap(value):
+    # The client library inspects references it is handed (batch writes,
+    # get_all, cursors), so give it the real objects
+    if isinstance(value, _Wrapper):
+        return value._target
+    if isinstance(value, dict):
+        return {k: _unwrap(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+
+class _Wrapper:
+    __slots__ = ('_target',)
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __eq__(self, other):
+        return self._target == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+
+class InstrumentedDocument(_Wrapper):
+    __slots__ = ()
+
+    def get(self, *args, **kwargs):
+        count_reads(1, collection=self._target.parent.id)
+        return self._target.get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        count_writes(1)
+        return self._target.set(*args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        count_writes(1)
+        return self._target.create(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        count_writes(1)
+        return self._target.update(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        count_writes(1)
+        return self._target.delete(*args, **kwargs)
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedQuery(self._target.collection(*args, **kwargs))
+
+
+class InstrumentedQuery(_Wrapper):
+    """
+    A collection reference or query. Every streamed document counts as one
+    read, which is how Firestore bills queries.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in _QUERY_BUILDERS:
+            def build(*args, **kwargs):
+                return InstrumentedQuery(attr(*_unwrap(args), **_unwrap(kwargs)))
+            return build
+        return attr
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._target.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        count_writes(1)
+        return self._target.add(*args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        for snapshot in self._target.stream(*args, **kwargs):
+            count_reads(1)
+            yield snapshot
+
+    def get(self, *args, **kwargs):
+        snapshots = self._target.get(*args, **kwargs)
+        count_reads(len(snapshots))
+        return snapshots
+
+
+class InstrumentedBatch(_Wrapper):
+    """
+    A write batch; its writes are counted when it commits.
+    """
+
+    __slots__ = ('_writes',)
+
+    def __init__(self, target):
+        super().__init__(target)
+        self._writes = 0
+
+    def _add(self, method, ref, *args, **kwargs):
+        self._writes += 1
+        return getattr(self._target, method)(_unwrap(ref), *args, **kwargs)
+
+    def set(self, ref, *args, **kwargs):
+        return self._add('set', ref, *args, **kwargs)
+
+    def create(self, ref, *args, **kwargs):
+        return self._add('create', ref, *args, **kwargs)
+
+    def update(self, ref, *args, **kwargs):
+        return self._add('update', ref, *args, **kwargs)
+
+    def delete(self, ref, *args, **kwargs):
+        return self._add('delete', ref, *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        result = self._target.commit(*args, **kwargs)
+        count_writes(self._writes)
+        self._writes = 0
+        return result
+
+
+class InstrumentedFirestore(_Wrapper):
+    """
+    Wraps a Firestore client so document reads and writes are counted per
+    request (see modules.metrics). Base of modules.datastore.Datastore.
+    Transactions are handed out unwrapped (the client library drives them
+    itself): reads made through a wrapped reference inside one are counted,
+    the transaction's own writes are not.
+    """
+
+    __slots__ = ()
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedQuery(self._target.collection(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._target.document(*args, **kwargs))
+
+    def get_all(self, references, *args, **kwargs):
+        for snapshot in self._target.get_all([_unwrap(ref) for ref in references], *args, **kwargs):
+            count_reads(1)
+            yield snapshot
+
+    def batch(self, *args, **kwargs):
+        return InstrumentedBatch(self._target.batch(*args, **kwargs))
@@ -0,0 +1,300 @@
+import logging
+import os
+import re
+import html
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from modules.search_index import tokenize, INDEXED_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Characters of context shown on each side of the first match in a snippet
+SNIPPET_CONTEXT = 90
+
+# bm25() column weights: note_id and type are not searchable, metadata
+# matches (subject, department, ...) count for more than body matches
+BM25_WEIGHTS = (0.0, 0.0, 5.0, 1.0)
+PREFIX_BM25_WEIGHTS = (5.0, 1.0)
+
+
+def query_terms(query):
+    """
+    Distinct search tokens of a query, in order.
+    """
+    terms = []
+    for token in tokenize(query):
+        if token not in terms:
+            terms.append(token)
+    return terms
+
+
+def build_match_query(terms, prefix=False):
+    """
+    Turns query terms into an FTS5 MATCH expression where any term may
+    match: as whole (stemmed) words, or as prefixes of unstemmed words.
+    """
+    # Terms are [a-z0-9]+, so quoting them is enough to keep them literal
+    return ' OR '.join(f'"{term}"*' if prefix else f'"{term}"' for term in terms)
+
+
+def make_snippet(text, terms):
+    """
+    Returns an HTML snippet of text around the first word starting with one
+    of terms, with those words wrapped in <mark>. Falls back to the start of
+    the text (matches found only through stemming are not highlighted).
+    FTS5's snippet() tokenizes the whole body on every call, which is far
+    slower on long notes than this single regex scan.
+    """
+    if not text:
+        return ''
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(t) for t in terms) + r')\w*', re.IGNORECASE)
+    first = pattern.search(text)
+    center = first.start() if first else 0
+    start = max(0, center - SNIPPET_CONTEXT)
+    end = min(len(text), center + SNIPPET_CONTEXT)
+    window = ' '.join(text[start:end].split())
+
+    parts = []
+    last = 0
+    for match in pattern.finditer(window):
+        parts.append(html.escape(window[last:match.start()]))
+        parts.append('<mark>' + html.escape(match.group(0)) + '</mark>')
+        last = match.end()
+    parts.append(html.escape(window[last:]))
+    snippet = ''.join(parts)
+    if start > 0:
+        snippet = '…' + snippet
+    if end < len(text):
+        snippet += '…'
+    return snippet
+
+
+class FullTextIndex:
+    """
+    On-disk BM25 full-text index (SQLite FTS5) over note metadata and the
+    extracted text of each note. Shared by all app processes on the host and
+    kept current incrementally: metadata when a note is uploaded, the body
+    once its text has been extracted.
+
+    Words are indexed twice: Porter-stemmed in notes_fts, so "systems" finds
+    "system", and as written in the contentless notes_prefix table, so every
+    prefix of a word being typed finds it ("operati" is no prefix of the
+    stem "oper"). A query term matches a note either way.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queries = 0
+        self.last_query_ms = 0.0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            # fts rowid == indexed_notes.rowid
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS indexed_notes (
+                    rowid INTEGER PRIMARY KEY,
+                    note_id TEXT UNIQUE NOT NULL,
+                    text_hash TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                    note_id UNINDEXED, type UNINDEXED, meta, body, tokenize='porter unicode61'
+                )
+            """)
+            backfill = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'notes_prefix'").fetchone() is None
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_prefix USING fts5(
+                    meta, body, content='', prefix='2 3', tokenize='unicode61'
+                )
+            """)
+            if backfill:
+                # An index built before notes_prefix existed
+                conn.execute('INSERT INTO notes_prefix (rowid, meta, body) SELECT rowid, meta, body FROM notes_fts')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _meta(note):
+        return ' '.join(str(note.get(field) or '') for field in INDEXED_FIELDS)
+
+    @staticmethod
+    def _delete(conn, rowid):
+        # A contentless table forgets a row given the values it was indexed with
+        row = conn.execute('SELECT meta, body FROM notes_fts WHERE rowid = ?', (rowid,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("INSERT INTO notes_prefix (notes_prefix, rowid, meta, body) VALUES ('delete', ?, ?, ?)",
+                     (rowid, *row))
+        conn.execute('DELETE FROM notes_fts WHERE rowid = ?', (rowid,))
+        return row
+
+    @staticmethod
+    def _insert(conn, rowid, note_id, file_type, meta, body):
+        conn.execute('INSERT INTO notes_fts (rowid, note_id, type, meta, body) VALUES (?, ?, ?, ?, ?)',
+                     (rowid, note_id, file_type, meta, body))
+        conn.execute('INSERT INTO notes_prefix (rowid, meta, body) VALUES (?, ?, ?)', (rowid, meta, body))
+
+    def _rowid(self, conn, note_id):
+        row = conn.execute('SELECT rowid FROM indexed_notes WHERE note_id = ?', (note_id,)).fetchone()
+        if row is not None:
+            return row[0]
+        return conn.execute('INSERT INTO indexed_notes (note_id) VALUES (?)', (note_id,)).lastrowid
+
+    def index_note(self, note_id, note, text=None, text_hash=None):
+        """
+        Adds or replaces a note's metadata. The body is replaced too if text is
+        given, otherwise any body indexed earlier is kept.
+        """
+        with self._connect() as conn:
+            rowid = self._rowid(conn, note_id)
+            old = self._delete(conn, rowid)
+            if text is None:
+                body = old[1] if old else ''
+            else:
+                body = text
+                conn.execute('UPDATE indexed_notes SET text_hash = ? WHERE rowid = ?', (text_hash, rowid))
+            self._insert(conn, rowid, note_id, note.get('type', 'note'), self._meta(note), body)
+
+    def set_text(self, note_id, text_hash, text):
+        """
+        Indexes a note's extracted text. The note's metadata must already be
+        indexed; otherwise this is a no-op and returns False.
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT rowid, text_hash FROM indexed_notes WHERE note_id = ?',
+                               (note_id,)).fetchone()
+            if row is None:
+                return False
+            if row[1] == text_hash:
+                return True
+            note_id_and_type = conn.execute('SELECT note_id, type FROM notes_fts WHERE rowid = ?',
+                                            (row[0],)).fetchone()
+            old = self._delete(conn, row[0])
+            if old is not None:
+                self._insert(conn, row[0], *note_id_and_type, old[0], text)
+            conn.execute('UPDATE indexed_notes SET text_hash = ? WHERE rowid = ?', (text_hash, row[0]))
+        return True
+
+    def remove(self, note_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT rowid FROM indexed_notes WHERE note_id = ?', (note_id,)).fetchone()
+            if row is not None:
+                self._delete(conn, row[0])
+                conn.execute('DELETE FROM indexed_notes WHERE rowid = ?', (row[0],))
+
+    def text_hashes(self):
+        """
+        Returns {note_id: text_hash or None} for every indexed note.
+        """
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT note_id, text_hash FROM indexed_notes'))
+
+    def sync(self, notes, load_text):
+        """
+        Reconciles the index with notes ({note_id: note dict}, e.g. after a
+        search index rebuild): adds notes uploaded by other processes, drops
+        notes that are gone, and indexes bodies whose textHash changed.
+        load_text(text_hash) returns the text, or None if it is not available.
+        Returns False without doing anything if a sync is already running.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return False
+        try:
+            self._sync(notes, load_text)
+        finally:
+            self._sync_lock.release()
+        return True
+
+    def _sync(self, notes, load_text):
+        indexed = self.text_hashes()
+        for note_id in set(indexed) - set(notes):
+            self.remove(note_id)
+
+        added = bodies = 0
+        for note_id, note in notes.items():
+            if note_id not in indexed:
+                self.index_note(note_id, note)
+                added += 1
+            text_hash = note.get('textHash')
+            if text_hash and indexed.get(note_id) != text_hash:
+                text = load_text(text_hash)
+                if text is not None and self.set_text(note_id, text_hash, text):
+                    bodies += 1
+        if added or bodies:
+            logger.info("Full-text index synced: %d notes added, %d bodies indexed", added, bodies)
+
+    def search(self, query, file_type='all', limit=20, offset=0):
+        """
+        Returns up to limit (note_id, score, snippet) tuples, best BM25 match
+        first (lower scores rank higher). Every term must match, as a stemmed
+        word or a prefix; the score adds up the BM25 of both kinds of match.
+        Snippets are escaped HTML with <mark> around the matched words.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+
+        weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+        prefix_weights = ', '.join(str(w) for w in PREFIX_BM25_WEIGHTS)
+        # Each term has to match one way or the other (with one term, every match does)
+        term_filter = """
+            AND rowid IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?
+                          UNION SELECT rowid FROM notes_prefix WHERE notes_prefix MATCH ?)
+        """ if len(terms) > 1 else ''
+        sql = f"""
+            WITH matches (rowid, score) AS (
+                SELECT rowid, bm25(notes_fts, {weights}) FROM notes_fts WHERE notes_fts MATCH ?
+                UNION ALL
+                SELECT rowid, bm25(notes_prefix, {prefix_weights}) FROM notes_prefix WHERE notes_prefix MATCH ?
+            ), scored (rowid, score) AS (
+                SELECT rowid, SUM(score) FROM matches
+                WHERE 1 {term_filter * len(terms)}
+                GROUP BY rowid
+            )
+            SELECT f.rowid, f.note_id, scored.score
+            FROM scored JOIN notes_fts f ON f.rowid = scored.rowid
+            {'WHERE f.type = ?' if file_type != 'all' else ''}
+            ORDER BY scored.score LIMIT ? OFFSET ?
+        """
+        params = [build_match_query(terms), build_match_query(terms, prefix=True)]
+        if len(terms) > 1:
+            for term in terms:
+                params += [build_match_query([term]), build_match_query([term], prefix=True)]
+        params += ([file_type] if file_type != 'all' else []) + [limit, offset]
+
+        start = time.perf_counter()
+        results = []
+        with self._connect() as conn:
+            for rowid, note_id, score in conn.execute(sql, params).fetchall():
+                # Bodies are only read for the page being returned
+                row = conn.execute('SELECT body FROM notes_fts WHERE rowid = ?', (rowid,)).fetchone()
+                results.append((note_id, score, make_snippet(row[0] if row else '', terms)))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.queries += 1
+            self.last_query_ms = elapsed_ms
+        return results
+
+    def stats(self):
+        with self._connect() as conn:
+            notes, bodies = conn.execute(
+                'SELECT COUNT(*), COUNT(text_hash) FROM indexed_notes').fetchone()
+        with self._lock:
+            return {'notes': notes, 'withText': bodies, 'queries': self.queries,
+                    'lastQueryMs': round(self.last_query_ms, 2)}
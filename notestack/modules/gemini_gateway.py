@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import threading
+
+from modules.metrics import timed, GEMINI_LATENCY, GEMINI_429
+
+
+class RateLimitError(Exception):
+    """Raised when a request could not get a slot within the allowed wait."""
+
+
+def is_rate_limit_error(error):
+    return isinstance(error, RateLimitError) or '429' in str(error)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding up to burst
+    tokens. acquire() blocks until a token is free or the timeout passes.
+    """
+
+    def __init__(self, rate_per_minute, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or max(1, rate_per_minute // 4))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and self.clock() + wait > deadline:
+                return False
+            self.sleep(wait)
+
+    def drain(self):
+        """
+        Empties the bucket, e.g. after the upstream reported a 429.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = 0.0
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _default_model_factory(model_name):
+    # Imported lazily so the gateway can be exercised with a fake model alone
+    from modules.model_registry import registry
+    return registry.get(model_name)
+
+
+class GeminiGateway:
+    """
+    Single entry point for Gemini calls. Requests wait for a rate-limit slot
+    instead of failing, identical concurrent requests share one upstream
+    call, and upstream 429s drain the bucket and are retried.
+    """
+
+    def __init__(self, requests_per_minute=10, max_wait_seconds=30, retries_on_429=1,
+                 model_factory=None, clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(requests_per_minute, clock=clock, sleep=sleep)
+        self.max_wait_seconds = max_wait_seconds
+        self.retries_on_429 = retries_on_429
+        self.model_factory = model_factory or _default_model_factory
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counts = {'calls': 0, 'queued': 0, 'coalesced': 0, 'rejected': 0, 'upstream_429': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def generate(self, model_name, prompt):
+        """
+        Returns the response text for prompt from model_name.
+        Raises RateLimitError if no slot frees up within max_wait_seconds.
+        """
+        key = (model_name, hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._counts['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._call(model_name, prompt)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _acquire(self, model_name):
+        if not self.bucket.acquire(timeout=0):
+            self._count('queued')
+            if not self.bucket.acquire(timeout=self.max_wait_seconds):
+                self._count('rejected')
+                GEMINI_429.inc(model=model_name, source='local')
+                raise RateLimitError(f"429: no Gemini quota available within {self.max_wait_seconds}s")
+
+    def _call(self, model_name, prompt):
+        attempts = 1 + self.retries_on_429
+        for attempt in range(attempts):
+            self._acquire(model_name)
+            self._count('calls')
+            with timed(GEMINI_LATENCY, model=model_name, kind='generate', outcome='ok') as call:
+                try:
+                    response = self.model_factory(model_name).generate_content(prompt)
+                    return response.text
+                except Exception as e:
+                    if '429' not in str(e):
+                        raise
+                    call.labels['outcome'] = 'rate_limited'
+                    self._count('upstream_429')
+                    GEMINI_429.inc(model=model_name, source='upstream')
+                    # Quota is exhausted upstream: make everyone wait for a refill
+                    self.bucket.drain()
+                    if attempt == attempts - 1:
+                        raise
+
+    def stream(self, model_name, prompt):
+        """
+        Yields response text chunks from a streaming generation. Shares the
+        rate limit with generate(), but streams are never coalesced.
+        """
+        self._acquire(model_name)
+        self._count('calls')
+        with timed(GEMINI_LATENCY, model=model_name, kind='stream', outcome='ok') as call:
+            try:
+                response = self.model_factory(model_name).generate_content(prompt, stream=True)
+                for chunk in response:
+                    # Chunks without candidates (e.g. safety metadata) have no text
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue
+                    if text:
+                        yield text
+            except Exception as e:
+                if '429' in str(e):
+                    call.labels['outcome'] = 'rate_limited'
+                    self._count('upstream_429')
+                    GEMINI_429.inc(model=model_name, source='upstream')
+                    self.bucket.drain()
+                raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats['inFlight'] = len(self._flights)
+        return stats
+
+
+# Shared by the summary, questions and safety modules. The quota is per
+# process, so divide the account's per-minute limit by the worker count.
+gateway = GeminiGateway(
+    requests_per_minute=int(os.environ.get('GEMINI_REQUESTS_PER_MINUTE') or 10),
+    max_wait_seconds=float(os.environ.get('GEMINI_MAX_WAIT_SECONDS') or 30),
+)
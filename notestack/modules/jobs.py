@@ -0,0 +1,250 @@
+import logging
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Job 'status' values
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# How often a long-poll re-reads a job started by another process
+POLL_INTERVAL = 0.25
+
+# Finished jobs are purged every this many submits
+PURGE_EVERY = 50
+
+
+class JobQueueFull(Exception):
+    """Raised when an operation already has as many jobs waiting as it may queue."""
+
+
+class JobManager:
+    """
+    Runs slow generations (Gemini calls) as background jobs so no request
+    waits for them: submit() returns a job ID at once and clients poll
+    get()/wait() for the result. Each operation has its own bounded thread
+    pool and queue limit, so a burst of one kind can't starve the other.
+    A job for the same key (note text, operation, parameters) that is still
+    queued or running is reused instead of starting another.
+    Job state lives in SQLite, so a poll can land on any app process on the
+    host; a job whose process died is reported failed once stale. The
+    process running a job refreshes it every stale_seconds / 4, so a long
+    job is never mistaken for a dead one.
+    """
+
+    def __init__(self, path, limits, max_queued=16, ttl_seconds=3600, stale_seconds=600):
+        self.path = path
+        self.limits = dict(limits)      # operation -> worker threads
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._lock = threading.Lock()
+        self._executors = {}
+        self._pending = {op: 0 for op in self.limits}   # queued + running in this process
+        self._events = {}               # job_id -> Event, for jobs run by this process
+        self._heartbeat = None
+        self._submits = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE serializes "is this key already running" across processes
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def _get_executor(self, operation):
+        # Created lazily so each gunicorn worker gets its own threads after fork
+        executor = self._executors.get(operation)
+        if executor is None:
+            executor = self._executors[operation] = ThreadPoolExecutor(
+                max_workers=self.limits[operation], thread_name_prefix=f"job-{operation}")
+        return executor
+
+    def submit(self, operation, key, compute):
+        """
+        Queues compute() as a job and returns its ID, or the ID of the queued
+        or running job with the same key. Raises JobQueueFull when this
+        process already has the operation's workers busy and max_queued jobs
+        waiting.
+        """
+        if operation not in self.limits:
+            raise ValueError(f"Unknown job operation: {operation}")
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute(
+                'SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) AND updated > ? '
+                'ORDER BY created DESC LIMIT 1', (key, QUEUED, RUNNING, now - self.stale_seconds)
+            ).fetchone()
+            if row is not None:
+                with self._lock:
+                    self.deduplicated += 1
+                return row[0]
+
+            with self._lock:
+                if self._pending[operation] >= self.limits[operation] + self.max_queued:
+                    self.rejected += 1
+                    raise JobQueueFull(operation)
+                self._pending[operation] += 1
+                self.submitted += 1
+                self._submits += 1
+                purge = self._submits % PURGE_EVERY == 0
+                executor = self._get_executor(operation)
+                job_id = uuid.uuid4().hex
+                self._events[job_id] = threading.Event()
+                self._start_heartbeat()
+            conn.execute('INSERT INTO jobs (id, key, operation, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                         (job_id, key, operation, QUEUED, now, now))
+
+        executor.submit(self._run, job_id, operation, compute)
+        if purge:
+            self.purge()
+        return job_id
+
+    def _start_heartbeat(self):
+        # Started with the first job (after fork, like the executors); called with _lock held
+        if self._heartbeat is None or not self._heartbeat.is_alive():
+            self._heartbeat = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+            self._heartbeat.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(self.stale_seconds / 4)
+            with self._lock:
+                job_ids = list(self._events)
+            if not job_ids:
+                continue
+            try:
+                self.touch(job_ids)
+            except sqlite3.Error as e:
+                logger.warning("Job heartbeat failed: %s", e)
+
+    def touch(self, job_ids):
+        """
+        Marks queued or running jobs as alive now, so they don't go stale.
+        """
+        placeholders = ', '.join('?' * len(job_ids))
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET updated = ? WHERE status IN (?, ?) AND id IN ({placeholders})',
+                         (time.time(), QUEUED, RUNNING, *job_ids))
+
+    def _set(self, job_id, status, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?',
+                         (status, None if result is None else json.dumps(result), error, time.time(), job_id))
+
+    def _run(self, job_id, operation, compute):
+        try:
+            self._set(job_id, RUNNING)
+            self._set(job_id, DONE, result=compute())
+        except Exception as e:
+            logger.error("Job %s (%s) failed: %s", job_id, operation, e)
+            self._set(job_id, FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._pending[operation] -= 1
+                event = self._events.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+    def get(self, job_id):
+        """
+        Returns {'jobId', 'operation', 'status', 'result' | 'error'} for a job,
+        or None if it is unknown (or purged).
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT operation, status, result, error, created, updated FROM jobs WHERE id = ?',
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        operation, status, result, error, created, updated = row
+        job = {'jobId': job_id, 'operation': operation, 'status': status, 'created': created}
+        if status in (QUEUED, RUNNING) and time.time() - updated > self.stale_seconds:
+            # The process running it went away
+            job['status'] = FAILED
+            job['error'] = 'The job was interrupted. Please try again.'
+        elif status == DONE:
+            job['result'] = json.loads(result)
+        elif status == FAILED:
+            job['error'] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """
+        Like get(), but waits up to timeout seconds for the job to finish.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._lock:
+                event = self._events.get(job_id)
+            if event is not None:
+                # Run here: wake up as soon as it finishes
+                event.wait(remaining)
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+
+    def purge(self):
+        """
+        Drops jobs that finished (or went stale) more than ttl_seconds ago.
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE updated < ?', (time.time() - self.ttl_seconds,))
+
+    def stats(self):
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+        with self._lock:
+            return {'limits': self.limits, 'maxQueued': self.max_queued, 'pending': dict(self._pending),
+                    'submitted': self.submitted, 'deduplicated': self.deduplicated,
+                    'rejected': self.rejected, 'jobs': counts}
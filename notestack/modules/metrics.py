@@ -0,0 +1,262 @@
+import time
+import bisect
+import threading
+import contextvars
+
+from flask import has_request_context, request
+
+# Seconds; spans a cached page render up to a slow Gemini fallback chain
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Firestore documents touched by one request
+DOCUMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_text(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f'{self.name}_bucket{_label_text(self.labelnames, key, (le,))} {cumulative}')
+                le = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{_label_text(self.labelnames, key, (le,))} {series[-1]}')
+                lines.append(f'{self.name}_sum{_label_text(self.labelnames, key)} {_number(float(series[-2]))}')
+                lines.append(f'{self.name}_count{_label_text(self.labelnames, key)} {series[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-local counters and histograms rendered in the Prometheus text
+    format. With enabled False every inc()/observe() returns before taking
+    a lock, and callers skip their timing work via timed()/enabled.
+    Each gunicorn worker keeps its own numbers; scrape every worker (or
+    aggregate by instance label) to see the whole app.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(self, name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(self, name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by every module; app.py switches it off when METRICS_ENABLED is false
+metrics = MetricsRegistry()
+
+HTTP_LATENCY = metrics.histogram(
+    'notestack_http_request_duration_seconds', 'Time to build the response, by route',
+    ('route', 'method', 'status'))
+FIRESTORE_READS = metrics.counter(
+    'notestack_firestore_document_reads_total', 'Firestore documents read, by route (or background)', ('source',))
+FIRESTORE_WRITES = metrics.counter(
+    'notestack_firestore_document_writes_total', 'Firestore documents written, by route (or background)', ('source',))
+REQUEST_READS = metrics.histogram(
+    'notestack_firestore_reads_per_request', 'Firestore documents read by one request', ('route',), DOCUMENT_BUCKETS)
+REQUEST_WRITES = metrics.histogram(
+    'notestack_firestore_writes_per_request', 'Firestore documents written by one request', ('route',),
+    DOCUMENT_BUCKETS)
+EXTRACT_SECONDS = metrics.histogram(
+    'notestack_extract_text_duration_seconds', 'extract_text time per file (cache hits excluded)', ('format',))
+EXTRACT_PAGES = metrics.histogram(
+    'notestack_extract_text_pages', 'Pages (DOCX: paragraphs) with text per extracted file', ('format',), PAGE_BUCKETS)
+EXTRACTIONS = metrics.counter(
+    'notestack_extractions_total', 'Background extractions by outcome (done, cached, failed)', ('outcome',))
+GEMINI_LATENCY = metrics.histogram(
+    'notestack_gemini_request_duration_seconds', 'Gemini call time (streams: until the last chunk)',
+    ('model', 'kind', 'outcome'))
+GEMINI_429 = metrics.counter(
+    'notestack_gemini_rate_limited_total', 'Gemini calls answered with 429 (upstream) or refused locally',
+    ('model', 'source'))
+GEMINI_MODEL_USED = metrics.counter(
+    'notestack_gemini_model_used_total', 'Successful generations by model; fallback="true" when not the first choice',
+    ('model', 'fallback'))
+GEMINI_MODEL_FAILURES = metrics.counter(
+    'notestack_gemini_model_failures_total', 'Models put on cooldown after failing', ('model',))
+
+
+class RequestCounts:
+    """
+    Firestore documents read and written by the request being handled, and
+    single-document gets per collection (many of them is an N+1 pattern).
+    """
+
+    __slots__ = ('reads', 'writes', 'gets')
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.gets = {}
+
+
+# Firestore counts of the request being handled; unset in background threads
+_request_counts = contextvars.ContextVar('firestore_counts', default=None)
+
+
+def start_request():
+    """
+    Starts counting Firestore documents for the current request.
+    """
+    counts = RequestCounts()
+    _request_counts.set(counts)
+    return counts
+
+
+def finish_request(route):
+    """
+    Records the current request's Firestore counts, stops counting and
+    returns them (None if counting never started).
+    """
+    counts = _request_counts.get()
+    if counts is None:
+        return None
+    REQUEST_READS.observe(counts.reads, route=route)
+    REQUEST_WRITES.observe(counts.writes, route=route)
+    _request_counts.set(None)
+    return counts
+
+
+def request_counts():
+    """
+    Returns the current request's RequestCounts, or None outside a request.
+    """
+    return _request_counts.get()
+
+
+def route_label():
+    """
+    The URL rule of the request being handled ('unmatched' for 404s), or
+    'background' outside a request. Rules, not paths, keep label sets small.
+    """
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def count_reads(n=1, collection=None):
+    """
+    Counts n document reads; collection is given for a single-document get.
+    Requests are counted even with metrics disabled (read budgets use them).
+    """
+    counts = _request_counts.get()
+    if counts is not None:
+        counts.reads += n
+        if collection is not None:
+            counts.gets[collection] = counts.gets.get(collection, 0) + 1
+    if metrics.enabled and n:
+        FIRESTORE_READS.inc(n, source=route_label())
+
+
+def count_writes(n=1):
+    counts = _request_counts.get()
+    if counts is not None:
+        counts.writes += n
+    if metrics.enabled and n:
+        FIRESTORE_WRITES.inc(n, source=route_label())
+
+
+class timed:
+    """
+    Context manager observing elapsed seconds into a histogram, or doing
+    nothing at all while metrics are disabled. Labels can be added (or
+    changed, e.g. outcome) inside the block through .labels.
+    """
+
+    __slots__ = ('histogram', 'labels', '_start')
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self._start = None
+
+    def __enter__(self):
+        if self.histogram.registry.enabled:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._start is not None:
+            if exc_type is not None and self.labels.get('outcome') == 'ok':
+                self.labels['outcome'] = 'error'
+            self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+        return False
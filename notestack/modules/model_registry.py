@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+
+from modules.metrics import GEMINI_MODEL_USED, GEMINI_MODEL_FAILURES
+
+
+class ModelRegistry:
+    """
+    Configures the Gemini SDK once, caches GenerativeModel handles and tracks
+    which model in a fallback list last worked. Models that fail are put on a
+    cooldown so later requests skip them instead of paying their error latency.
+    """
+
+    def __init__(self, cooldown_seconds=60, clock=time.monotonic):
+        self.cooldown_seconds = cooldown_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._configured_key = None
+        self._models = {}
+        self._cooldown_until = {}
+        self._last_good = {}
+
+    def api_key(self):
+        return os.environ.get('GEMINI_API_KEY')
+
+    def _configure(self):
+        # Caller holds the lock. Re-configures only if the key changed.
+        import google.generativeai as genai
+        key = self.api_key()
+        if key != self._configured_key:
+            genai.configure(api_key=key)
+            self._configured_key = key
+            self._models.clear()
+        return genai
+
+    def get(self, model_name):
+        """
+        Returns a cached GenerativeModel handle for model_name.
+        """
+        with self._lock:
+            genai = self._configure()
+            model = self._models.get(model_name)
+            if model is None:
+                model = self._models[model_name] = genai.GenerativeModel(model_name)
+            return model
+
+    def candidates(self, models):
+        """
+        Returns models in the order to try them: the last one that worked for
+        this fallback list first, then the rest, skipping models on cooldown.
+        If every model is cooling down they are all returned, in order.
+        """
+        now = self.clock()
+        with self._lock:
+            last_good = self._last_good.get(tuple(models))
+            ordered = list(models)
+            if last_good in ordered:
+                ordered.remove(last_good)
+                ordered.insert(0, last_good)
+            available = [m for m in ordered if self._cooldown_until.get(m, 0) <= now]
+        return available or ordered
+
+    def mark_success(self, models, model_name):
+        GEMINI_MODEL_USED.inc(model=model_name, fallback='true' if model_name != models[0] else 'false')
+        with self._lock:
+            self._last_good[tuple(models)] = model_name
+            self._cooldown_until.pop(model_name, None)
+
+    def mark_failure(self, model_name):
+        GEMINI_MODEL_FAILURES.inc(model=model_name)
+        with self._lock:
+            self._cooldown_until[model_name] = self.clock() + self.cooldown_seconds
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            return {
+                'cachedModels': sorted(self._models),
+                'coolingDown': sorted(m for m, until in self._cooldown_until.items() if until > now),
+                'lastGood': sorted(set(self._last_good.values())),
+            }
+
+
+registry = ModelRegistry(
+    cooldown_seconds=float(os.environ.get('GEMINI_MODEL_COOLDOWN_SECONDS') or 60)
+)
@@ -0,0 +1,247 @@
+import time
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.safety import (prefilter_content, check_content_safety, content_sample,
+                            APPROVED, REJECTED, UNCERTAIN, MANUAL)
+from modules.result_cache import make_key
+
+logger = logging.getLogger(__name__)
+
+# Note 'status' values: uploads start pending and only approved notes are searchable
+PENDING_REVIEW = 'pending'
+
+# 'moderation.stage' of a pending note that waits for a person (/admin/moderate_note)
+MANUAL_REVIEW = 'manual'
+
+# Bump when the pre-filter rules or the prompt change, so cached verdicts are redone
+MODERATION_VERSION = 2
+
+
+def verdict_key(text_hash):
+    return make_key(text=text_hash, operation='moderation', version=MODERATION_VERSION)
+
+
+class ModerationPipeline:
+    """
+    Moderates uploaded notes off the request path, once their text has been
+    extracted. A local pre-filter settles most documents; only uncertain
+    ones go to the model. Verdicts are cached by text content hash, so a
+    re-uploaded or duplicate file is never checked twice. The verdict moves
+    the note from 'pending' to 'approved' or 'rejected'. Nothing is approved
+    unreviewed: a note whose model check could not run stays pending and is
+    retried by a background thread after retry_seconds, then after twice as
+    long each time, up to retry_max_seconds; one with no text to judge stays
+    pending for a person.
+    """
+
+    def __init__(self, db, text_cache, result_cache, max_workers=2, check=check_content_safety,
+                 retry_seconds=60, retry_max_seconds=3600, clock=time.monotonic):
+        self.db = db
+        self.text_cache = text_cache
+        self.result_cache = result_cache
+        self.max_workers = max_workers
+        self.check = check
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.clock = clock
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._listeners = []
+        self._retries = {}  # note_id -> (text_hash, attempts, clock time of next retry)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.prefiltered = 0
+        self.model_checks = 0
+        self.cached = 0
+        self.approved = 0
+        self.rejected = 0
+        self.deferred = 0
+        self.held = 0
+
+    def _get_executor(self):
+        # Created lazily so each gunicorn worker gets its own threads after fork
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='moderation')
+        return self._executor
+
+    def add_listener(self, callback):
+        """
+        Registers callback(note_id, status, note), called after a note is approved or rejected.
+        """
+        self._listeners.append(callback)
+
+    def submit(self, note_id, text_hash):
+        """
+        Queues a note whose text is in the text cache (text_hash None: its
+        text could not be extracted). Notes no longer pending are skipped, so
+        re-extracting an approved note doesn't moderate it again.
+        Returns False if it is already queued in this process.
+        """
+        with self._lock:
+            if note_id in self._in_flight:
+                return False
+            self._in_flight.add(note_id)
+            executor = self._get_executor()
+        executor.submit(self._run, note_id, text_hash)
+        return True
+
+    def _run(self, note_id, text_hash):
+        try:
+            doc = self.db.collection('notes').document(note_id).get()
+            note = doc.to_dict() if doc.exists else None
+            if note is None or note.get('status') != PENDING_REVIEW:
+                self._settled(note_id)
+                return
+            if text_hash is None:
+                verdict = {'status': MANUAL, 'stage': 'extraction', 'reason': 'No extractable text'}
+            else:
+                verdict = self.verdict(text_hash)
+            if verdict is None:
+                # Text evicted before we got to it; the note stays pending until requeued
+                logger.warning("Moderation skipped for note %s: text %s not cached", note_id, text_hash)
+                self._settled(note_id)
+                return
+            if verdict['status'] == UNCERTAIN:
+                # The model could not be asked; retried later, see retry_due()
+                delay = self._defer(note_id, text_hash)
+                logger.warning("Moderation deferred for note %s, retrying in %ds: %s",
+                               note_id, delay, verdict.get('reason', ''))
+                return
+            if verdict['status'] == MANUAL:
+                self.hold(note_id, verdict)
+                return
+            self.apply(note_id, verdict, note)
+        except Exception:
+            logger.exception("Moderation failed for note %s", note_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(note_id)
+
+    def _defer(self, note_id, text_hash):
+        with self._lock:
+            attempts = self._retries[note_id][1] if note_id in self._retries else 0
+            delay = min(self.retry_seconds * 2 ** attempts, self.retry_max_seconds)
+            self._retries[note_id] = (text_hash, attempts + 1, self.clock() + delay)
+            self.deferred += 1
+        return delay
+
+    def _settled(self, note_id):
+        with self._lock:
+            self._retries.pop(note_id, None)
+
+    def retry_due(self):
+        """
+        Queues the deferred notes whose next retry is due. Returns how many.
+        """
+        now = self.clock()
+        with self._lock:
+            due = [(note_id, text_hash) for note_id, (text_hash, _, at) in self._retries.items() if at <= now]
+        for note_id, text_hash in due:
+            self.submit(note_id, text_hash)
+        return len(due)
+
+    def _run_retries(self):
+        # Checking is cheap (no I/O), so a coarse tick is enough
+        while not self._stopped.wait(max(1, self.retry_seconds / 4)):
+            try:
+                self.retry_due()
+            except Exception:
+                logger.exception("Moderation retry error")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_retries, name='moderation-retry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def verdict(self, text_hash):
+        """
+        Returns the verdict for a text: cached, from the pre-filter, or from
+        the model. None if the text is not in the text cache.
+        """
+        key = verdict_key(text_hash)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            with self._lock:
+                self.cached += 1
+            return cached
+
+        text = self.text_cache.get(text_hash)
+        if text is None:
+            return None
+        verdict = prefilter_content(text)
+        verdict['stage'] = 'prefilter'
+        if verdict['status'] == UNCERTAIN:
+            verdict = self.check(content_sample(text))
+            verdict['stage'] = 'model'
+            with self._lock:
+                self.model_checks += 1
+        else:
+            with self._lock:
+                self.prefiltered += 1
+
+        # Still uncertain (model unavailable) is no verdict yet
+        if verdict['status'] != UNCERTAIN:
+            self.result_cache.set(key, verdict)
+        return verdict
+
+    def hold(self, note_id, verdict):
+        """
+        Leaves the note pending and marks it for manual review.
+        """
+        self.db.collection('notes').document(note_id).update({
+            'moderation': {
+                'stage': MANUAL_REVIEW,
+                'reason': f"{verdict.get('reason', '')}; needs manual review",
+                'at': datetime.datetime.now(datetime.timezone.utc),
+            }
+        })
+        with self._lock:
+            self.held += 1
+            self._retries.pop(note_id, None)
+        logger.info("Note %s held for manual review: %s", note_id, verdict.get('reason', ''))
+
+    def apply(self, note_id, verdict, note):
+        """
+        Records an approved or rejected verdict on the note and tells the listeners.
+        """
+        status = verdict['status']
+        if status not in (APPROVED, REJECTED):
+            raise ValueError(f"Not a final moderation verdict: {status}")
+        updates = {
+            'status': status,
+            'moderation': {
+                'stage': verdict.get('stage'),
+                'reason': verdict.get('reason', ''),
+                'at': datetime.datetime.now(datetime.timezone.utc),
+            }
+        }
+        self.db.collection('notes').document(note_id).update(updates)
+        with self._lock:
+            if status == APPROVED:
+                self.approved += 1
+            else:
+                self.rejected += 1
+            self._retries.pop(note_id, None)
+        logger.info("Note %s %s by %s: %s", note_id, status, verdict.get('stage'), verdict.get('reason', ''))
+
+        note = dict(note, **updates)
+        for callback in self._listeners:
+            try:
+                callback(note_id, status, note)
+            except Exception:
+                logger.exception("Moderation listener error for note %s", note_id)
+
+    def stats(self):
+        with self._lock:
+            return {'inFlight': len(self._in_flight), 'workers': self.max_workers,
+                    'prefiltered': self.prefiltered, 'modelChecks': self.model_checks,
+                    'cachedVerdicts': self.cached, 'approved': self.approved, 'rejected': self.rejected,
+                    'deferred': self.deferred, 'retrying': len(self._retries), 'heldForReview': self.held}
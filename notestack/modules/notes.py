@@ -0,0 +1,129 @@
+import json
+import base64
+
+GET_ALL_CHUNK_SIZE = 100
+
+# Fields shipped by list views (search, library, profile). Heavy fields such
+# as extractedText are left out and, where possible, not even read.
+LIST_FIELDS = ('subjectName', 'subjectCode', 'department', 'type', 'uploaderId', 'uploaderName',
+               'filename', 'fileUrl', 'timestamp', 'status', 'extraction', 'viewCount')
+
+
+def project_note(note):
+    """
+    Returns the list-view copy of a note dict: its id plus LIST_FIELDS.
+    """
+    light = {field: note[field] for field in LIST_FIELDS if field in note}
+    light['id'] = note.get('id')
+    return light
+
+
+def parse_limit(value, default, maximum):
+    """
+    Parses a ?limit= value, clamped to 1..maximum. Falls back to default.
+    """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(position):
+    """
+    Opaque page cursor for a dict describing where the next page starts.
+    """
+    raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor. Returns {} for no cursor, raises ValueError for a bad one.
+    """
+    if not cursor:
+        return {}
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(position, dict):
+        raise ValueError('Invalid cursor')
+    return position
+
+
+def fetch_notes(db, note_ids, chunk_size=GET_ALL_CHUNK_SIZE, field_paths=None):
+    """
+    Resolves a list of note IDs to note dicts using batched get_all calls.
+    Keeps the order of note_ids, skips duplicates and drops missing notes.
+    field_paths limits the fields read from Firestore.
+    """
+    ordered_ids = []
+    seen = set()
+    for note_id in note_ids:
+        if note_id and note_id not in seen:
+            seen.add(note_id)
+            ordered_ids.append(note_id)
+
+    if not ordered_ids:
+        return []
+
+    notes_ref = db.collection('notes')
+    found = {}
+    for i in range(0, len(ordered_ids), chunk_size):
+        refs = [notes_ref.document(note_id) for note_id in ordered_ids[i:i + chunk_size]]
+        # get_all returns snapshots in arbitrary order, so map them back by ID
+        for snapshot in db.get_all(refs, field_paths=field_paths):
+            if snapshot.exists:
+                note = snapshot.to_dict()
+                note['id'] = snapshot.id
+                found[snapshot.id] = note
+
+    return [found[note_id] for note_id in ordered_ids if note_id in found]
+
+
+def fetch_saved_page(db, note_ids, limit, cursor=None):
+    """
+    One page of a user's saved notes, given all their saved IDs in order.
+    Returns (notes, next cursor or None). The cursor resumes after the last
+    note shown, or at its old position if that note was unsaved meanwhile.
+    """
+    position = decode_cursor(cursor)
+    start = 0
+    if position:
+        try:
+            start = note_ids.index(position.get('after')) + 1
+        except ValueError:
+            start = max(0, int(position.get('i', 0)))
+    page_ids = note_ids[start:start + limit]
+    notes = [project_note(note) for note in fetch_notes(db, page_ids, field_paths=LIST_FIELDS)]
+
+    next_cursor = None
+    if page_ids and start + limit < len(note_ids):
+        next_cursor = encode_cursor({'after': page_ids[-1], 'i': start + limit})
+    return notes, next_cursor
+
+
+def fetch_uploads_page(db, uid, limit, cursor=None):
+    """
+    One page of the notes uploaded by uid, in document ID order, reading only
+    LIST_FIELDS. Returns (notes, next cursor or None).
+    """
+    position = decode_cursor(cursor)
+    query = (db.collection('notes')
+             .where('uploaderId', '==', uid)
+             .order_by('__name__')
+             .select(LIST_FIELDS))
+    if position.get('after'):
+        query = query.start_after({'__name__': db.collection('notes').document(position['after'])})
+    # One extra document tells us whether there is a next page
+    docs = list(query.limit(limit + 1).stream())
+
+    notes = []
+    for doc in docs[:limit]:
+        note = doc.to_dict()
+        note['id'] = doc.id
+        notes.append(project_note(note))
+    next_cursor = encode_cursor({'after': docs[limit - 1].id}) if len(docs) > limit else None
+    return notes, next_cursor
@@ -1,32 +1,21 @@
-import google.generativeai as genai
+import logging
 import os
 import json
+from modules.gemini_gateway import gateway, is_rate_limit_error
+from modules.model_registry import registry
+from modules.streaming import stream_model_json
 
-genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+logger = logging.getLogger(__name__)
 
-def generate_questions(text, mode, marks=None, num_questions=1):
-    """
-    Generates multiple exam-oriented questions with fallbacks.
-    """
-    api_key = os.environ.get('GEMINI_API_KEY')
-    if not api_key:
-        return {"questions": []}
-        
-    genai.configure(api_key=api_key)
-    
-    models_to_try = [
-        'models/gemini-2.5-flash',
-        'models/gemini-1.5-flash',
-        'models/gemini-pro',
-        'models/gemma-3-27b-it'
-    ]
-    
-    for model_name in models_to_try:
-        try:
-            print(f"DEBUG: Trying model {model_name} for {num_questions} questions...")
-            model = genai.GenerativeModel(model_name)
-            
-            prompt = f"""
+MODELS_TO_TRY = [
+    'models/gemini-2.5-flash',
+    'models/gemini-1.5-flash',
+    'models/gemini-pro',
+    'models/gemma-3-27b-it'
+]
+
+def build_questions_prompt(text, mode, marks=None, num_questions=1):
+    return f"""
             Generate EXACTLY {num_questions} {mode} questions based on the text.
             Marks per question: {marks if marks else 'N/A'}
             
@@ -49,21 +38,55 @@ def generate_questions(text, mode, marks=None, num_questions=1):
             Text:
             {text[:15000]}
             """
+
+def generate_questions(text, mode, marks=None, num_questions=1):
+    """
+    Generates multiple exam-oriented questions with fallbacks.
+    """
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return {"questions": []}
+    
+    # Starts with the model that last worked and skips ones cooling down
+    for model_name in registry.candidates(MODELS_TO_TRY):
+        try:
+            logger.debug("Trying model %s for %s questions", model_name, num_questions)
+            prompt = build_questions_prompt(text, mode, marks, num_questions)
             
-            response = model.generate_content(prompt)
-            result = response.text.strip()
+            # Rate limited and de-duplicated through the shared gateway
+            result = gateway.generate(model_name, prompt).strip()
             
             if '```json' in result:
                 result = result.split('```json')[1].split('```')[0].strip()
             elif '```' in result:
                 result = result.split('```')[1].split('```')[0].strip()
                 
-            return json.loads(result)
+            parsed = json.loads(result)
+            registry.mark_success(MODELS_TO_TRY, model_name)
+            return parsed
         except Exception as e:
             err_msg = str(e)
-            print(f"DEBUG: Model {model_name} failed: {err_msg}")
-            if "429" in err_msg:
+            logger.warning("Model %s failed: %s", model_name, err_msg)
+            if is_rate_limit_error(e):
                 return {"questions": [{"question": "AI Limit Reached: Please wait 1 minute.", "type": "error", "answer": ""}]}
+            if not isinstance(e, json.JSONDecodeError):
+                # Unavailable model: skip it for a while on later requests
+                registry.mark_failure(model_name)
             continue
             
     return {"questions": []}
+
+def is_valid_question_set(result):
+    """
+    True for generated questions, False for empty or limit-reached results.
+    """
+    questions = result.get('questions') or []
+    return bool(questions) and all(q.get('type') != 'error' for q in questions)
+
+def stream_questions(text, mode, marks=None, num_questions=1):
+    """
+    Streaming variant of generate_questions.
+    Yields ('item', 'questions', question) for each completed question and
+    finally ('done', None, result).
+    """
+    return stream_model_json(MODELS_TO_TRY, build_questions_prompt(text, mode, marks, num_questions))
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# Eviction runs every this many writes rather than on every write
+EVICT_EVERY = 50
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_key(**parts):
+    """
+    Builds a stable cache key from keyword parts (order-independent).
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent JSON result cache backed by SQLite, shared by all app processes
+    on the host. Entries expire after ttl_seconds; once the stored values grow
+    past max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, ttl_seconds, max_bytes):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps this safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss or expired entry.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, created FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                with self._lock:
+                    self.misses += 1
+                return None
+            conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        raw = json.dumps(value)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, raw, len(raw), now, now)
+            )
+        with self._lock:
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def get_or_compute(self, key, compute, bypass=False, should_store=None):
+        """
+        Returns the cached value for key, or calls compute() and stores its result.
+        bypass skips the lookup (e.g. "regenerate") but still refreshes the entry.
+        should_store(result) can veto caching, e.g. for error responses.
+        """
+        if not bypass:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        result = compute()
+        if should_store is None or should_store(result):
+            self.set(key, result)
+        return result
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones over max_bytes.
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM results WHERE created < ?', (time.time() - self.ttl_seconds,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute('SELECT key, size FROM results ORDER BY accessed').fetchall()
+            doomed = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            conn.executemany('DELETE FROM results WHERE key = ?', doomed)
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'maxBytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
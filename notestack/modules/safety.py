@@ -1,41 +1,141 @@
-import google.generativeai as genai
-import os
+import logging
+import re
 import json
+from modules.gemini_gateway import gateway, is_rate_limit_error
+from modules.model_registry import registry
+from modules.utils import PAGE_BREAK
+
+logger = logging.getLogger(__name__)
+
+# Verdicts; 'uncertain' means "ask the model" from the local pre-filter and "ask again
+# later" from check_content_safety, 'manual' that a person has to look (no text to judge)
+APPROVED = 'approved'
+REJECTED = 'rejected'
+UNCERTAIN = 'uncertain'
+MANUAL = 'manual'
+
+# Models for the safety check, tried in order through the registry (cheapest first)
+SAFETY_MODELS = [
+    'models/gemini-1.5-flash',
+    'models/gemini-2.5-flash',
+    'models/gemma-3-27b-it'
+]
+
+# The pre-filter and the model only look at the start of a document
+SAMPLE_PAGES = 3
+SAMPLE_CHARS = 5000
+
+# Fewer words than this is too little to judge locally either way
+MIN_WORDS = 40
+
+WORD_RE = re.compile(r'[a-z]+')
+
+# Terms with no place in study material: several of them reject outright
+BLOCKED_RE = re.compile(
+    r'\b(?:porn\w*|xxx|nsfw|nudes?|hentai|onlyfans|escort\w*|camgirl\w*|'
+    r'fuck\w*|motherfucker\w*|bitch\w*|cunt\w*|whore\w*|slut\w*|retard\w*)\b',
+    re.IGNORECASE
+)
+BLOCKED_REJECT_HITS = 2
+
+# Terms that are fine in a history, law or biology note but can also mean
+# trouble: any of them sends the document to the model
+SENSITIVE_RE = re.compile(
+    r'\b(?:kill\w*|murder\w*|terroris\w*|bomb\w*|suicide|weapon\w*|drugs?|'
+    r'sex\w*|naked|hate|racis\w*|casino|betting|lottery|election\w*|vote\w*|'
+    r'propaganda|crypto\w*|giveaway|click here|whatsapp)\b',
+    re.IGNORECASE
+)
+
+# Words typical of lecture notes and question papers
+ACADEMIC_WORDS = frozenset('''
+    definition define theorem lemma proof example examples algorithm equation equations formula
+    function functions chapter unit module lecture syllabus exam examination question questions
+    answer answers marks solution solve solved introduction analysis figure table derive derivation
+    explain describe calculate compute evaluate discuss compare differentiate prove given find
+    theory method methods process system systems model problem problems value values variable
+    data structure structures program programming memory circuit current voltage force energy
+    matrix vector integral derivative probability semester university department course subject
+    notes assignment experiment result results conclusion principle properties property types
+    advantages disadvantages applications application steps step case diagram graph network
+'''.split())
+
+# Share of academic words above which a clean document is approved locally
+ACADEMIC_MIN_RATIO = 0.03
+
+
+def content_sample(text):
+    """
+    Returns the first pages of extracted text, which is what moderation reads.
+    """
+    return PAGE_BREAK.join(text.split(PAGE_BREAK, SAMPLE_PAGES)[:SAMPLE_PAGES])[:SAMPLE_CHARS]
+
+
+def prefilter_content(text):
+    """
+    Cheap local first stage of moderation, run on the first pages of a note.
+    Returns { "status": "approved" | "rejected" | "uncertain" | "manual", "reason": "..." };
+    uncertain documents need check_content_safety(), manual ones a person.
+    """
+    sample = content_sample(text or '')
+    words = WORD_RE.findall(sample.lower())
+    blocked = BLOCKED_RE.findall(sample)
+    if len(blocked) >= BLOCKED_REJECT_HITS:
+        return {"status": REJECTED, "reason": f"Blocked terms: {', '.join(sorted(set(t.lower() for t in blocked))[:5])}"}
+    if not words:
+        return {"status": MANUAL, "reason": "No readable text (e.g. a scanned document)"}
+    if len(words) < MIN_WORDS:
+        return {"status": UNCERTAIN, "reason": "Too little text to judge locally"}
+    if blocked or SENSITIVE_RE.search(sample):
+        return {"status": UNCERTAIN, "reason": "Sensitive terms need context"}
+
+    academic = sum(1 for word in words if word in ACADEMIC_WORDS)
+    if academic / len(words) >= ACADEMIC_MIN_RATIO:
+        return {"status": APPROVED, "reason": "Academic content"}
+    return {"status": UNCERTAIN, "reason": "Few academic terms"}
 
-# Configure API
-genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
 
 def check_content_safety(text):
     """
     Analyzes content for safety violations using Gemini.
     Returns: JSON { "status": "approved" | "rejected", "reason": "..." }
+    If no model can be asked the status is "uncertain": no decision yet.
     """
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    
     prompt = f"""
-    You are a content safety moderator for an academic platform. 
+    You are a content safety moderator for an academic platform.
     Analyze the following text for:
     - Offensive, abusive, hateful, violent, explicit, discriminatory, political, or harmful content.
     - Irrelevant or non-academic material.
-    
+
     Return ONLY a JSON object with this format:
     {{
       "status": "approved" | "rejected",
       "reason": "<short explanation>"
     }}
-    
+
     Text to Analyze:
-    {text[:5000]}  # Limit text to avoid token limits for this check
+    {text[:SAMPLE_CHARS]}  # Limit text to avoid token limits for this check
     """
-    
-    try:
-        response = model.generate_content(prompt)
-        # Clean up code blocks if model returns them
-        result = response.text.replace('```json', '').replace('```', '').strip()
-        data = json.loads(result)
-        return data
-    except Exception as e:
-        print(f"AI Safety Check Error: {e}")
-        # Default to approved if AI fails, or handle as error? 
-        # For safety, maybe reject or allow with warning? Let's default valid for MVP unless explicit failure.
-        return {"status": "approved", "reason": "AI check unavailable, manual review marked."}
+
+    if not registry.api_key():
+        return {"status": UNCERTAIN, "reason": "AI check unavailable: GEMINI_API_KEY is not set"}
+
+    error = None
+    # Starts with the model that last worked and skips ones cooling down
+    for model_name in registry.candidates(SAFETY_MODELS):
+        try:
+            response_text = gateway.generate(model_name, prompt)
+            # Clean up code blocks if model returns them
+            result = response_text.replace('```json', '').replace('```', '').strip()
+            data = json.loads(result)
+            if data.get('status') not in (APPROVED, REJECTED):
+                raise ValueError(f"Unexpected moderation status: {data.get('status')}")
+            registry.mark_success(SAFETY_MODELS, model_name)
+            return data
+        except Exception as e:
+            logger.warning("AI safety check error with %s: %s", model_name, e)
+            error = e
+            if not is_rate_limit_error(e) and not isinstance(e, ValueError):
+                # Unavailable model: skip it for a while on later checks
+                registry.mark_failure(model_name)
+    return {"status": UNCERTAIN, "reason": f"AI check unavailable: {error}"}
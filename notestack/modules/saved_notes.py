@@ -0,0 +1,173 @@
+import logging
+import time
+import threading
+from collections import OrderedDict
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# Firestore's limit on writes per batch
+BATCH_LIMIT = 500
+
+
+def saved_doc_id(uid, note_id):
+    """
+    Deterministic saved_notes document ID, so "is it saved" is a direct get.
+    """
+    return f"{uid}_{note_id}"
+
+
+class SavedNoteIndex:
+    """
+    Per-user set of saved note IDs. Each user has one user_saved/{uid}
+    document whose noteIds array lists their saved notes in save order;
+    saved_notes/{uid}_{noteId} documents keep the per-save details. Sets are
+    cached in memory with a short TTL so saved flags are set lookups.
+    Users saved under the old random document IDs are migrated on first load.
+    """
+
+    def __init__(self, ttl_seconds=30, max_users=2048):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # uid -> (expires_at, [note_id, ...], {note_id, ...})
+        self.hits = 0
+        self.misses = 0
+        self.migrated = 0
+
+    def _migrate(self, db, uid):
+        """
+        Moves a user's legacy saved_notes documents to deterministic IDs and
+        writes their user_saved document. Returns the note IDs in save order.
+        """
+        saved = []
+        for doc in db.collection('saved_notes').where('userId', '==', uid).stream():
+            data = doc.to_dict()
+            if data.get('noteId'):
+                saved.append((doc, data))
+        # Oldest first; entries without a savedAt go last
+        dated = sorted((s for s in saved if s[1].get('savedAt')), key=lambda s: s[1]['savedAt'])
+        saved = dated + [s for s in saved if not s[1].get('savedAt')]
+
+        note_ids = []
+        seen = set()
+        writes = []
+        for doc, data in saved:
+            note_id = data['noteId']
+            if note_id not in seen:
+                seen.add(note_id)
+                note_ids.append(note_id)
+            target = saved_doc_id(uid, note_id)
+            if doc.id != target:
+                writes.append(('set', db.collection('saved_notes').document(target), data))
+                writes.append(('delete', doc.reference, None))
+        for i in range(0, len(writes), BATCH_LIMIT):
+            batch = db.batch()
+            for op, ref, data in writes[i:i + BATCH_LIMIT]:
+                if op == 'set':
+                    batch.set(ref, data)
+                else:
+                    batch.delete(ref)
+            batch.commit()
+
+        if not note_ids:
+            # Nothing to move; writing an empty list could wipe a save racing with this
+            return note_ids
+        # ArrayUnion so a save racing with the migration is not lost
+        db.collection('user_saved').document(uid).set({'noteIds': firestore.ArrayUnion(note_ids)}, merge=True)
+        with self._lock:
+            self.migrated += 1
+        logger.info("Migrated %d saved notes for %s", len(note_ids), uid)
+        return note_ids
+
+    def _load(self, db, uid):
+        """
+        Returns (ordered note IDs, set of note IDs) for uid, from memory if fresh.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(uid)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        snapshot = db.collection('user_saved').document(uid).get()
+        if snapshot.exists:
+            note_ids = list(snapshot.to_dict().get('noteIds', []))
+        else:
+            note_ids = self._migrate(db, uid)
+        self._store(uid, note_ids)
+        return note_ids, set(note_ids)
+
+    def _store(self, uid, note_ids):
+        with self._lock:
+            self._entries[uid] = (time.monotonic() + self.ttl_seconds, note_ids, set(note_ids))
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def note_ids(self, db, uid):
+        """
+        Returns the user's saved note IDs, oldest save first.
+        """
+        return list(self._load(db, uid)[0])
+
+    def ids(self, db, uid):
+        """
+        Returns the user's saved note IDs as a set, for membership checks.
+        """
+        return frozenset(self._load(db, uid)[1])
+
+    def is_saved(self, db, uid, note_id):
+        return note_id in self._load(db, uid)[1]
+
+    def save(self, db, uid, note_id, saved_at):
+        """
+        Saves note_id for uid. Returns False if it was already saved.
+        """
+        note_ids, saved = self._load(db, uid)
+        # Written even if our copy says it is saved, since it may be stale (both writes are
+        # idempotent); the copy only decides the return value
+        batch = db.batch()
+        batch.set(db.collection('saved_notes').document(saved_doc_id(uid, note_id)), {
+            'userId': uid,
+            'noteId': note_id,
+            'savedAt': saved_at
+        })
+        batch.set(db.collection('user_saved').document(uid),
+                  {'noteIds': firestore.ArrayUnion([note_id])}, merge=True)
+        batch.commit()
+        if note_id in saved:
+            return False
+        self._store(uid, note_ids + [note_id])
+        return True
+
+    def unsave(self, db, uid, note_id):
+        """
+        Removes note_id from uid's saved notes. Returns False if it was not saved.
+        """
+        note_ids, saved = self._load(db, uid)
+        # Written even if our copy says it is not saved, since it may be stale
+        batch = db.batch()
+        batch.delete(db.collection('saved_notes').document(saved_doc_id(uid, note_id)))
+        batch.set(db.collection('user_saved').document(uid),
+                  {'noteIds': firestore.ArrayRemove([note_id])}, merge=True)
+        batch.commit()
+        self._store(uid, [n for n in note_ids if n != note_id])
+        return note_id in saved
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'migrated': self.migrated}
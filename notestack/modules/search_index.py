@@ -0,0 +1,205 @@
+import logging
+import re
+import time
+import bisect
+import threading
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Metadata fields that are searchable from /api/search_notes
+INDEXED_FIELDS = ('subjectName', 'department', 'subjectCode', 'uploaderName')
+
+# Heavy fields that never need to live in the in-memory copy of a note
+EXCLUDED_FIELDS = ('extractedText',)
+
+
+def tokenize(value):
+    """
+    Lowercases and splits a string into alphanumeric tokens.
+    """
+    if not value:
+        return []
+    return TOKEN_RE.findall(str(value).lower())
+
+
+class SearchIndex:
+    """
+    In-process inverted index over approved note metadata.
+    Built once from Firestore, then kept current by add()/remove() so that
+    searches are served without any Firestore reads.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._notes = {}        # note_id -> note dict (light copy)
+        self._note_tokens = {}  # note_id -> set of tokens
+        self._postings = {}     # token -> set of note_ids
+        self._vocab = []        # sorted tokens, used for prefix lookups
+        self._refreshing = False
+        self._listeners = []
+        self.built_at = None
+        self.build_seconds = 0.0
+
+    def build(self, db):
+        """
+        (Re)builds the whole index from the approved notes in Firestore.
+        The new index is assembled off to the side and swapped in at the end,
+        so searches keep working against the old one while this runs.
+        """
+        start = time.perf_counter()
+        fresh = SearchIndex()
+        for doc in db.collection('notes').where('status', '==', 'approved').stream():
+            fresh._add(doc.id, doc.to_dict())
+
+        with self._lock:
+            self._notes = fresh._notes
+            self._note_tokens = fresh._note_tokens
+            self._postings = fresh._postings
+            self._vocab = fresh._vocab
+            self.built_at = time.time()
+            self.build_seconds = time.perf_counter() - start
+            notes = dict(self._notes)
+        logger.info("Search index built: %d notes, %d tokens in %.3fs",
+                    len(notes), len(self._vocab), self.build_seconds)
+        for callback in self._listeners:
+            try:
+                callback(notes)
+            except Exception:
+                logger.exception("Search index listener error")
+
+    def add_listener(self, callback):
+        """
+        Registers callback(notes), called with {note_id: note} after each build.
+        """
+        self._listeners.append(callback)
+
+    def maybe_refresh(self, db, max_age):
+        """
+        Rebuilds the index in a background thread once it is older than max_age
+        seconds. Picks up notes written by other app processes.
+        """
+        if not max_age or self.built_at is None:
+            return
+        if time.time() - self.built_at < max_age:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self.build(db)
+            except Exception:
+                logger.exception("Search index refresh error")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def add(self, note_id, note):
+        """
+        Adds or replaces a single note in the index.
+        """
+        with self._lock:
+            self._add(note_id, note)
+
+    def remove(self, note_id):
+        with self._lock:
+            self._remove(note_id)
+
+    def get(self, note_id):
+        """
+        Returns a copy of an indexed note, or None if it is not in the index.
+        """
+        with self._lock:
+            note = self._notes.get(note_id)
+            return dict(note) if note is not None else None
+
+    def _add(self, note_id, note):
+        if note_id in self._notes:
+            self._remove(note_id)
+
+        light = {k: v for k, v in note.items() if k not in EXCLUDED_FIELDS}
+        light['id'] = note_id
+
+        tokens = set()
+        for field in INDEXED_FIELDS:
+            tokens.update(tokenize(note.get(field)))
+
+        self._notes[note_id] = light
+        self._note_tokens[note_id] = tokens
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                bisect.insort(self._vocab, token)
+            postings.add(note_id)
+
+    def _remove(self, note_id):
+        self._notes.pop(note_id, None)
+        for token in self._note_tokens.pop(note_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(note_id)
+            if not postings:
+                del self._postings[token]
+                i = bisect.bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+
+    def _prefix_matches(self, prefix):
+        """
+        Returns the union of postings for every token starting with prefix.
+        """
+        matched = set()
+        i = bisect.bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            matched |= self._postings[self._vocab[i]]
+            i += 1
+        return matched
+
+    def search(self, query, file_type='all', after=None, limit=None):
+        """
+        Returns copies of the notes matching every query token (each token may
+        be a prefix, for as-you-type search), filtered by type.
+        Results are in note ID order, which is the same in every process and
+        across rebuilds, so a page can resume after the last ID it showed.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            # Narrowest term first keeps the intersections small
+            candidates = None
+            for term in sorted(set(terms), key=len, reverse=True):
+                matched = self._prefix_matches(term)
+                candidates = matched if candidates is None else candidates & matched
+                if not candidates:
+                    return []
+
+            results = []
+            for note_id in sorted(candidates):
+                if after is not None and note_id <= after:
+                    continue
+                note = self._notes[note_id]
+                if file_type != 'all' and note.get('type', 'note') != file_type:
+                    continue
+                results.append(dict(note))
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'notes': len(self._notes),
+                'tokens': len(self._vocab),
+                'postings': sum(len(p) for p in self._postings.values()),
+                'builtAt': self.built_at,
+                'buildSeconds': round(self.build_seconds, 4),
+            }
@@ -0,0 +1,500 @@
+import logging
+import os
+import math
+import time
+import zlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from modules.search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Hashed feature buckets per vector (float32, so 4 KB per passage at 1024)
+DEFAULT_DIM = 1024
+# Target passage length; passages end at a paragraph or sentence break
+PASSAGE_CHARS = 1500
+# Up to this many live passages, queries score every passage (one matrix
+# product). Above it an inverted-file (IVF) index is trained: passages are
+# grouped around k-means centroids and a query only scores the passages of
+# its IVF_NPROBE nearest groups.
+EXACT_MAX_ROWS = 50000
+IVF_NPROBE = 16
+IVF_SAMPLE = 20000
+IVF_ITERATIONS = 8
+IVF_SEED = 1234
+# Assignment and scoring work on blocks of this many rows to bound memory
+BLOCK_ROWS = 65536
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """
+    Splits text into (start, end) spans of about size characters, preferring
+    to cut at a blank line, then at a sentence end, in the second half of
+    each span. Whitespace-only spans are skipped.
+    """
+    spans = []
+    start = 0
+    n = len(text)
+    while start < n:
+        end = min(n, start + size)
+        if end < n:
+            cut = text.rfind('\n\n', start + size // 2, end)
+            if cut == -1:
+                cut = text.rfind('. ', start + size // 2, end)
+                if cut != -1:
+                    cut += 1
+            if cut != -1:
+                end = cut
+        if text[start:end].strip():
+            spans.append((start, end))
+        start = end
+    return spans
+
+
+def hash_vectors(texts, dim=DEFAULT_DIM):
+    """
+    Embeds texts as L2-normalized hashed term-frequency vectors over words
+    (sublinear tf, a hash bit picks the sign to cancel collisions). Bigrams
+    were tried and left out: the extra bucket collisions cost more precision
+    than they added.
+    Returns a (len(texts), dim) float32 array. IDF is applied at query time,
+    so stored vectors never need recomputing as the corpus grows.
+    """
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        counts = {}
+        for feature in tokenize(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            counts[h] = counts.get(h, 0) + 1
+        if not counts:
+            continue
+        hashes = np.fromiter(counts.keys(), dtype=np.uint32, count=len(counts))
+        tf = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(out[i], (hashes % dim).astype(np.intp), signs * tf)
+        norm = np.linalg.norm(out[i])
+        if norm:
+            out[i] /= norm
+    return out
+
+
+class SemanticIndex:
+    """
+    Local retrieval index over note passages. Vectors live in a flat float32
+    file that is memory-mapped for scoring; passage metadata (which note,
+    which text, which character span) lives in SQLite next to it. Passage
+    text itself is not stored: it is sliced from the text cache on demand.
+    Every app process on the host shares the files and catches up on other
+    processes' writes through a change sequence number.
+    """
+
+    def __init__(self, folder, dim=DEFAULT_DIM):
+        self.folder = folder
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.vectors_path = os.path.join(folder, 'vectors.f32')
+        self.db_path = os.path.join(folder, 'passages.sqlite3')
+        os.makedirs(folder, exist_ok=True)
+        if not os.path.exists(self.vectors_path):
+            open(self.vectors_path, 'ab').close()
+
+        self._lock = threading.RLock()
+        self._seq = 0
+        self._rows = 0                  # rows known to this process
+        self._row_note = []             # row -> note_id
+        self._row_span = []             # row -> (text_hash, start, end)
+        self._live = np.zeros(0, dtype=bool)
+        self._note_rows = {}            # note_id -> [row, ...] (live only)
+        self._df = np.zeros(dim, dtype=np.float64)
+        self._centroids = None          # (cells, dim) once the IVF index is trained
+        self._cell_rows = []            # cell -> [row, ...] (live only)
+        self._row_cell = np.zeros(0, dtype=np.int32)
+        self._trained_rows = 0
+        self._training = False
+        self._sync_lock = threading.Lock()
+        self._mmap = None
+        self.queries = 0
+        self.last_query_ms = 0.0
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS passages (
+                    row INTEGER PRIMARY KEY,
+                    note_id TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    deleted INTEGER NOT NULL DEFAULT 0,
+                    seq INTEGER NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS passages_note ON passages (note_id, deleted)')
+            conn.execute('CREATE INDEX IF NOT EXISTS passages_seq ON passages (seq)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE serializes writers across processes, so row numbers
+        # and file offsets are handed out once
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def add_note(self, note_id, text_hash, text):
+        """
+        Indexes the passages of a note's text, replacing any passages indexed
+        for an older text. Returns the number of passages added (0 if this
+        text is already indexed).
+        """
+        if self.indexed_hash(note_id) == text_hash:
+            return 0
+        spans = split_passages(text)
+        vectors = hash_vectors([text[s:e] for s, e in spans], self.dim)
+        with self._write() as conn:
+            # Checked again under the write lock: another process may have won
+            row = conn.execute('SELECT text_hash FROM passages WHERE note_id = ? AND deleted = 0 LIMIT 1',
+                               (note_id,)).fetchone()
+            if row is not None and row[0] == text_hash:
+                return 0
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM passages').fetchone()[0]
+            conn.execute('UPDATE passages SET deleted = 1, seq = ? WHERE note_id = ? AND deleted = 0',
+                         (seq, note_id))
+            first = conn.execute('SELECT COALESCE(MAX(row), -1) + 1 FROM passages').fetchone()[0]
+            conn.executemany(
+                'INSERT INTO passages (row, note_id, text_hash, start, end, seq) VALUES (?, ?, ?, ?, ?, ?)',
+                [(first + i, note_id, text_hash, s, e, seq) for i, (s, e) in enumerate(spans)]
+            )
+            # Vectors are on disk before the rows become visible at COMMIT
+            with open(self.vectors_path, 'r+b') as f:
+                f.seek(first * self.row_bytes)
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return len(spans)
+
+    def remove_note(self, note_id):
+        with self._write() as conn:
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM passages').fetchone()[0]
+            conn.execute('UPDATE passages SET deleted = 1, seq = ? WHERE note_id = ? AND deleted = 0',
+                         (seq, note_id))
+
+    def indexed_hash(self, note_id):
+        """
+        Returns the text_hash a note is indexed under, or None.
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT text_hash FROM passages WHERE note_id = ? AND deleted = 0 LIMIT 1',
+                               (note_id,)).fetchone()
+        return row[0] if row else None
+
+    def indexed_hashes(self):
+        """
+        Returns {note_id: text_hash} for every note with live passages.
+        """
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT DISTINCT note_id, text_hash FROM passages WHERE deleted = 0'))
+
+    def _vectors(self):
+        # Caller holds the lock. Re-maps once the file has grown past the map.
+        if self._mmap is None or self._mmap.shape[0] < self._rows:
+            rows = os.path.getsize(self.vectors_path) // self.row_bytes
+            if rows == 0:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._mmap
+
+    def _assign(self, centroids, vectors, rows):
+        """
+        Nearest centroid for each of rows, computed block by block.
+        """
+        cells = np.empty(len(rows), dtype=np.int32)
+        for i in range(0, len(rows), BLOCK_ROWS):
+            block = np.asarray(vectors[rows[i:i + BLOCK_ROWS]])
+            cells[i:i + BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+        return cells
+
+    def train(self):
+        """
+        Trains the IVF index with spherical k-means (about sqrt(passages)
+        cells) on a sample of live passages, then assigns every passage.
+        Passages added later are assigned to the nearest existing cell.
+        """
+        with self._lock:
+            vectors = self._vectors()
+            live_rows = np.flatnonzero(self._live)
+        if not len(live_rows):
+            return
+        start = time.perf_counter()
+        rng = np.random.default_rng(IVF_SEED)
+        cells = int(min(1024, max(16, math.sqrt(len(live_rows)))))
+        sample = np.sort(rng.choice(live_rows, min(IVF_SAMPLE, len(live_rows)), replace=False))
+        data = np.asarray(vectors[sample])
+        centroids = data[rng.choice(len(data), min(cells, len(data)), replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            norms = np.linalg.norm(sums, axis=1)
+            # Empty cells keep their previous centroid
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        # The slow part runs without the lock; rows that changed meanwhile
+        # are fixed up below
+        assignment = self._assign(centroids, vectors, live_rows)
+        with self._lock:
+            vectors = self._vectors()
+            row_cell = np.full(self._rows, -1, dtype=np.int32)
+            row_cell[live_rows] = assignment
+            row_cell[~self._live] = -1
+            missing = np.flatnonzero(self._live & (row_cell < 0))
+            if len(missing):
+                row_cell[missing] = self._assign(centroids, vectors, missing)
+            cell_rows = [[] for _ in range(len(centroids))]
+            for row in np.flatnonzero(row_cell >= 0).tolist():
+                cell_rows[row_cell[row]].append(row)
+            self._row_cell = row_cell
+            self._cell_rows = cell_rows
+            self._centroids = centroids
+            self._trained_rows = int(self._live.sum())
+        logger.info("Semantic IVF index trained: %d cells over %d passages in %.2fs",
+                    len(centroids), self._trained_rows, time.perf_counter() - start)
+
+    def _maybe_train(self):
+        # Caller holds the lock. Trains in the background once the corpus is
+        # past EXACT_MAX_ROWS and again whenever it has doubled since.
+        live = int(self._live.sum())
+        if live <= EXACT_MAX_ROWS or self._training:
+            return
+        if self._centroids is not None and live < 2 * self._trained_rows:
+            return
+        self._training = True
+
+        def _run():
+            try:
+                self.train()
+            except Exception:
+                logger.exception("Semantic index training error")
+            finally:
+                self._training = False
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def refresh(self):
+        """
+        Applies passages added or removed (by any process) since the last call.
+        """
+        with self._connect() as conn:
+            changes = conn.execute(
+                'SELECT row, note_id, text_hash, start, end, deleted, seq FROM passages '
+                'WHERE seq > ? ORDER BY seq, row', (self._seq,)).fetchall()
+        if not changes:
+            return
+        with self._lock:
+            new_rows = [c for c in changes if c[0] >= self._rows and not c[5]]
+            if new_rows:
+                top = max(c[0] for c in new_rows) + 1
+                grow = top - self._rows
+                self._row_note.extend([None] * grow)
+                self._row_span.extend([None] * grow)
+                self._live = np.concatenate([self._live, np.zeros(grow, dtype=bool)])
+                self._row_cell = np.concatenate([self._row_cell, np.full(grow, -1, dtype=np.int32)])
+                self._rows = top
+            vectors = self._vectors()
+
+            added = [c[0] for c in new_rows]
+            added_set = set(added)
+            for row, note_id, text_hash, start, end, deleted, seq in changes:
+                if deleted and row < len(self._live) and self._live[row]:
+                    self._live[row] = False
+                    self._note_rows[note_id].remove(row)
+                    if not self._note_rows[note_id]:
+                        del self._note_rows[note_id]
+                    self._df -= vectors[row] != 0
+                    if self._row_cell[row] >= 0:
+                        self._cell_rows[self._row_cell[row]].remove(row)
+                        self._row_cell[row] = -1
+                elif not deleted and row in added_set:
+                    self._row_note[row] = note_id
+                    self._row_span[row] = (text_hash, start, end)
+                    self._live[row] = True
+                    self._note_rows.setdefault(note_id, []).append(row)
+                self._seq = max(self._seq, seq)
+
+            if added:
+                block = np.asarray(vectors[added])
+                self._df += (block != 0).sum(axis=0)
+                if self._centroids is not None:
+                    cells = np.argmax(block @ self._centroids.T, axis=1)
+                    for row, cell in zip(added, cells.tolist()):
+                        self._row_cell[row] = cell
+                        self._cell_rows[cell].append(row)
+
+    def _query_vector(self, query):
+        q = hash_vectors([query], self.dim)[0]
+        if not q.any():
+            return None
+        live = max(int(self._live.sum()), 1)
+        idf = np.log((live + 1) / (self._df + 1)) + 1.0
+        q = (q * idf).astype(np.float32)
+        return q / np.linalg.norm(q)
+
+    def _ivf_candidates(self, q):
+        cell_scores = self._centroids @ q
+        probes = np.argsort(-cell_scores)[:IVF_NPROBE]
+        rows = [self._cell_rows[cell] for cell in probes.tolist()]
+        return np.fromiter((row for cell in rows for row in cell), dtype=np.int64,
+                           count=sum(len(cell) for cell in rows))
+
+    def search(self, query, k=8, note_ids=None):
+        """
+        Returns up to k (note_id, text_hash, start, end, score) passages most
+        similar to query, best first. note_ids restricts the search to those
+        notes (scored exactly); otherwise small corpora are scored exactly and
+        large ones through the IVF index once it is trained.
+        """
+        self.refresh()
+        start_time = time.perf_counter()
+        with self._lock:
+            q = self._query_vector(query)
+            if q is None or not self._rows:
+                return []
+            vectors = self._vectors()
+
+            if note_ids is not None:
+                rows = [row for note_id in note_ids for row in self._note_rows.get(note_id, ())]
+                candidates = np.array(rows, dtype=np.int64)
+            else:
+                self._maybe_train()
+                candidates = None
+                if self._centroids is not None and int(self._live.sum()) > EXACT_MAX_ROWS:
+                    candidates = self._ivf_candidates(q)
+                    if len(candidates) < k:
+                        candidates = None
+
+            if candidates is None:
+                # Whole matrix, block by block; dead rows masked out
+                scores = np.empty(self._rows, dtype=np.float32)
+                for i in range(0, self._rows, BLOCK_ROWS):
+                    scores[i:i + BLOCK_ROWS] = np.asarray(vectors[i:min(i + BLOCK_ROWS, self._rows)]) @ q
+                scores[~self._live] = -np.inf
+                candidates = np.arange(self._rows)
+            else:
+                if not len(candidates):
+                    return []
+                scores = np.asarray(vectors[candidates]) @ q
+
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            results = []
+            for i in best:
+                # Dead rows and passages sharing no feature with the query
+                if not np.isfinite(scores[i]) or scores[i] <= 0:
+                    continue
+                row = int(candidates[i])
+                text_hash, start, end = self._row_span[row]
+                results.append((self._row_note[row], text_hash, start, end, float(scores[i])))
+            self.queries += 1
+            self.last_query_ms = (time.perf_counter() - start_time) * 1000
+            return results
+
+    def relevant_text(self, query, note_ids, max_chars, load_text):
+        """
+        Picks the passages of note_ids most relevant to query, up to max_chars
+        in total, and returns them joined in reading order (by note, then by
+        position). load_text(text_hash) returns a note's full text or None.
+        Returns '' if none of the notes have indexed passages.
+        """
+        hits = self.search(query, k=max(8, max_chars // (PASSAGE_CHARS // 2)), note_ids=note_ids)
+        chosen = []
+        total = 0
+        for note_id, text_hash, start, end, score in hits:
+            if total + (end - start) > max_chars and chosen:
+                continue
+            chosen.append((note_id, text_hash, start, end))
+            total += end - start
+
+        order = {note_id: i for i, note_id in enumerate(note_ids)}
+        chosen.sort(key=lambda c: (order.get(c[0], len(order)), c[2]))
+        texts = {}
+        passages = []
+        for note_id, text_hash, start, end in chosen:
+            if text_hash not in texts:
+                texts[text_hash] = load_text(text_hash)
+            if texts[text_hash]:
+                passages.append(texts[text_hash][start:end].strip())
+        return '\n\n'.join(passages)
+
+    def sync(self, notes, load_text):
+        """
+        Indexes notes ({note_id: note dict}) whose textHash is not indexed yet
+        and drops notes that are gone. For use after a search index rebuild.
+        Returns False without doing anything if a sync is already running.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return False
+        try:
+            self._sync(notes, load_text)
+        finally:
+            self._sync_lock.release()
+        return True
+
+    def _sync(self, notes, load_text):
+        indexed = self.indexed_hashes()
+        for note_id in set(indexed) - set(notes):
+            self.remove_note(note_id)
+        added = 0
+        for note_id, note in notes.items():
+            text_hash = note.get('textHash')
+            if text_hash and indexed.get(note_id) != text_hash:
+                text = load_text(text_hash)
+                if text:
+                    self.add_note(note_id, text_hash, text)
+                    added += 1
+        if added:
+            logger.info("Semantic index synced: %d notes added", added)
+
+    def stats(self):
+        self.refresh()
+        with self._lock:
+            live = int(self._live.sum())
+            return {
+                'passages': live,
+                'notes': len(self._note_rows),
+                'dim': self.dim,
+                'vectorBytes': self._rows * self.row_bytes,
+                'ivfCells': len(self._cell_rows) if self._centroids is not None else 0,
+                'queries': self.queries,
+                'lastQueryMs': round(self.last_query_ms, 2),
+            }
+
+
+def default_query(note):
+    """
+    Default retrieval query for a note when the user gave no topic: its
+    subject and department, which is what exam questions are about.
+    """
+    parts = [note.get('subjectName'), note.get('department'), note.get('subjectCode')]
+    return ' '.join(str(p) for p in parts if p)
@@ -0,0 +1,276 @@
+import os
+import re
+import shutil
+import mimetypes
+import threading
+
+from werkzeug.security import safe_join
+
+# Content-addressed upload names are <sha256>.<ext>
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+# Parts of multipart uploads and ranged downloads to and from object storage
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+def is_blob_name(filename):
+    return bool(filename) and bool(BLOB_NAME_RE.match(filename))
+
+
+def shard_path(name):
+    """
+    Relative path of a stored file: blobs are fanned out two levels deep by
+    hash prefix (ab/cd/abcd...pdf), legacy names stay at the top.
+    """
+    if is_blob_name(name):
+        return os.path.join(name[:2], name[2:4], name)
+    return name
+
+
+def _safe_path(root, name):
+    # Route names can't contain '/', but '..' or dotfiles like '.incoming' can still arrive
+    if not name or name.startswith('.'):
+        return None
+    return safe_join(root, shard_path(name))
+
+
+class LocalStorage:
+    """
+    Keeps uploads on the local disk under the uploads folder. Each blob
+    shard directory holds a handful of files even with millions stored,
+    so lookups and directory listings stay cheap. Suited to a single host.
+    """
+
+    backend = 'local'
+    shared = False
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.local_root = folder
+        self.spool_folder = os.path.join(folder, '.incoming')
+        os.makedirs(self.spool_folder, exist_ok=True)
+        self._shard_flat_blobs()
+
+    def _shard_flat_blobs(self):
+        # Blobs written before sharding sit in the top folder
+        for name in os.listdir(self.folder):
+            if is_blob_name(name):
+                self.put(os.path.join(self.folder, name), name)
+
+    def local_path(self, name):
+        """
+        Returns a path on the local disk holding the file.
+        Raises FileNotFoundError if it isn't stored.
+        """
+        path = _safe_path(self.folder, name)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(name)
+        return path
+
+    def relative_path(self, name):
+        return shard_path(name)
+
+    def exists(self, name):
+        path = _safe_path(self.folder, name)
+        return path is not None and os.path.isfile(path)
+
+    def put(self, src_path, name):
+        """
+        Moves a finished file into the store under name.
+        """
+        dest = os.path.join(self.folder, shard_path(name))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(src_path, dest)
+
+    def delete(self, name):
+        try:
+            os.remove(os.path.join(self.folder, shard_path(name)))
+        except OSError:
+            pass
+
+    def blobs(self):
+        """
+        Yields (name, mtime) for every stored blob.
+        """
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if is_blob_name(name):
+                    try:
+                        yield name, os.path.getmtime(os.path.join(root, name))
+                    except OSError:
+                        continue
+
+    def stats(self):
+        return {'backend': self.backend, 'folder': self.folder}
+
+
+class ObjectStorage:
+    """
+    Keeps uploads in an S3-compatible bucket (AWS S3, Google Cloud Storage
+    through its XML interoperability API, MinIO), so app instances need no
+    shared disk. boto3's transfer manager streams uploads and downloads in
+    part_size multipart chunks, never holding a whole file in memory.
+    Files are read through a size-bounded local cache; blobs are
+    content-addressed, so a cached copy never goes stale.
+    """
+
+    backend = 's3'
+    shared = True
+
+    def __init__(self, bucket, cache_folder, cache_max_bytes, prefix='', endpoint_url=None,
+                 region=None, part_size=DEFAULT_PART_SIZE, client=None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.exceptions import ClientError
+
+        # client can be any S3 API stand-in (e.g. a local MinIO or moto server)
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.transfer = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                       io_chunksize=256 * 1024, max_concurrency=4)
+        self._client_error = ClientError
+        self.cache_folder = cache_folder
+        self.cache_max_bytes = cache_max_bytes
+        self.local_root = cache_folder
+        self.spool_folder = os.path.join(cache_folder, '.incoming')
+        os.makedirs(self.spool_folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._cache_bytes = sum(size for _, _, size in self._cached())
+        self.downloads = 0
+        self.uploads = 0
+        self.cache_hits = 0
+
+    def key(self, name):
+        # Blob names start with their hash, which spreads keys across the
+        # store's partitions without an extra shard prefix
+        return self.prefix + name
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def local_path(self, name):
+        """
+        Returns a path on the local disk holding the file, downloading it
+        into the cache on a miss. Raises FileNotFoundError if it isn't stored.
+        """
+        path = _safe_path(self.cache_folder, name)
+        if path is None:
+            raise FileNotFoundError(name)
+        try:
+            os.utime(path)
+            with self._lock:
+                self.cache_hits += 1
+            return path
+        except OSError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.client.download_file(self.bucket, self.key(name), tmp_path, Config=self.transfer)
+        except self._client_error as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self._is_missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+        self._add_to_cache(tmp_path, path)
+        with self._lock:
+            self.downloads += 1
+        return path
+
+    def relative_path(self, name):
+        return shard_path(name)
+
+    def exists(self, name):
+        path = _safe_path(self.cache_folder, name)
+        if path is None:
+            return False
+        if os.path.isfile(path):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+            return True
+        except self._client_error as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def put(self, src_path, name):
+        """
+        Uploads a finished file under name, then keeps it as the cached copy.
+        """
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_file(src_path, self.bucket, self.key(name), Config=self.transfer,
+                                ExtraArgs={'ContentType': content_type})
+        with self._lock:
+            self.uploads += 1
+        path = os.path.join(self.cache_folder, shard_path(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._add_to_cache(src_path, path)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        path = os.path.join(self.cache_folder, shard_path(name))
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._cache_bytes -= size
+
+    def blobs(self):
+        """
+        Yields (name, mtime) for every stored blob.
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                name = obj['Key'][len(self.prefix):]
+                if is_blob_name(name):
+                    yield name, obj['LastModified'].timestamp()
+
+    def _cached(self):
+        for root, dirs, files in os.walk(self.cache_folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if not is_blob_name(name):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _add_to_cache(self, src_path, path):
+        # shutil.move renames when both are on one disk (spools are) and copies otherwise
+        size = os.path.getsize(src_path)
+        shutil.move(src_path, path)
+        with self._lock:
+            self._cache_bytes += size
+            if self._cache_bytes > self.cache_max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # mtimes are the LRU clock (hits touch the file), as in the text cache
+        entries = sorted(self._cached(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.cache_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._cache_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.backend, 'bucket': self.bucket, 'prefix': self.prefix,
+                    'cacheBytes': self._cache_bytes, 'cacheMaxBytes': self.cache_max_bytes,
+                    'cacheHits': self.cache_hits, 'downloads': self.downloads, 'uploads': self.uploads}
@@ -0,0 +1,152 @@
+import logging
+import json
+
+from modules.gemini_gateway import gateway, is_rate_limit_error
+from modules.model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = ' \t\r\n'
+
+
+class IncrementalJSONParser:
+    """
+    Parses one JSON object as it arrives in chunks and reports values as soon
+    as they are complete:
+      ('field', key, value) for each top-level field
+      ('item', key, value) for each element of a top-level array
+    Anything before the first '{' (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buf = ''
+        self.pos = 0
+        self.start = None       # index of the opening '{'
+        self.end = None         # index just past the closing '}'
+        self.stack = []         # open containers: dicts with kind/start/key/expect_key
+        self.in_string = False
+        self.escape = False
+        self.token_start = None  # start of the current string or bare scalar
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text and returns the events it completed.
+        """
+        self.buf += chunk
+        events = []
+        while self.pos < len(self.buf) and not self.complete:
+            self._step(self.buf[self.pos], events)
+            self.pos += 1
+        return events
+
+    def result(self):
+        """
+        Returns the fully parsed object once the closing brace has been seen.
+        """
+        if not self.complete:
+            raise ValueError('Incomplete JSON object')
+        return json.loads(self.buf[self.start:self.end])
+
+    def _step(self, ch, events):
+        pos = self.pos
+        if self.start is None:
+            if ch == '{':
+                self.start = pos
+                self.stack.append({'kind': 'obj', 'start': pos, 'key': None, 'expect_key': True})
+            return
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == '\\':
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                self._end_string(pos + 1, events)
+            return
+
+        # Bare scalars (numbers, true, false, null) end at a delimiter
+        if self.token_start is not None and (ch in WHITESPACE or ch in ',]}'):
+            self._complete_value(self.token_start, pos, events)
+            self.token_start = None
+
+        top = self.stack[-1]
+        if ch == '"':
+            self.in_string = True
+            self.token_start = pos
+        elif ch in '{[':
+            self.stack.append({'kind': 'obj' if ch == '{' else 'arr', 'start': pos,
+                               'key': None, 'expect_key': ch == '{'})
+        elif ch in '}]':
+            frame = self.stack.pop()
+            if not self.stack:
+                self.end = pos + 1
+                return
+            self._complete_value(frame['start'], pos + 1, events)
+        elif ch == ':':
+            top['expect_key'] = False
+        elif ch == ',':
+            if top['kind'] == 'obj':
+                top['expect_key'] = True
+        elif ch not in WHITESPACE and self.token_start is None:
+            self.token_start = pos
+
+    def _end_string(self, end, events):
+        start, self.token_start = self.token_start, None
+        top = self.stack[-1]
+        if top['kind'] == 'obj' and top['expect_key']:
+            top['key'] = json.loads(self.buf[start:end])
+        else:
+            self._complete_value(start, end, events)
+
+    def _complete_value(self, start, end, events):
+        depth = len(self.stack)
+        try:
+            value = json.loads(self.buf[start:end])
+        except ValueError:
+            return
+        if depth == 1:
+            events.append(('field', self.stack[0]['key'], value))
+        elif depth == 2 and self.stack[1]['kind'] == 'arr':
+            events.append(('item', self.stack[0]['key'], value))
+
+
+def stream_model_json(models, prompt):
+    """
+    Streams a JSON response for prompt, trying models in registry order.
+    Yields parser events as they complete, then ('done', None, result).
+    A model may only be skipped for the next one before it produced output.
+    """
+    last_error = None
+    for model_name in registry.candidates(models):
+        parser = IncrementalJSONParser()
+        emitted = False
+        try:
+            logger.debug("Streaming from model %s", model_name)
+            for chunk in gateway.stream(model_name, prompt):
+                for event in parser.feed(chunk):
+                    emitted = True
+                    yield event
+            result = parser.result()
+            registry.mark_success(models, model_name)
+            yield ('done', None, result)
+            return
+        except Exception as e:
+            logger.warning("Streaming model %s failed: %s", model_name, e)
+            if emitted or is_rate_limit_error(e):
+                raise
+            if not isinstance(e, ValueError):
+                registry.mark_failure(model_name)
+            last_error = e
+    raise RuntimeError(f"Generation failed. Error: {last_error}")
+
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Events message with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
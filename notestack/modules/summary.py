@@ -1,36 +1,41 @@
-import google.generativeai as genai
+import logging
 import os
+import re
 import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.gemini_gateway import gateway, is_rate_limit_error
+from modules.model_registry import registry
+from modules.streaming import stream_model_json
+from modules.result_cache import make_key, text_hash
+from modules.utils import PAGE_BREAK
 
-genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+logger = logging.getLogger(__name__)
 
-def generate_summary(text):
-    """
-    Generates academic summary with fallbacks.
-    Returns: JSON { "short_summary": "...", "detailed_summary": ["...", "..."] }
-    """
-    api_key = os.environ.get('GEMINI_API_KEY')
-    if not api_key:
-        return {"short_summary": "API Key missing.", "detailed_summary": []}
-        
-    genai.configure(api_key=api_key)
-    
-    # Try multiple models - prioritized for Free Tier
-    # Try multiple models - verified models/gemini-2.5-flash works for this API key
-    models_to_try = [
-        'models/gemini-2.5-flash',
-        'models/gemini-1.5-flash',
-        'models/gemini-pro',
-        'models/gemma-3-27b-it'
-    ]
-    
-    last_error = ""
-    for model_name in models_to_try:
-        try:
-            print(f"DEBUG: Trying model {model_name}...")
-            model = genai.GenerativeModel(model_name)
-            
-            prompt = f"""
+# Try multiple models - prioritized for Free Tier
+# Try multiple models - verified models/gemini-2.5-flash works for this API key
+MODELS_TO_TRY = [
+    'models/gemini-2.5-flash',
+    'models/gemini-1.5-flash',
+    'models/gemini-pro',
+    'models/gemma-3-27b-it'
+]
+
+# Notes longer than a single prompt are summarized chunk by chunk (map-reduce)
+SINGLE_PASS_CHARS = 15000
+CHUNK_MIN_CHARS = 4000
+CHUNK_MAX_CHARS = 12000
+REDUCE_MAX_CHARS = 15000
+
+# Lines that look like headings: "Chapter 3", "UNIT II", "2.1 Stacks", "INTRODUCTION"
+HEADING_RE = re.compile(
+    r'^\s*(?:(?i:chapter|unit|module|section|part|lecture)\b'
+    r'|\d+(?:\.\d+)*[.)]?\s+[A-Z]'
+    r'|[A-Z][A-Z0-9 ,:&()-]{3,60}$)'
+)
+
+def build_summary_prompt(text):
+    return f"""
             Summarize the following academic notes. Return ONLY JSON.
             {{
               "short_summary": "3-5 lines",
@@ -40,9 +45,19 @@ def generate_summary(text):
             Text:
             {text[:15000]}
             """
-            
-            response = model.generate_content(prompt)
-            result = response.text.strip()
+
+def _generate_json(prompt):
+    """
+    Runs prompt through the fallback models and returns the parsed JSON.
+    Raises on rate limits straight away, or once every model has failed.
+    """
+    last_error = ""
+    # Starts with the model that last worked and skips ones cooling down
+    for model_name in registry.candidates(MODELS_TO_TRY):
+        try:
+            logger.debug("Trying model %s", model_name)
+            # Rate limited and de-duplicated through the shared gateway
+            result = gateway.generate(model_name, prompt).strip()
             
             # Extract JSON from markdown if necessary
             if '```json' in result:
@@ -50,13 +65,231 @@ def generate_summary(text):
             elif '```' in result:
                 result = result.split('```')[1].split('```')[0].strip()
             
-            return json.loads(result)
+            parsed = json.loads(result)
+            registry.mark_success(MODELS_TO_TRY, model_name)
+            return parsed
         except Exception as e:
             err_msg = str(e)
-            print(f"DEBUG: Model {model_name} failed: {err_msg}")
-            if "429" in err_msg:
-                return {"short_summary": "AI Limit Reached: You've hit Google's free tier limit. Please wait 1 minute before trying again.", "detailed_summary": []}
+            logger.warning("Model %s failed: %s", model_name, err_msg)
+            if is_rate_limit_error(e):
+                raise
+            if not isinstance(e, json.JSONDecodeError):
+                # Unavailable model: skip it for a while on later requests
+                registry.mark_failure(model_name)
             last_error = err_msg
             continue
             
-    return {"short_summary": f"Generation failed. Error: {last_error}", "detailed_summary": []}
+    raise RuntimeError(last_error)
+
+def _error_summary(error):
+    if is_rate_limit_error(error):
+        return {"short_summary": "AI Limit Reached: You've hit Google's free tier limit. Please wait 1 minute before trying again.", "detailed_summary": []}
+    return {"short_summary": f"Generation failed. Error: {error}", "detailed_summary": []}
+
+def generate_summary(text):
+    """
+    Generates academic summary with fallbacks.
+    Returns: JSON { "short_summary": "...", "detailed_summary": ["...", "..."] }
+    """
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return {"short_summary": "API Key missing.", "detailed_summary": []}
+    
+    try:
+        return _generate_json(build_summary_prompt(text))
+    except Exception as e:
+        return _error_summary(e)
+
+def is_valid_summary(result):
+    """
+    True for a real summary, False for the limit/failure placeholders above.
+    """
+    return bool(result.get('detailed_summary'))
+
+def stream_summary(text):
+    """
+    Streaming variant of generate_summary.
+    Yields ('field', 'short_summary', str), ('item', 'detailed_summary', str)
+    and finally ('done', None, summary) as the model produces them.
+    """
+    return stream_model_json(MODELS_TO_TRY, build_summary_prompt(text))
+
+def needs_map_reduce(text):
+    return len(text) > SINGLE_PASS_CHARS
+
+def _segments(text, max_chars):
+    """
+    Yields page-sized pieces of text, splitting oversized pages before
+    heading lines (or at line ends when there are no headings).
+    """
+    for page in text.split(PAGE_BREAK):
+        if len(page) <= max_chars:
+            yield page
+            continue
+        current, size = [], 0
+        for line in page.split('\n'):
+            at_heading = size >= CHUNK_MIN_CHARS and HEADING_RE.match(line)
+            if current and (at_heading or size + len(line) > max_chars):
+                yield '\n'.join(current)
+                current, size = [], 0
+            while len(line) > max_chars:
+                yield line[:max_chars]
+                line = line[max_chars:]
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            yield '\n'.join(current)
+
+def chunk_text(text, max_chars=CHUNK_MAX_CHARS, min_chars=CHUNK_MIN_CHARS):
+    """
+    Groups pages into chunks of at most max_chars. Boundaries are content
+    defined: past min_chars a chunk ends after any page whose hash picks it
+    as a cut point, so an edit only changes the chunks around it and the
+    rest keep their cached summaries.
+    """
+    chunks, current, size = [], [], 0
+    for segment in _segments(text, max_chars):
+        if not segment.strip():
+            continue
+        if current and size + len(segment) > max_chars:
+            chunks.append('\n'.join(current))
+            current, size = [], 0
+        current.append(segment)
+        size += len(segment) + 1
+        if size >= min_chars and zlib.crc32(segment.encode('utf-8')) % 4 == 0:
+            chunks.append('\n'.join(current))
+            current, size = [], 0
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+def build_chunk_prompt(chunk):
+    return f"""
+            Summarize this section of a longer set of academic notes. Return ONLY JSON.
+            {{
+              "short_summary": "1-2 lines",
+              "detailed_summary": ["bullet", "point"]
+            }}
+            
+            Text:
+            {chunk}
+            """
+
+def _render_partials(partials):
+    parts = []
+    for i, partial in enumerate(partials, 1):
+        lines = [f"Section {i}: {partial.get('short_summary', '')}"]
+        lines += [f"- {point}" for point in partial.get('detailed_summary') or []]
+        parts.append('\n'.join(lines))
+    return '\n\n'.join(parts)
+
+def build_reduce_prompt(partials):
+    return f"""
+            Combine these section summaries of one set of academic notes into a single summary. Return ONLY JSON.
+            {{
+              "short_summary": "3-5 lines",
+              "detailed_summary": ["bullet", "point"]
+            }}
+            
+            Section summaries:
+            {_render_partials(partials)}
+            """
+
+def _cached_json(cache, operation, content, prompt):
+    """
+    Generates JSON for prompt, cached by the hash of the content it covers
+    (whichever model answered; see summary_cache_key in app.py).
+    """
+    if cache is None:
+        return _generate_json(prompt)
+    key = make_key(text=text_hash(content), operation=operation)
+    return cache.get_or_compute(key, lambda: _generate_json(prompt), should_store=is_valid_summary)
+
+def _iter_map(chunks, cache, max_workers):
+    """
+    Summarizes chunks concurrently (the gateway keeps this within the rate
+    limit) and yields (index, partial summary) as each one finishes.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_cached_json, cache, 'summary_chunk', chunk, build_chunk_prompt(chunk)): i
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def _reduce_until_fits(partials, cache):
+    """
+    Merges groups of partial summaries until they all fit in one reduce prompt.
+    """
+    while len(partials) > 1 and len(_render_partials(partials)) > REDUCE_MAX_CHARS:
+        groups, current = [], []
+        for partial in partials:
+            if len(current) >= 2 and len(_render_partials(current + [partial])) > REDUCE_MAX_CHARS:
+                groups.append(current)
+                current = []
+            current.append(partial)
+        groups.append(current)
+        partials = [
+            group[0] if len(group) == 1 else
+            _cached_json(cache, 'summary_reduce', _render_partials(group), build_reduce_prompt(group))
+            for group in groups
+        ]
+    return partials
+
+def map_chunks(text, max_chunks):
+    """
+    Chunks a note for the map step in at most max_chunks pieces. Long notes
+    get proportionally bigger chunks: every content-defined cut falls past
+    the target size (len(text) / max_chunks), and if a few too many chunks
+    remain the smallest neighbouring pair is merged until they fit.
+    """
+    target = len(text) // max_chunks + 1
+    chunks = chunk_text(text, max(CHUNK_MAX_CHARS, 2 * target), max(CHUNK_MIN_CHARS, target))
+    while len(chunks) > max_chunks:
+        i = min(range(len(chunks) - 1), key=lambda i: len(chunks[i]) + len(chunks[i + 1]))
+        chunks[i:i + 2] = [chunks[i] + '\n' + chunks[i + 1]]
+    return chunks
+
+def _map_chunks(text, cache, max_workers, max_chunks):
+    chunks = map_chunks(text, max_chunks)
+    partials = [None] * len(chunks)
+    for done, (i, partial) in enumerate(_iter_map(chunks, cache, max_workers), 1):
+        partials[i] = partial
+        yield done, len(chunks), partials
+
+def generate_summary_mapreduce(text, cache=None, max_workers=4, max_chunks=12):
+    """
+    Summarizes the full text of a long note: chunks are summarized
+    concurrently (each cached by content hash when a cache is given) and then
+    reduced into the usual short_summary/detailed_summary shape.
+    """
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return {"short_summary": "API Key missing.", "detailed_summary": []}
+
+    try:
+        partials = []
+        for _, _, partials in _map_chunks(text, cache, max_workers, max_chunks):
+            pass
+        partials = _reduce_until_fits(partials, cache)
+        if len(partials) == 1:
+            return partials[0]
+        return _generate_json(build_reduce_prompt(partials))
+    except Exception as e:
+        return _error_summary(e)
+
+def stream_summary_mapreduce(text, cache=None, max_workers=4, max_chunks=12):
+    """
+    Streaming variant of generate_summary_mapreduce. Yields
+    ('progress', None, {'done': n, 'total': m}) while chunks are summarized,
+    then streams the final reduce step like stream_summary.
+    """
+    partials = []
+    for done, total, partials in _map_chunks(text, cache, max_workers, max_chunks):
+        yield ('progress', None, {'done': done, 'total': total})
+    partials = _reduce_until_fits(partials, cache)
+    if len(partials) == 1:
+        yield ('done', None, partials[0])
+        return
+    yield from stream_model_json(MODELS_TO_TRY, build_reduce_prompt(partials))
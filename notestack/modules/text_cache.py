@@ -0,0 +1,117 @@
+import logging
+import os
+import zlib
+import hashlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+CACHE_SUFFIX = '.txt.z'
+
+
+def hash_file(filepath):
+    """
+    Returns the sha256 hex digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TextCache:
+    """
+    On-disk cache of extracted text, keyed by the content hash of the source
+    file and stored zlib-compressed. File mtimes double as the LRU clock:
+    hits touch the entry and eviction removes the oldest entries first once
+    the folder grows past max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.folder, key[:2], key + CACHE_SUFFIX)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if not name.endswith(CACHE_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def get(self, key):
+        """
+        Returns the cached text for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        try:
+            return zlib.decompress(data).decode('utf-8')
+        except (zlib.error, UnicodeDecodeError) as e:
+            logger.warning("Dropping corrupt text cache entry %s: %s", key, e)
+            self._discard(path)
+            return None
+
+    def put(self, key, text):
+        path = self._path(key)
+        data = zlib.compress(text.encode('utf-8'), 6)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file and rename so readers never see partial entries
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _discard(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._total_bytes -= size
+
+    def _evict(self):
+        # Re-scan so entries written by other processes are accounted for
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+    def stats(self):
+        return {
+            'folder': self.folder,
+            'bytes': self._total_bytes,
+            'maxBytes': self.max_bytes,
+        }
@@ -0,0 +1,319 @@
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from modules.text_cache import HASH_CHUNK_SIZE, hash_file
+from modules.storage import is_blob_name
+
+SPOOL_SUFFIX = '.upload.tmp'
+
+# Spool files older than this are left over from a crash and removed at startup
+STALE_SPOOL_SECONDS = 3600
+
+# Unreferenced blobs younger than this are left alone by sweep(), since an
+# upload may have stored one just before writing the note that uses it
+SWEEP_GRACE_SECONDS = 24 * 3600
+
+
+class HashingSpool:
+    """
+    Writable file that an uploaded file part is streamed into. Bytes are
+    hashed as they arrive and the upload is cut off with a 413 as soon as it
+    passes max_bytes. The spool lives on the same disk as the storage's
+    files, so keeping it is a rename; if it is never committed it is
+    deleted when closed.
+    """
+
+    def __init__(self, folder, max_bytes, on_reject=None):
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix=SPOOL_SUFFIX)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._on_reject = on_reject
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.close()
+            if self._on_reject is not None:
+                self._on_reject()
+            raise RequestEntityTooLarge(f"File is larger than {self.max_bytes} bytes")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def commit(self, storage, name):
+        """
+        Hands the spooled bytes to storage under name.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        storage.put(self.path, name)
+        self.committed = True
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __getattr__(self, name):
+        # read, seek, tell, ... for anything else that reads the upload
+        return getattr(self._file, name)
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded files. Each distinct file is kept
+    once as <sha256>.<ext> in a storage backend (modules/storage.py); every
+    note or profile file that uses it holds a named reference (its owner).
+    The reference table is SQLite, shared by all app processes on the host.
+    On local storage a blob is deleted when its last reference goes. Shared
+    (object) storage is used by several hosts whose tables don't see each
+    other's references, so there unreferenced blobs are only removed by
+    sweep(), which marks from the note and profile documents instead.
+    """
+
+    def __init__(self, storage, index_path, max_bytes, legacy_folder=None):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.incoming = storage.spool_folder
+        # Files saved under readable names before this store existed
+        self.legacy_folder = legacy_folder
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self.ingested = 0
+        self.deduplicated = 0
+        self.bytes_saved = 0
+        self.rejected = 0
+        index_folder = os.path.dirname(index_path)
+        if index_folder:
+            os.makedirs(index_folder, exist_ok=True)
+        self._remove_stale_spools()
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS refs (
+                    owner TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE serializes writers across processes, so "is this
+        # blob already stored" and "is it still referenced" are decided once
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def _remove_stale_spools(self):
+        cutoff = time.time() - STALE_SPOOL_SECONDS
+        for name in os.listdir(self.incoming):
+            path = os.path.join(self.incoming, name)
+            try:
+                if name.endswith(SPOOL_SUFFIX) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _count_reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def spool(self):
+        return HashingSpool(self.incoming, self.max_bytes, on_reject=self._count_reject)
+
+    def ingest(self, file, ext, owner):
+        """
+        Stores an uploaded file (a FileStorage or any readable stream) and
+        points owner at it. Identical content is stored once. A previous blob
+        of the same owner is released. Returns (blob name, sha256 hex).
+        """
+        stream = getattr(file, 'stream', file)
+        if not isinstance(stream, HashingSpool):
+            # e.g. a request parsed without the spooling request class
+            spool = self.spool()
+            try:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                    spool.write(chunk)
+            except Exception:
+                spool.close()
+                raise
+            stream = spool
+
+        digest = stream.hexdigest()
+        name = f"{digest}.{ext.lower()}"
+        try:
+            if self.storage.shared:
+                # Upload outside the write lock: shared storage only loses
+                # blobs to sweep(), which spares recent ones
+                duplicate = self.storage.exists(name)
+                if not duplicate:
+                    stream.commit(self.storage, name)
+            with self._write() as conn:
+                if not self.storage.shared:
+                    duplicate = self.storage.exists(name)
+                    if not duplicate:
+                        stream.commit(self.storage, name)
+                conn.execute('INSERT OR IGNORE INTO blobs (hash, name, size, created) VALUES (?, ?, ?, ?)',
+                             (digest, name, stream.size, time.time()))
+                self._point(conn, owner, digest)
+        finally:
+            stream.close()
+        with self._lock:
+            self.ingested += 1
+            if duplicate:
+                self.deduplicated += 1
+                self.bytes_saved += stream.size
+        return name, digest
+
+    def adopt(self, filename, owner):
+        """
+        Moves a file saved under a legacy name (e.g. subject_dept_enrollment.pdf)
+        into the store, dropping it if the same content is already stored.
+        Returns (blob name, sha256 hex), or None if the file is missing.
+        """
+        if self.legacy_folder is None or is_blob_name(filename) or filename.startswith('.'):
+            return None
+        legacy_path = os.path.join(self.legacy_folder, filename)
+        if not os.path.isfile(legacy_path):
+            return None
+        digest = hash_file(legacy_path)
+        name = f"{digest}.{filename.rsplit('.', 1)[-1].lower()}"
+        size = os.path.getsize(legacy_path)
+        with self._write() as conn:
+            duplicate = self.storage.exists(name)
+            if duplicate:
+                os.remove(legacy_path)
+            else:
+                self.storage.put(legacy_path, name)
+            conn.execute('INSERT OR IGNORE INTO blobs (hash, name, size, created) VALUES (?, ?, ?, ?)',
+                         (digest, name, size, time.time()))
+            self._point(conn, owner, digest)
+        if duplicate:
+            with self._lock:
+                self.deduplicated += 1
+                self.bytes_saved += size
+        return name, digest
+
+    def add_reference(self, digest, owner):
+        """
+        Points owner at an already stored blob.
+        """
+        with self._write() as conn:
+            if conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone() is None:
+                raise KeyError(digest)
+            self._point(conn, owner, digest)
+
+    def _point(self, conn, owner, digest):
+        row = conn.execute('SELECT hash FROM refs WHERE owner = ?', (owner,)).fetchone()
+        conn.execute('INSERT OR REPLACE INTO refs (owner, hash, created) VALUES (?, ?, ?)',
+                     (owner, digest, time.time()))
+        if row is not None and row[0] != digest:
+            self._collect(conn, row[0])
+
+    def _collect(self, conn, digest):
+        # Runs inside the write transaction, so no other process can start
+        # referencing the blob between the check and the delete
+        if self.storage.shared:
+            return
+        if conn.execute('SELECT 1 FROM refs WHERE hash = ? LIMIT 1', (digest,)).fetchone():
+            return
+        row = conn.execute('SELECT name FROM blobs WHERE hash = ?', (digest,)).fetchone()
+        conn.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+        if row is not None:
+            self.storage.delete(row[0])
+
+    def release(self, *owners):
+        """
+        Drops the references held by owners, deleting blobs nobody uses anymore.
+        """
+        with self._write() as conn:
+            for owner in owners:
+                row = conn.execute('SELECT hash FROM refs WHERE owner = ?', (owner,)).fetchone()
+                if row is None:
+                    continue
+                conn.execute('DELETE FROM refs WHERE owner = ?', (owner,))
+                self._collect(conn, row[0])
+
+    def sweep(self, referenced, grace_seconds=SWEEP_GRACE_SECONDS):
+        """
+        Deletes stored blobs whose names are not in referenced (the set of
+        blob names that notes and profiles point at) and that are older than
+        grace_seconds. Returns the number deleted.
+        """
+        cutoff = time.time() - grace_seconds
+        doomed = [name for name, mtime in self.storage.blobs() if name not in referenced and mtime < cutoff]
+        with self._write() as conn:
+            for name in doomed:
+                digest = name.split('.', 1)[0]
+                conn.execute('DELETE FROM refs WHERE hash = ?', (digest,))
+                conn.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+                self.storage.delete(name)
+        return len(doomed)
+
+    def stats(self):
+        with self._connect() as conn:
+            blobs, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            refs = conn.execute('SELECT COUNT(*) FROM refs').fetchone()[0]
+        with self._lock:
+            return {'storage': self.storage.stats(), 'blobs': blobs, 'bytes': size, 'references': refs,
+                    'maxUploadBytes': self.max_bytes,
+                    'ingested': self.ingested, 'deduplicated': self.deduplicated,
+                    'bytesSaved': self.bytes_saved, 'rejected': self.rejected}
+
+
+def request_class(store):
+    """
+    Returns a Flask request class whose uploaded files are streamed straight
+    into store spools instead of Werkzeug's temporary files.
+    """
+    class SpoolingRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            return store.spool()
+
+    return SpoolingRequest
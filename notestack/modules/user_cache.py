@@ -0,0 +1,77 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+
+class UserProfileCache:
+    """
+    Caches user profile documents at two levels: for the current request
+    (flask.g) and for the process with a short TTL. Missing profiles are
+    cached too, as None. Writers call invalidate(); other processes pick the
+    change up once their TTL expires.
+    """
+
+    def __init__(self, ttl_seconds=30, max_entries=2048):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # uid -> (expires_at, profile or None)
+        self.hits = 0
+        self.misses = 0
+
+    def _request_cache(self):
+        if not has_request_context():
+            return None
+        if not hasattr(g, 'user_profiles'):
+            g.user_profiles = {}
+        return g.user_profiles
+
+    def get(self, db, uid):
+        """
+        Returns a copy of the user's profile dict, or None if there is none.
+        """
+        request_cache = self._request_cache()
+        if request_cache is not None and uid in request_cache:
+            return copy.deepcopy(request_cache[uid])
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(uid)
+                self.hits += 1
+                profile = entry[1]
+            else:
+                entry = None
+                self.misses += 1
+
+        if entry is None:
+            user_doc = db.collection('users').document(uid).get()
+            profile = user_doc.to_dict() if user_doc.exists else None
+            with self._lock:
+                self._entries[uid] = (now + self.ttl_seconds, profile)
+                self._entries.move_to_end(uid)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if request_cache is not None:
+            request_cache[uid] = profile
+        return copy.deepcopy(profile)
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+        request_cache = self._request_cache()
+        if request_cache is not None:
+            request_cache.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
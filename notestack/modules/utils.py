@@ -1,43 +1,114 @@
+import logging
 import pypdf
 import pdfplumber
 import docx
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_text(filepath):
+logger = logging.getLogger(__name__)
+
+# Pages handed to each worker when extracting a PDF in parallel
+PAGES_PER_TASK = 16
+
+# Marks PDF page boundaries in extracted text (used to chunk long notes)
+PAGE_BREAK = '\f'
+
+
+def _pdf_page_texts(filepath, start=0, stop=None):
+    """
+    Yields (page_number, text) for PDF pages in [start, stop) using pypdf.
+    pdfplumber is only opened for pages where pypdf finds no text.
+    """
+    reader = pypdf.PdfReader(filepath)
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    plumber = None
+    try:
+        for i in range(start, stop):
+            text = reader.pages[i].extract_text() or ''
+            if not text.strip():
+                if plumber is None:
+                    logger.debug("pypdf found no text on page %d, trying pdfplumber: %s", i, filepath)
+                    plumber = pdfplumber.open(filepath)
+                text = plumber.pages[i].extract_text() or ''
+            yield i, text
+    finally:
+        if plumber is not None:
+            plumber.close()
+
+
+def _extract_page_range(filepath, start, stop):
+    # Runs in a worker process
+    return [text for _, text in _pdf_page_texts(filepath, start, stop)]
+
+
+def pdf_page_count(filepath):
+    return len(pypdf.PdfReader(filepath).pages)
+
+
+def iter_page_text(filepath, max_chars=None):
+    """
+    Lazily yields the text of each page (each paragraph for DOCX), skipping
+    empty ones. Stops early once max_chars characters have been yielded.
+    """
+    ext = filepath.rsplit('.', 1)[1].lower()
+    if ext == 'pdf':
+        pages = (text for _, text in _pdf_page_texts(filepath))
+    elif ext == 'docx':
+        pages = (para.text for para in docx.Document(filepath).paragraphs)
+    else:
+        return
+
+    total = 0
+    for text in pages:
+        if not text.strip():
+            continue
+        yield text
+        total += len(text) + 1
+        if max_chars is not None and total >= max_chars:
+            return
+
+
+def _iter_pdf_parallel(filepath, page_workers):
+    """
+    Yields page texts in order, extracted by a pool of worker processes.
+    """
+    page_count = pdf_page_count(filepath)
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PAGES_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=page_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_extract_page_range, filepath, start, stop) for start, stop in ranges]
+        for future in futures:
+            for text in future.result():
+                if text.strip():
+                    yield text
+
+
+def extract_text(filepath, max_chars=None, page_workers=0):
     """
     Extracts text from PDF or DOCX file.
+    max_chars stops reading pages once that much text is available (the result
+    is trimmed to it). page_workers > 1 fans the pages of a full PDF
+    extraction out across a process pool.
     """
-    text = ""
     ext = filepath.rsplit('.', 1)[1].lower()
-    
+
     try:
-        if ext == 'pdf':
-            print(f"DEBUG: Extracting PDF with pypdf: {filepath}")
-            reader = pypdf.PdfReader(filepath)
-            for page in reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-            
-            if not text.strip():
-                print(f"DEBUG: pypdf failed, trying pdfplumber: {filepath}")
-                with pdfplumber.open(filepath) as pdf:
-                    for page in pdf.pages:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted + "\n"
-        elif ext == 'docx':
-            print(f"DEBUG: Extracting DOCX: {filepath}")
-            doc = docx.Document(filepath)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-    except Exception as e:
-        print(f"DEBUG: Error extracting text from {filepath}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.debug("Extracting %s: %s", ext.upper(), filepath)
+        if ext == 'pdf' and page_workers > 1 and max_chars is None:
+            pages = _iter_pdf_parallel(filepath, page_workers)
+        else:
+            pages = iter_page_text(filepath, max_chars)
+        separator = '\n' + PAGE_BREAK if ext == 'pdf' else '\n'
+        text = separator.join(pages)
+    except Exception:
+        logger.exception("Error extracting text from %s", filepath)
         return None
-        
+
     extracted_text = text.strip()
-    print(f"DEBUG: Extraction complete. Chars: {len(extracted_text)}")
+    if max_chars is not None:
+        extracted_text = extracted_text[:max_chars]
+    logger.debug("Extraction complete. Chars: %d", len(extracted_text))
     return extracted_text
 
 def generate_filename(subject_name, department, enrollment_id):
@@ -0,0 +1,128 @@
+import logging
+import time
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Failed flushes are retried, but never hold more than this many views
+MAX_PENDING = 10000
+
+
+class ViewBuffer:
+    """
+    Write-behind buffer for note views. add() returns immediately; a
+    background thread hands buffered views to flush_fn in batches once
+    max_size views are waiting or every flush_interval seconds. Repeat views
+    of the same note by the same user within dedupe_window seconds (double
+    clicks) are dropped. If flush_fn raises, the views are retried on the
+    next flush; an exception with a `written` attribute (e.g.
+    view_stats.PartialWriteError) means that many leading views are done
+    and only the rest are retried.
+    """
+
+    def __init__(self, flush_fn, max_size=100, flush_interval=5.0, dedupe_window=2.0,
+                 clock=time.monotonic):
+        self.flush_fn = flush_fn
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.dedupe_window = dedupe_window
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._last_seen = {}  # (uid, note_id) -> clock time of last accepted view
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._counts = {'accepted': 0, 'duplicates': 0, 'flushed': 0, 'flushes': 0,
+                        'failures': 0, 'dropped': 0}
+        self.last_flush_seconds = 0.0
+
+    def add(self, uid, note_id):
+        """
+        Buffers a view. Returns False if it was dropped as a duplicate.
+        """
+        now = self.clock()
+        key = (uid, note_id)
+        with self._lock:
+            last = self._last_seen.get(key)
+            if last is not None and now - last < self.dedupe_window:
+                self._counts['duplicates'] += 1
+                return False
+            self._last_seen[key] = now
+            self._pending.append({
+                'userId': uid,
+                'noteId': note_id,
+                'timestamp': datetime.datetime.now()
+            })
+            self._counts['accepted'] += 1
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """
+        Writes out everything buffered so far. Returns the number of views written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                views, self._pending = self._pending, []
+                # Forget dedupe entries that can no longer match
+                cutoff = self.clock() - self.dedupe_window
+                self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+            if not views:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.flush_fn(views)
+            except Exception as e:
+                written = getattr(e, 'written', 0)
+                logger.error("View flush failed (%d of %d views written): %s", written, len(views), e)
+                views = views[written:]
+                with self._lock:
+                    self._counts['failures'] += 1
+                    self._counts['flushed'] += written
+                    # Put them back in front of newer views, within the cap
+                    self._pending = views + self._pending
+                    overflow = len(self._pending) - MAX_PENDING
+                    if overflow > 0:
+                        self._pending = self._pending[overflow:]
+                        self._counts['dropped'] += overflow
+                return 0
+
+            with self._lock:
+                self.last_flush_seconds = time.perf_counter() - start
+                self._counts['flushed'] += len(views)
+                self._counts['flushes'] += 1
+            return len(views)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='view-buffer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread and flushes what is left (called at exit).
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats['depth'] = len(self._pending)
+            stats['lastFlushSeconds'] = round(self.last_flush_seconds, 4)
+        return stats
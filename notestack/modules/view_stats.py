@@ -0,0 +1,131 @@
+import logging
+import datetime
+
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# Distinct notes kept in a user's "recently viewed" ring
+RECENT_LIMIT = 5
+# Firestore's limit on writes per batch
+BATCH_LIMIT = 500
+
+
+def _push_recent(recent, note_ids):
+    """
+    Returns the recent ring after viewing note_ids in order: most recent
+    first, no duplicates, at most RECENT_LIMIT entries.
+    """
+    for note_id in note_ids:
+        recent = [note_id] + [n for n in recent if n != note_id]
+    return recent[:RECENT_LIMIT]
+
+
+@firestore.transactional
+def _apply_views(transaction, stats_ref, note_ids):
+    snapshot = stats_ref.get(transaction=transaction)
+    data = snapshot.to_dict() if snapshot.exists else {}
+    if 'views' not in data:
+        # Not backfilled yet: rebuild_user_stats will count these views from
+        # the raw log, so counting them here too would double them
+        return
+    transaction.set(stats_ref, {
+        'views': data.get('views', 0) + len(note_ids),
+        'recentNoteIds': _push_recent(data.get('recentNoteIds', []), note_ids),
+        'updatedAt': datetime.datetime.now(datetime.timezone.utc)
+    }, merge=True)
+
+
+def record_views(db, uid, note_ids):
+    """
+    Folds views (oldest first) into the user's counters and recent ring and
+    bumps each note's viewCount.
+    """
+    if not note_ids:
+        return
+    _apply_views(db.transaction(), db.collection('user_stats').document(uid), list(note_ids))
+
+    per_note = {}
+    for note_id in note_ids:
+        per_note[note_id] = per_note.get(note_id, 0) + 1
+    for note_id, count in per_note.items():
+        try:
+            db.collection('notes').document(note_id).update({'viewCount': firestore.Increment(count)})
+        except Exception as e:
+            # The note may have been deleted since it was viewed
+            logger.warning("Could not count view for note %s: %s", note_id, e)
+
+
+class PartialWriteError(Exception):
+    """
+    Raised by write_views when a batch fails after earlier ones committed:
+    the first `written` views are logged and counted, the rest are not.
+    """
+
+    def __init__(self, written, error):
+        super().__init__(f"{written} views written before the failure: {error}")
+        self.written = written
+
+
+def write_views(db, views):
+    """
+    Appends buffered views (dicts with userId, noteId, timestamp) to the
+    user_views log in batched commits, folding each committed batch into
+    the users' counters with one record_views call per user. If a batch
+    fails, PartialWriteError says how many views are done so a retry
+    starts from the failed batch instead of logging earlier ones twice.
+    """
+    for i in range(0, len(views), BATCH_LIMIT):
+        chunk = views[i:i + BATCH_LIMIT]
+        try:
+            batch = db.batch()
+            for view in chunk:
+                batch.set(db.collection('user_views').document(), view)
+            batch.commit()
+        except Exception as e:
+            if i == 0:
+                raise
+            raise PartialWriteError(i, e) from e
+
+        per_user = {}
+        for view in chunk:
+            per_user.setdefault(view['userId'], []).append(view['noteId'])
+        for uid, note_ids in per_user.items():
+            try:
+                record_views(db, uid, note_ids)
+            except Exception as e:
+                # The raw log is written, so a compaction can still recover these
+                logger.error("Could not update view stats for %s: %s", uid, e)
+
+
+def record_upload(db, uid):
+    db.collection('user_stats').document(uid).set({'uploads': firestore.Increment(1)}, merge=True)
+
+
+def rebuild_user_stats(db, uid):
+    """
+    Compaction: recomputes a user's counters from the raw user_views log and
+    their uploads. Used to backfill users whose stats predate the counters.
+    """
+    views = [doc.to_dict() for doc in db.collection('user_views').where('userId', '==', uid).stream()]
+    views.sort(key=lambda v: v.get('timestamp') or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc))
+    uploads = db.collection('notes').where('uploaderId', '==', uid).get()
+
+    stats = {
+        'views': len(views),
+        'uploads': len(uploads),
+        'recentNoteIds': _push_recent([], [v.get('noteId') for v in views if v.get('noteId')]),
+        'updatedAt': datetime.datetime.now(datetime.timezone.utc)
+    }
+    db.collection('user_stats').document(uid).set(stats)
+    return stats
+
+
+def get_user_stats(db, uid):
+    """
+    Returns the user's precomputed stats, backfilling them on first use.
+    """
+    snapshot = db.collection('user_stats').document(uid).get()
+    if snapshot.exists and 'views' in snapshot.to_dict():
+        return snapshot.to_dict()
+    return rebuild_user_stats(db, uid)
@@ -0,0 +1,64 @@
+import sqlite3
+
+from modules.fulltext import FullTextIndex
+
+NOTE = {'subjectName': 'Operating Systems', 'department': 'CSE', 'type': 'note'}
+BODY = 'Running threads: round robin scheduling and deadlock avoidance.'
+
+
+def make_index(tmp_path):
+    index = FullTextIndex(str(tmp_path / 'fulltext.sqlite3'))
+    index.index_note('n1', NOTE, BODY, 'h1')
+    index.index_note('n2', {'subjectName': 'Compilers', 'department': 'CSE', 'type': 'pyq'})
+    return index
+
+
+def found(index, query, file_type='all'):
+    return [note_id for note_id, _, _ in index.search(query, file_type)]
+
+
+def test_every_prefix_of_an_indexed_word_matches(tmp_path):
+    index = make_index(tmp_path)
+    for word in ('operating', 'systems', 'running', 'threads', 'scheduling', 'deadlock', 'compilers'):
+        for end in range(2, len(word) + 1):
+            assert found(index, word[:end]), word[:end]
+
+
+def test_whole_words_match_through_stemming(tmp_path):
+    index = make_index(tmp_path)
+    assert found(index, 'system') == ['n1']
+    assert found(index, 'thread scheduled') == ['n1']
+    assert found(index, 'operating schedulin') == ['n1']
+    assert found(index, 'operating compilers') == []
+
+
+def test_updates_and_removals_reach_both_tables(tmp_path):
+    index = make_index(tmp_path)
+    index.set_text('n2', 'h2', 'Lexers and parsers')
+    assert found(index, 'pars') == ['n2']
+    index.index_note('n2', {'subjectName': 'Compiler Design', 'type': 'pyq'})
+    assert found(index, 'desig', 'pyq') == ['n2']
+    assert found(index, 'lexe') == ['n2']
+    assert found(index, 'compil', 'note') == []
+
+    index.remove('n1')
+    assert found(index, 'oper') == []
+    assert found(index, 'operating') == []
+
+
+def test_index_from_before_the_prefix_table_is_backfilled(tmp_path):
+    path = str(tmp_path / 'fulltext.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE indexed_notes (rowid INTEGER PRIMARY KEY, note_id TEXT UNIQUE NOT NULL, '
+                     'text_hash TEXT)')
+        conn.execute("CREATE VIRTUAL TABLE notes_fts USING fts5(note_id UNINDEXED, type UNINDEXED, meta, body, "
+                     "prefix='2 3', tokenize='porter unicode61')")
+        conn.execute("INSERT INTO indexed_notes (rowid, note_id) VALUES (1, 'n1')")
+        conn.execute("INSERT INTO notes_fts (rowid, note_id, type, meta, body) VALUES (1, 'n1', 'note', ?, ?)",
+                     ('Operating Systems CSE', BODY))
+    conn.close()
+
+    index = FullTextIndex(path)
+    assert found(index, 'operati') == ['n1']
+    index.remove('n1')
+    assert found(index, 'operati') == []
@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+
+from modules.gemini_gateway import GeminiGateway, TokenBucket, RateLimitError, is_rate_limit_error
+
+
+class FakeClock:
+    """A monotonic clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+class Reply:
+    def __init__(self, text):
+        self.text = text
+
+
+class NoText:
+    @property
+    def text(self):
+        raise ValueError('no candidates')
+
+
+class FakeModel:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def make_gateway(model, clock, **kwargs):
+    kwargs.setdefault('requests_per_minute', 60)
+    return GeminiGateway(model_factory=lambda model_name: model, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_bucket_allows_a_burst_then_refills_at_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(60, burst=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=5)
+    assert clock.slept == pytest.approx(1.0)
+
+
+def test_bucket_gives_up_without_sleeping_past_the_timeout():
+    clock = FakeClock()
+    bucket = TokenBucket(6, burst=1, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    assert not bucket.acquire(timeout=5)
+    assert clock.slept == 0
+
+
+def test_identical_concurrent_requests_share_one_call():
+    release = threading.Event()
+    calls = []
+
+    class SlowModel:
+        def generate_content(self, prompt, stream=False):
+            calls.append(prompt)
+            release.wait(5)
+            return Reply('shared')
+
+    gateway = GeminiGateway(model_factory=lambda model_name: SlowModel())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(gateway.generate('m', 'same prompt')))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while gateway.stats()['coalesced'] < 2:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['shared'] * 3
+    assert len(calls) == 1
+    assert gateway.stats()['inFlight'] == 0
+
+
+def test_upstream_429_drains_the_bucket_and_is_retried():
+    clock = FakeClock()
+    model = FakeModel([Exception('429 Resource has been exhausted'), Reply('ok')])
+    gateway = make_gateway(model, clock)
+
+    assert gateway.generate('m', 'prompt') == 'ok'
+    assert len(model.prompts) == 2
+    # The retry had to wait for a token to refill
+    assert clock.slept > 0
+    assert gateway.stats()['upstream_429'] == 1
+
+
+def test_repeated_upstream_429_is_raised_after_the_retries():
+    clock = FakeClock()
+    model = FakeModel([Exception('429 quota'), Exception('429 quota')])
+    gateway = make_gateway(model, clock, retries_on_429=1)
+
+    with pytest.raises(Exception) as error:
+        gateway.generate('m', 'prompt')
+    assert is_rate_limit_error(error.value)
+
+
+def test_no_slot_within_max_wait_is_a_local_rate_limit_error():
+    clock = FakeClock()
+    model = FakeModel([Reply('first')])
+    gateway = make_gateway(model, clock, requests_per_minute=1, max_wait_seconds=10)
+
+    assert gateway.generate('m', 'one') == 'first'
+    with pytest.raises(RateLimitError):
+        gateway.generate('m', 'two')
+    assert gateway.stats()['rejected'] == 1
+    assert model.prompts == ['one']
+
+
+def test_stream_skips_chunks_without_text():
+    clock = FakeClock()
+    model = FakeModel([[Reply('a'), NoText(), Reply(''), Reply('b')]])
+    gateway = make_gateway(model, clock)
+
+    assert list(gateway.stream('m', 'prompt')) == ['a', 'b']
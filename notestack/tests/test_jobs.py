@@ -0,0 +1,25 @@
+import threading
+import time
+
+from modules.jobs import JobManager, DONE, RUNNING
+
+
+def test_long_job_is_kept_alive_past_stale_seconds(tmp_path):
+    jobs = JobManager(str(tmp_path / 'jobs.sqlite3'), {'summary': 1}, stale_seconds=0.2)
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        return {'summary': 'done'}
+
+    job_id = jobs.submit('summary', 'k1', compute)
+    time.sleep(0.6)
+    assert jobs.get(job_id)['status'] == RUNNING
+    # Still alive, so the same key is not started again
+    assert jobs.submit('summary', 'k1', compute) == job_id
+
+    release.set()
+    job = jobs.wait(job_id, 5)
+    assert job['status'] == DONE
+    assert job['result'] == {'summary': 'done'}
+
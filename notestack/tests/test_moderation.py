@@ -0,0 +1,187 @@
+import time
+
+from modules import safety
+from modules.firestore_fake import FakeFirestore
+from modules.gemini_gateway import RateLimitError
+from modules.model_registry import ModelRegistry
+from modules.moderation import ModerationPipeline, PENDING_REVIEW, MANUAL_REVIEW
+from modules.result_cache import ResultCache
+from modules.text_cache import TextCache
+
+ACADEMIC = ' '.join(['The theorem and its proof follow from the definition; solve the example equation.'] * 10)
+
+
+class FakeCheck:
+    def __init__(self, verdict):
+        self.verdict = verdict
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return dict(self.verdict)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_pipeline(tmp_path, check, clock=time.monotonic):
+    db = FakeFirestore()
+    text_cache = TextCache(str(tmp_path / 'text'), 1024 * 1024)
+    result_cache = ResultCache(str(tmp_path / 'results.sqlite3'), 3600, 1024 * 1024)
+    pipeline = ModerationPipeline(db, text_cache, result_cache, check=check, retry_seconds=60,
+                                  retry_max_seconds=200, clock=clock)
+    published = []
+    pipeline.add_listener(lambda note_id, status, note: published.append((note_id, status)))
+    return db, text_cache, pipeline, published
+
+
+def add_note(db, note_id):
+    db.collection('notes').document(note_id).set({'status': PENDING_REVIEW, 'subjectName': 'Maths'})
+
+
+def note(db, note_id):
+    return db.collection('notes').document(note_id).get().to_dict()
+
+
+def test_unavailable_model_leaves_the_note_pending_and_is_retried(tmp_path):
+    check = FakeCheck({'status': 'uncertain', 'reason': 'AI check unavailable'})
+    db, text_cache, pipeline, published = make_pipeline(tmp_path, check)
+    add_note(db, 'n1')
+    text_cache.put('h1', 'short note')
+
+    pipeline._run('n1', 'h1')
+    assert note(db, 'n1')['status'] == PENDING_REVIEW
+    assert published == []
+    assert pipeline.stats()['deferred'] == 1
+
+    # The failed check was not cached, so a requeue asks the model again
+    check.verdict = {'status': 'approved', 'reason': 'Study notes'}
+    pipeline._run('n1', 'h1')
+    assert check.calls == 2
+    assert note(db, 'n1')['status'] == 'approved'
+    assert published == [('n1', 'approved')]
+
+
+def wait_idle(pipeline, timeout=5):
+    deadline = time.monotonic() + timeout
+    while pipeline.stats()['inFlight']:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_deferred_note_is_retried_with_backoff(tmp_path):
+    clock = FakeClock()
+    check = FakeCheck({'status': 'uncertain', 'reason': 'AI check unavailable'})
+    db, text_cache, pipeline, published = make_pipeline(tmp_path, check, clock)
+    add_note(db, 'n1')
+    text_cache.put('h1', 'short note')
+
+    pipeline._run('n1', 'h1')
+    # Retried after 60s, then 120s, then at most every 200s
+    for wait in (60, 120, 200, 200):
+        clock.now += wait - 1
+        assert pipeline.retry_due() == 0
+        clock.now += 1
+        calls = check.calls
+        assert pipeline.retry_due() == 1
+        wait_idle(pipeline)
+        assert check.calls == calls + 1
+    assert note(db, 'n1')['status'] == PENDING_REVIEW
+
+    check.verdict = {'status': 'approved', 'reason': 'Study notes'}
+    clock.now += 200
+    assert pipeline.retry_due() == 1
+    wait_idle(pipeline)
+    assert published == [('n1', 'approved')]
+    assert pipeline.stats()['retrying'] == 0
+    clock.now += 1000
+    assert pipeline.retry_due() == 0
+
+
+def test_short_text_goes_to_the_model(tmp_path):
+    check = FakeCheck({'status': 'rejected', 'reason': 'Spam'})
+    db, text_cache, pipeline, published = make_pipeline(tmp_path, check)
+    add_note(db, 'n1')
+    text_cache.put('h1', 'buy followers now')
+
+    pipeline._run('n1', 'h1')
+    assert check.calls == 1
+    assert note(db, 'n1')['status'] == 'rejected'
+
+
+def test_unextractable_note_is_held_for_manual_review(tmp_path):
+    check = FakeCheck({'status': 'approved', 'reason': 'unused'})
+    db, text_cache, pipeline, published = make_pipeline(tmp_path, check)
+    add_note(db, 'failed')
+    add_note(db, 'scanned')
+    text_cache.put('h1', '\n \n12 34\n')
+
+    pipeline._run('failed', None)
+    pipeline._run('scanned', 'h1')
+    for note_id in ('failed', 'scanned'):
+        assert note(db, note_id)['status'] == PENDING_REVIEW
+        assert note(db, note_id)['moderation']['stage'] == MANUAL_REVIEW
+    assert check.calls == 0
+    assert published == []
+    assert pipeline.stats()['heldForReview'] == 2
+
+
+def test_clean_academic_text_is_approved_locally(tmp_path):
+    check = FakeCheck({'status': 'rejected', 'reason': 'unused'})
+    db, text_cache, pipeline, published = make_pipeline(tmp_path, check)
+    add_note(db, 'n1')
+    text_cache.put('h1', ACADEMIC)
+
+    pipeline._run('n1', 'h1')
+    assert check.calls == 0
+    assert published == [('n1', 'approved')]
+
+
+class FakeGateway:
+    def __init__(self, answers):
+        self.answers = answers  # model -> response text or exception
+        self.calls = []
+
+    def generate(self, model_name, prompt):
+        self.calls.append(model_name)
+        answer = self.answers[model_name]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def test_safety_check_falls_back_through_the_registry(monkeypatch):
+    clock = FakeClock()
+    registry = ModelRegistry(cooldown_seconds=60, clock=clock)
+    first, second, third = safety.SAFETY_MODELS
+    gateway = FakeGateway({first: RuntimeError('503 unavailable'), second: RateLimitError('429'),
+                           third: '```json {"status": "approved", "reason": "Lecture notes"} ```'})
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(safety, 'registry', registry)
+    monkeypatch.setattr(safety, 'gateway', gateway)
+
+    assert safety.check_content_safety('text')['status'] == 'approved'
+    assert gateway.calls == [first, second, third]
+
+    # The model that answered goes first; the unavailable one cools down, the rate-limited one doesn't
+    gateway.calls.clear()
+    safety.check_content_safety('text')
+    assert gateway.calls == [third]
+    assert registry.candidates(safety.SAFETY_MODELS) == [third, second]
+
+
+def test_safety_check_is_uncertain_when_no_model_answers(monkeypatch):
+    gateway = FakeGateway({model: RateLimitError('429') for model in safety.SAFETY_MODELS})
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(safety, 'registry', ModelRegistry())
+    monkeypatch.setattr(safety, 'gateway', gateway)
+    assert safety.check_content_safety('text')['status'] == 'uncertain'
+    assert gateway.calls == safety.SAFETY_MODELS
+
+    monkeypatch.delenv('GEMINI_API_KEY')
+    assert safety.check_content_safety('text')['status'] == 'uncertain'
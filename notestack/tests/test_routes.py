@@ -0,0 +1,213 @@
+"""
+Drives the main routes against the in-memory Firestore fake in strict mode
+(an N+1 pattern or a blown read budget fails the request) and checks how
+many documents each one reads.
+"""
+import importlib
+import io
+import time
+
+import pytest
+from pypdf import PdfWriter
+
+from modules import datastore
+
+NOTES = 30
+SAVED = 25
+RECENT = ['n3', 'n1', 'n4']
+
+
+@pytest.fixture(scope='module')
+def notestack(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('notestack')
+    with pytest.MonkeyPatch.context() as mp:
+        # config.Config reads the environment on import; relative paths (uploads) land in folder
+        mp.chdir(folder)
+        mp.setenv('FIRESTORE_BACKEND', 'memory')
+        mp.setenv('FIRESTORE_STRICT', 'true')
+        mp.setenv('FIRESTORE_READ_BUDGET', '50')
+        mp.setenv('SEARCH_INDEX_REFRESH_SECONDS', '0')
+        for name in ('UPLOAD_INDEX_PATH', 'FULLTEXT_INDEX_PATH', 'RESULT_CACHE_PATH', 'JOBS_PATH'):
+            mp.setenv(name, str(folder / f'{name.lower()}.sqlite3'))
+        for name in ('TEXT_CACHE_FOLDER', 'SEMANTIC_INDEX_FOLDER', 'OBJECT_CACHE_FOLDER'):
+            mp.setenv(name, str(folder / name.lower()))
+        app = importlib.import_module('app')
+        app.app.testing = True
+        seed(app)
+        yield app
+
+
+def seed(app):
+    db = app.db
+    for i in range(NOTES):
+        db.note_ref(f'n{i}').set({
+            'subjectName': f'Operating Systems {i}', 'department': 'CSE', 'type': 'note',
+            'uploaderId': 'u2', 'uploaderName': 'Asha', 'filename': f'n{i}.pdf',
+            'fileUrl': f'/uploads/n{i}.pdf', 'status': 'approved', 'timestamp': i,
+        })
+    db.user_ref('u1').set({'name': 'Ravi', 'enrollmentId': 'BT21CSE001', 'email': 'ravi@example.com'})
+    db.collection('user_saved').document('u1').set({'noteIds': [f'n{i}' for i in range(SAVED)]})
+    db.collection('user_stats').document('u1').set({'views': 7, 'uploads': 0, 'recentNoteIds': RECENT})
+
+    app.search_index.build(db)
+    # The build syncs the full-text index in a thread; wait for a sync of our own to finish
+    if app.fulltext_index is not None:
+        notes = {note_id: app.search_index.get(note_id) for note_id in (f'n{i}' for i in range(NOTES))}
+        while not app.fulltext_index.sync(notes, app.text_cache.get):
+            time.sleep(0.01)
+
+
+@pytest.fixture
+def client(notestack):
+    # Cold per-process caches, so every request pays for what it reads
+    notestack.user_cache.clear()
+    notestack.saved_index.clear()
+    client = notestack.app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = 'u1'
+    return client
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Firestore documents read by each request, in order."""
+    counts = []
+
+    def finish_request(route):
+        request_counts = finish(route)
+        counts.append(request_counts.reads)
+        return request_counts
+
+    finish = datastore.finish_request
+    monkeypatch.setattr(datastore, 'finish_request', finish_request)
+    return counts
+
+
+def test_search_reads_only_the_saved_set(client, reads):
+    response = client.get('/api/search_notes?q=operating')
+    assert response.status_code == 200
+    notes = response.get_json()['notes']
+    assert len(notes) == 20
+    assert all(note['isSaved'] == (int(note['id'][1:]) < SAVED) for note in notes)
+    assert reads == [1]
+
+
+def test_library_reads_one_page_in_a_batch(client, reads):
+    response = client.get('/library')
+    assert response.status_code == 200
+    # profile, saved set, first page of notes
+    assert reads == [1 + 1 + 20]
+
+
+def test_saved_notes_pages(client, reads):
+    first = client.get('/api/saved_notes').get_json()
+    second = client.get(f"/api/saved_notes?cursor={first['nextCursor']}").get_json()
+    assert len(first['notes']) + len(second['notes']) == SAVED
+    assert second['nextCursor'] is None
+    # The saved set is cached after the first request
+    assert reads == [1 + 20, SAVED - 20]
+
+
+def test_dashboard_reads_stats_and_recent_notes(client, reads):
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    assert reads == [1 + 1 + len(RECENT)]
+
+
+def test_ai_assist_reads_saved_notes_in_a_batch(client, reads):
+    response = client.get('/ai-assist')
+    assert response.status_code == 200
+    assert reads == [1 + 1 + SAVED]
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_upload_reads_only_the_profile(notestack, client, reads):
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    pdf = io.BytesIO()
+    writer.write(pdf)
+    pdf.seek(0)
+
+    response = client.post('/upload_file', data={
+        'file': (pdf, 'notes.pdf'), 'subjectName': 'Compilers', 'department': 'CSE',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert reads == [1]
+
+    # A PDF with no text is extracted in the background and held for manual review
+    [upload] = notestack.db.notes(status='pending')
+    note_ref = upload.reference
+    wait_for(lambda: 'moderation' in note_ref.get().to_dict())
+    note = note_ref.get().to_dict()
+    assert note['extraction'] == 'done'
+    assert note['status'] == 'pending'
+    assert note['moderation']['stage'] == 'manual'
+
+
+def test_n_plus_one_gets_fail_in_strict_mode(notestack):
+    db = notestack.db
+    db.begin_request()
+    for i in range(notestack.app.config['FIRESTORE_N_PLUS_ONE_GETS']):
+        db.note_ref(f'n{i}').get()
+    with pytest.raises(datastore.NPlusOneReads):
+        db.end_request('/test')
+
+
+@pytest.mark.parametrize('route', ['/admin/dedupe_uploads', '/admin/collect_uploads', '/admin/compact_view_stats',
+                                   '/admin/rebuild_search_index'])
+def test_maintenance_routes_need_an_admin(notestack, client, monkeypatch, route):
+    monkeypatch.setitem(notestack.app.config, 'ADMIN_TOKEN', 'admin-secret')
+    assert client.post(route).status_code == 403
+    assert client.post(route, headers={'Authorization': 'Bearer wrong'}).status_code == 403
+
+
+def test_admin_routes_reject_anonymous_requests(notestack, client, monkeypatch):
+    monkeypatch.setitem(notestack.app.config, 'ADMIN_TOKEN', 'admin-secret')
+    notestack.db.note_ref('held').set({'subjectName': 'Scanned', 'status': 'pending',
+                                       'moderation': {'stage': 'manual'}})
+    decision = {'noteId': 'held', 'status': 'approved'}
+
+    assert client.post('/admin/moderate_note', json=decision).status_code == 403
+    assert client.post('/admin/moderate_note', json=decision,
+                       headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.post('/admin/moderate_pending').status_code == 403
+    assert notestack.db.note_ref('held').get().get('status') == 'pending'
+
+    response = client.post('/admin/moderate_note', json=decision,
+                           headers={'Authorization': 'Bearer admin-secret'})
+    assert response.status_code == 200
+    assert notestack.db.note_ref('held').get().get('status') == 'approved'
+
+
+@pytest.mark.parametrize('route', ['/api/generate_questions', '/api/generate_questions/stream'])
+def test_questions_reject_a_non_numeric_count(client, route):
+    response = client.post(route, json={'noteId': 'n1', 'numQuestions': 'abc'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'numQuestions must be a number'}
+
+
+def test_metrics_need_the_scraper_token(notestack, monkeypatch):
+    client = notestack.app.test_client()
+    monkeypatch.setitem(notestack.app.config, 'METRICS_TOKEN', None)
+    assert client.get('/metrics').status_code == 401
+
+    monkeypatch.setitem(notestack.app.config, 'METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+    assert response.status_code == 200
+    assert b'notestack_firestore_reads_per_request' in response.data
+
+
+@pytest.mark.parametrize('route', ['/api/search_index/stats', '/api/ai_stats', '/api/view_buffer/stats',
+                                   '/api/uploads/stats'])
+def test_stats_need_an_admin(notestack, client, monkeypatch, route):
+    monkeypatch.setitem(notestack.app.config, 'ADMIN_TOKEN', 'admin-secret')
+    assert client.get(route).status_code == 403
+    assert client.get(route, headers={'Authorization': 'Bearer admin-secret'}).status_code == 200
@@ -0,0 +1,36 @@
+import datetime
+
+from modules.firestore_fake import FakeFirestore
+from modules.saved_notes import SavedNoteIndex
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def test_save_is_written_even_when_the_cached_set_is_stale():
+    db = FakeFirestore()
+    worker_a, worker_b = SavedNoteIndex(), SavedNoteIndex()
+    assert worker_a.save(db, 'u1', 'n1', now())
+    assert worker_b.unsave(db, 'u1', 'n1')
+
+    # worker_a still has n1 cached as saved
+    worker_a.save(db, 'u1', 'n1', now())
+    assert db.collection('user_saved').document('u1').get().to_dict()['noteIds'] == ['n1']
+    assert db.collection('saved_notes').document('u1_n1').get().exists
+
+
+def test_migrating_a_user_with_nothing_saved_writes_nothing():
+    db = FakeFirestore()
+    assert SavedNoteIndex().note_ids(db, 'u1') == []
+    assert not db.collection('user_saved').document('u1').get().exists
+
+
+def test_legacy_saves_are_migrated_in_save_order():
+    db = FakeFirestore()
+    saved_notes = db.collection('saved_notes')
+    saved_notes.document('legacy-b').set({'userId': 'u1', 'noteId': 'n2', 'savedAt': 2})
+    saved_notes.document('legacy-a').set({'userId': 'u1', 'noteId': 'n1', 'savedAt': 1})
+
+    assert SavedNoteIndex().note_ids(db, 'u1') == ['n1', 'n2']
+    assert sorted(doc.id for doc in saved_notes.stream()) == ['u1_n1', 'u1_n2']
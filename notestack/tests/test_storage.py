@@ -0,0 +1,165 @@
+import os
+import shutil
+import hashlib
+import datetime
+
+import pytest
+from botocore.exceptions import ClientError
+
+from modules.storage import LocalStorage, ObjectStorage, is_blob_name, shard_path
+
+
+def blob_name(content, ext='pdf'):
+    return f"{hashlib.sha256(content).hexdigest()}.{ext}"
+
+
+def spool(storage, content):
+    path = os.path.join(storage.spool_folder, 'upload.tmp')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+class MemoryS3:
+    """The handful of S3 client calls ObjectStorage makes, kept in a dict."""
+
+    def __init__(self):
+        self.objects = {}  # (bucket, key) -> (bytes, extra args)
+        self.downloads = 0
+
+    def _missing(self, operation):
+        return ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, operation)
+
+    def upload_file(self, filename, bucket, key, Config=None, ExtraArgs=None):
+        with open(filename, 'rb') as f:
+            self.objects[(bucket, key)] = (f.read(), ExtraArgs or {})
+
+    def download_file(self, bucket, key, filename, Config=None):
+        if (bucket, key) not in self.objects:
+            raise self._missing('HeadObject')
+        self.downloads += 1
+        with open(filename, 'wb') as f:
+            f.write(self.objects[(bucket, key)][0])
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._missing('HeadObject')
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix=''):
+                yield {'Contents': [{'Key': key, 'LastModified': datetime.datetime.now(datetime.timezone.utc)}
+                                    for bucket, key in client.objects if bucket == Bucket and key.startswith(Prefix)]}
+        return Paginator()
+
+
+def test_blob_names_are_sharded_by_hash_prefix():
+    name = blob_name(b'notes')
+    assert is_blob_name(name)
+    assert shard_path(name) == os.path.join(name[:2], name[2:4], name)
+    assert shard_path('legacy_notes.pdf') == 'legacy_notes.pdf'
+
+
+def test_local_storage_round_trip(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    name = blob_name(b'lecture 1')
+    storage.put(spool(storage, b'lecture 1'), name)
+
+    assert storage.exists(name)
+    with open(storage.local_path(name), 'rb') as f:
+        assert f.read() == b'lecture 1'
+    assert [n for n, _ in storage.blobs()] == [name]
+
+    storage.delete(name)
+    assert not storage.exists(name)
+    with pytest.raises(FileNotFoundError):
+        storage.local_path(name)
+
+
+def test_local_storage_shards_blobs_left_in_the_top_folder(tmp_path):
+    name = blob_name(b'old')
+    (tmp_path / name).write_bytes(b'old')
+    storage = LocalStorage(str(tmp_path))
+    assert storage.local_path(name) == os.path.join(str(tmp_path), shard_path(name))
+
+
+@pytest.mark.parametrize('name', ['../config.py', '.incoming', ''])
+def test_local_storage_rejects_unsafe_names(tmp_path, name):
+    storage = LocalStorage(str(tmp_path))
+    assert not storage.exists(name)
+    with pytest.raises(FileNotFoundError):
+        storage.local_path(name)
+
+
+def make_object_storage(tmp_path, s3, cache_max_bytes=1024 * 1024):
+    return ObjectStorage('notes-bucket', str(tmp_path / 'cache'), cache_max_bytes, prefix='uploads/', client=s3)
+
+
+def test_object_storage_uploads_and_serves_from_the_cache(tmp_path):
+    s3 = MemoryS3()
+    storage = make_object_storage(tmp_path, s3)
+    name = blob_name(b'lecture 2')
+    storage.put(spool(storage, b'lecture 2'), name)
+
+    content, extra = s3.objects[('notes-bucket', 'uploads/' + name)]
+    assert content == b'lecture 2'
+    assert extra['ContentType'] == 'application/pdf'
+    assert storage.exists(name)
+    storage.local_path(name)
+    assert s3.downloads == 0
+    assert storage.stats()['cacheHits'] == 1
+
+
+def test_object_storage_downloads_on_a_cache_miss(tmp_path):
+    s3 = MemoryS3()
+    name = blob_name(b'lecture 3')
+    writer = make_object_storage(tmp_path, s3)
+    writer.put(spool(writer, b'lecture 3'), name)
+    shutil.rmtree(tmp_path / 'cache')
+
+    storage = make_object_storage(tmp_path, s3)
+    with open(storage.local_path(name), 'rb') as f:
+        assert f.read() == b'lecture 3'
+    assert s3.downloads == 1
+    assert [n for n, _ in storage.blobs()] == [name]
+
+
+def test_object_storage_missing_files(tmp_path):
+    storage = make_object_storage(tmp_path, MemoryS3())
+    name = blob_name(b'never stored')
+    assert not storage.exists(name)
+    with pytest.raises(FileNotFoundError):
+        storage.local_path(name)
+
+
+def test_object_storage_cache_is_size_bounded(tmp_path):
+    storage = make_object_storage(tmp_path, MemoryS3(), cache_max_bytes=1500)
+    names = []
+    for i in range(3):
+        content = bytes([i]) * 1000
+        names.append(blob_name(content))
+        storage.put(spool(storage, content), names[-1])
+        os.utime(os.path.join(storage.cache_folder, shard_path(names[-1])), (i, i))
+
+    assert storage.stats()['cacheBytes'] <= 1500
+    # Evicted copies are downloaded again
+    for name in names:
+        assert storage.exists(name)
+        storage.local_path(name)
+
+
+def test_object_storage_delete_removes_object_and_cached_copy(tmp_path):
+    s3 = MemoryS3()
+    storage = make_object_storage(tmp_path, s3)
+    name = blob_name(b'lecture 4')
+    storage.put(spool(storage, b'lecture 4'), name)
+    storage.delete(name)
+    assert s3.objects == {}
+    assert not storage.exists(name)
+    assert storage.stats()['cacheBytes'] == 0
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from modules.summary import chunk_text, map_chunks, CHUNK_MAX_CHARS
+from modules.utils import PAGE_BREAK
+
+WORDS = 'stack queue tree graph kernel thread memory matrix vector signal packet index query'.split()
+
+
+def make_note(pages, seed=3):
+    rng = random.Random(seed)
+    return ('\n' + PAGE_BREAK).join(
+        '\n'.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))) for _ in range(24))
+        for _ in range(pages))
+
+
+@pytest.mark.parametrize('pages', [2, 40, 400])
+def test_map_chunks_never_exceeds_max_chunks(pages):
+    note = make_note(pages)
+    chunks = map_chunks(note, 12)
+    assert 1 <= len(chunks) <= 12
+    assert ''.join(chunks).replace('\n', '') == note.replace(PAGE_BREAK, '').replace('\n', '')
+
+
+def test_short_notes_chunk_as_before():
+    note = make_note(4)
+    assert map_chunks(note, 12) == chunk_text(note)
+    assert all(len(chunk) <= CHUNK_MAX_CHARS for chunk in chunk_text(note))
+
+
+def test_an_edit_keeps_most_chunks_of_a_long_note():
+    note = make_note(400)
+    edited = note.replace(PAGE_BREAK, PAGE_BREAK + 'edited ', 1)
+    before, after = map_chunks(note, 12), map_chunks(edited, 12)
+    assert len(set(before) & set(after)) >= len(before) - 2
@@ -0,0 +1,135 @@
+import datetime
+
+import pytest
+
+from modules import view_stats
+from modules.view_buffer import ViewBuffer
+from modules.view_stats import write_views, PartialWriteError
+from modules.firestore_fake import FakeFirestore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Recorder:
+    def __init__(self, fail=None):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, views):
+        if self.fail is not None:
+            error, self.fail = self.fail, None
+            raise error
+        self.batches.append([view['noteId'] for view in views])
+
+
+def test_repeat_views_within_the_window_are_dropped():
+    clock = FakeClock()
+    buffer = ViewBuffer(Recorder(), dedupe_window=2.0, clock=clock)
+    assert buffer.add('u1', 'n1')
+    assert not buffer.add('u1', 'n1')
+    assert buffer.add('u2', 'n1')
+    clock.now = 2.5
+    assert buffer.add('u1', 'n1')
+    assert buffer.stats()['duplicates'] == 1
+    assert buffer.stats()['depth'] == 3
+
+
+def test_flush_hands_views_over_in_order():
+    recorder = Recorder()
+    buffer = ViewBuffer(recorder, dedupe_window=0)
+    for note_id in ('n1', 'n2', 'n3'):
+        buffer.add('u1', note_id)
+    assert buffer.flush() == 3
+    assert buffer.flush() == 0
+    assert recorder.batches == [['n1', 'n2', 'n3']]
+    assert buffer.stats()['flushed'] == 3
+
+
+def test_failed_flush_is_retried_ahead_of_newer_views():
+    recorder = Recorder(fail=RuntimeError('unavailable'))
+    buffer = ViewBuffer(recorder, dedupe_window=0)
+    buffer.add('u1', 'n1')
+    assert buffer.flush() == 0
+    buffer.add('u1', 'n2')
+    assert buffer.flush() == 2
+    assert recorder.batches == [['n1', 'n2']]
+    assert buffer.stats()['failures'] == 1
+
+
+def test_partial_failure_retries_only_the_unwritten_views():
+    recorder = Recorder(fail=PartialWriteError(2, RuntimeError('unavailable')))
+    buffer = ViewBuffer(recorder, dedupe_window=0)
+    for note_id in ('n1', 'n2', 'n3'):
+        buffer.add('u1', note_id)
+    buffer.flush()
+    assert buffer.stats()['flushed'] == 2
+    buffer.flush()
+    assert recorder.batches == [['n3']]
+
+
+def test_retries_are_capped(monkeypatch):
+    monkeypatch.setattr('modules.view_buffer.MAX_PENDING', 3)
+    buffer = ViewBuffer(Recorder(fail=RuntimeError('unavailable')), dedupe_window=0)
+    for i in range(5):
+        buffer.add('u1', f'n{i}')
+    buffer.flush()
+    assert buffer.stats()['depth'] == 3
+    assert buffer.stats()['dropped'] == 2
+
+
+class FlakyBatches:
+    """Wraps a client so its nth batch commit (0-based) fails once."""
+
+    def __init__(self, db, fail_at):
+        self.db = db
+        self.fail_at = fail_at
+        self.commits = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def batch(self):
+        batch = self.db.batch()
+        commit = batch.commit
+
+        def flaky_commit():
+            self.commits += 1
+            if self.commits - 1 == self.fail_at:
+                raise RuntimeError('deadline exceeded')
+            return commit()
+        batch.commit = flaky_commit
+        return batch
+
+
+def views(count):
+    return [{'userId': 'u1', 'noteId': f'n{i % 3}', 'timestamp': datetime.datetime.now()} for i in range(count)]
+
+
+def test_write_views_retry_does_not_duplicate_committed_batches(monkeypatch):
+    monkeypatch.setattr(view_stats, 'BATCH_LIMIT', 2)
+    fake = FakeFirestore()
+    fake.collection('user_stats').document('u1').set({'views': 0})
+    db = FlakyBatches(fake, fail_at=1)
+    buffer = ViewBuffer(lambda batch: write_views(db, batch), dedupe_window=0)
+    for view in views(5):
+        buffer.add(view['userId'], view['noteId'])
+
+    buffer.flush()
+    assert buffer.stats()['depth'] == 3
+    buffer.flush()
+
+    assert len(list(fake.collection('user_views').stream())) == 5
+    assert fake.collection('user_stats').document('u1').get().to_dict()['views'] == 5
+
+
+def test_first_batch_failure_is_not_partial():
+    db = FlakyBatches(FakeFirestore(), fail_at=0)
+    with pytest.raises(RuntimeError) as error:
+        write_views(db, views(2))
+    assert not isinstance(error.value, PartialWriteError)